@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import re
+import glob
+import json
+import time
+import argparse
+from logging import getLogger
+from typing import Dict, Sequence
+
+# Third-party modules
+import numpy as np
+import pandas as pd
+
+# Project modules
+from storage import CAPTURE_FILE, META_FILE, open_capture, read_chunks
+
+__all__ = [
+    "ALIGN_COLUMNS",
+    "align",
+    "first_arrival_share",
+    "lead_lag",
+    "lead_share",
+    "load_samples",
+    "pairwise_tests",
+    "summary"
+]
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# Columns comparable across connections update by update. Corrected delays are not: the clock offset subtracted from
+# every sample is the running minimum at its receipt, so copies of one update are corrected by different offsets.
+ALIGN_COLUMNS = ("delay", "client_ms")
+
+
+def _from_frames(frames: Dict[int, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Long samples of per-connection DataFrames, both of the current and of the historical pickle layouts.
+    """
+    columns = list()
+    for conn_id, df in frames.items():
+        client_ms = df["client_timestamps"] if "client_timestamps" in df else df["client_timestamp"]
+        columns.append(pd.DataFrame({
+            "conn_id": np.full(len(df), conn_id, dtype=np.int64),
+            "update_id": df["update_id"].to_numpy(dtype=np.int64),
+            "client_ms": client_ms.to_numpy(dtype=np.float64),
+            "delay": df["delay"].to_numpy(dtype=np.float64),
+            "corrected_delay": df["corrected_delay" if "corrected_delay" in df else "delay"].to_numpy(dtype=np.float64)
+        }))
+    if not columns:
+        return pd.DataFrame(columns=["conn_id", "update_id", "client_ms", "delay", "corrected_delay"])
+    return pd.concat(columns, ignore_index=True)
+
+
+def _from_records(records: np.ndarray) -> pd.DataFrame:
+    client_time_ns = records["client_time_ns"]
+    delay = (client_time_ns - records["event_time"] * 1_000_000) / 1e6
+    corrected_delay = delay
+    if "offset_ns" in records.dtype.names:
+        origin_ms = np.where(records["transaction_time"] > 0, records["transaction_time"], records["event_time"])
+        corrected_delay = (client_time_ns - origin_ms * 1_000_000 - records["offset_ns"]) / 1e6
+    return pd.DataFrame({
+        "conn_id": records["conn_id"].astype(np.int64),
+        "update_id": records["update_id"].astype(np.int64),
+        "client_ms": client_time_ns / 1e6,
+        "delay": delay,
+        "corrected_delay": corrected_delay
+    })
+
+
+def load_samples(path: str) -> pd.DataFrame:
+    """
+    Load a whole capture in one pass: a capture file, or a directory with a capture file, streamed chunks or pickled
+    connections.
+
+    :param path: capture file or directory
+    :type path: str
+    :return pd.DataFrame: long samples with columns ``conn_id``, ``update_id``, ``client_ms``, ``delay`` and
+        ``corrected_delay``, times in milliseconds
+    """
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, CAPTURE_FILE)):
+            path = os.path.join(path, CAPTURE_FILE)
+        elif os.path.exists(os.path.join(path, META_FILE)):
+            return _from_frames(dict(enumerate(read_chunks(path))))
+        else:
+            pickles = dict()
+            for pth in glob.glob(os.path.join(path, "connection_*.pkl")):
+                pickles[int(re.search(r"connection_(\d+)\.pkl$", pth).group(1))] = pth
+            return _from_frames({conn_id: pd.read_pickle(pickles[conn_id]) for conn_id in sorted(pickles)})
+    return _from_records(np.asarray(open_capture(path)))
+
+
+def summary(samples: pd.DataFrame, column: str = "delay", quantiles: Sequence[float] = QUANTILES) -> pd.DataFrame:
+    """
+    :param samples: long samples, see ``load_samples``
+    :type samples: pd.DataFrame
+    :param column: delay column to describe
+    :type column: str
+    :param quantiles: quantiles to compute
+    :type quantiles: Sequence[float]
+    :return pd.DataFrame: count, mean, std, min, quantiles and max of every connection
+    """
+    return samples.groupby("conn_id")[column].describe(percentiles=list(quantiles))
+
+
+def align(samples: pd.DataFrame, column: str = "delay") -> pd.DataFrame:
+    """
+    Align all connections on ``update_id`` with a single pivot. Delays of the same update differ across connections
+    only by their receive times, so they order the arrivals exactly like client timestamps do.
+
+    :param samples: long samples, see ``load_samples``
+    :type samples: pd.DataFrame
+    :param column: value of every connection, one of ``ALIGN_COLUMNS``
+    :type column: str
+    :return pd.DataFrame: one row per update id, one column per connection, NaN where a connection missed the update
+    """
+    if column not in ALIGN_COLUMNS:
+        raise ValueError(f"Connections can only be aligned on {', '.join(ALIGN_COLUMNS)}, got {column}!")
+    aligned = samples.drop_duplicates(["conn_id", "update_id"]).pivot(index="update_id", columns="conn_id",
+                                                                     values=column)
+    aligned.attrs["column"] = column
+    return aligned
+
+
+def _check_aligned(aligned: pd.DataFrame) -> None:
+    column = aligned.attrs.get("column", "delay")
+    if column not in ALIGN_COLUMNS:
+        raise ValueError(f"Arrivals can only be compared on {', '.join(ALIGN_COLUMNS)}, got {column}!")
+
+
+def first_arrival_share(aligned: pd.DataFrame, complete: bool = True) -> pd.Series:
+    """
+    :param aligned: aligned delays, see ``align``
+    :type aligned: pd.DataFrame
+    :param complete: only count updates received by all connections, as an inner join on ``update_id`` does
+    :type complete: bool
+    :return pd.Series: fraction of the updates each connection received first
+    """
+    _check_aligned(aligned)
+    values = aligned.to_numpy(dtype=np.float64)
+    missing = np.isnan(values)
+    values = values[~missing.any(axis=1)] if complete else np.where(missing, np.inf, values)[~missing.all(axis=1)]
+    counts = np.bincount(values.argmin(axis=1), minlength=values.shape[1]) if len(values) else \
+        np.zeros(values.shape[1], dtype=np.int64)
+    return pd.Series(counts / max(counts.sum(), 1), index=aligned.columns, name="share")
+
+
+def lead_lag(aligned: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mean lead/lag of every pair of connections over their common updates, in two matrix products.
+
+    :param aligned: aligned delays, see ``align``
+    :type aligned: pd.DataFrame
+    :return pd.DataFrame: entry ``[i, j]`` is the mean of ``delay_i - delay_j``, negative when ``i`` leads ``j``
+    """
+    _check_aligned(aligned)
+    values = aligned.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    mask = present.astype(np.float64)
+    # sums[i, j]: sum of the delays of i over the updates received by both i and j.
+    sums = np.where(present, values, 0.0).T @ mask
+    counts = mask.T @ mask
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = (sums - sums.T) / counts
+    return pd.DataFrame(matrix, index=aligned.columns, columns=aligned.columns)
+
+
+def lead_share(aligned: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param aligned: aligned delays, see ``align``
+    :type aligned: pd.DataFrame
+    :return pd.DataFrame: entry ``[i, j]`` is the fraction of the common updates of ``i`` and ``j`` that ``i``
+        received strictly earlier
+    """
+    _check_aligned(aligned)
+    values = aligned.to_numpy(dtype=np.float64)
+    mask = (~np.isnan(values)).astype(np.float64)
+    counts = mask.T @ mask
+    # NaN never compares lower, so only common updates are counted; one vectorized row of the matrix per connection.
+    leads = np.stack([(values[:, [i]] < values).sum(axis=0) for i in range(values.shape[1])]) \
+        if values.shape[1] else np.zeros((0, 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = leads / counts
+    return pd.DataFrame(matrix, index=aligned.columns, columns=aligned.columns)
+
+
+def pairwise_tests(samples: pd.DataFrame, column: str = "delay", bins: int = 10) -> pd.DataFrame:
+    """
+    Compare the delay distributions of every pair of connections with Kolmogorov-Smirnov, Mann-Whitney U and
+    chi-squared tests. Samples are sorted once and shifted into disjoint bands of one array, so the ranks needed by
+    the tests of a connection against all the following ones come from a single binary search. P-values of all pairs
+    are computed at once from the asymptotic distributions, without tie correction.
+
+    :param samples: long samples, see ``load_samples``
+    :type samples: pd.DataFrame
+    :param column: delay column to compare
+    :type column: str
+    :param bins: number of quantile bins of the first connection of a pair in the chi-squared test
+    :type bins: int
+    :return pd.DataFrame: statistics and p-values of every pair ``conn_a < conn_b``
+    """
+    # Local import, scipy is only needed by the tests and not by the rest of the analysis.
+    try:
+        from scipy.stats import chi2, kstwobign, norm
+    except ImportError as e:
+        raise ImportError("Pairwise tests require scipy, install it with pip install scipy or skip them with "
+                          "--no_tests!") from e
+    ordered = samples.dropna(subset=[column]).sort_values(["conn_id", column])
+    conn_ids, sizes = np.unique(ordered["conn_id"].to_numpy(), return_counts=True)
+    values = ordered[column].to_numpy(dtype=np.float64)
+    starts = np.r_[0, np.cumsum(sizes)]
+    num_conn = len(conn_ids)
+    if num_conn < 2:
+        return pd.DataFrame(columns=["conn_a", "conn_b", "ks_stat", "ks_p", "mwu_stat", "mwu_p", "chi2_stat",
+                                     "chi2_p"])
+
+    # Band j holds the sorted samples of connection j shifted by j * width, so bands never overlap.
+    lowest = values.min()
+    width = 2.0 * (values.max() - lowest) + 1.0
+    shifts = np.arange(num_conn) * width
+    bands = values - lowest + np.repeat(shifts, sizes)
+    # Empirical CDF of every sample within its own connection, and the first index of every run of equal samples.
+    positions = np.arange(len(bands))
+    run_start = np.maximum.accumulate(np.where(np.r_[True, bands[1:] != bands[:-1]], positions, 0))
+    own_cdf = (np.searchsorted(bands, bands, side="right") - np.repeat(starts[:-1], sizes)) / np.repeat(sizes, sizes)
+
+    blocks = list()
+    for i in range(num_conn - 1):
+        a = values[starts[i]:starts[i + 1]]
+        others = np.arange(i + 1, num_conn)
+        n_a, n_b = sizes[i], sizes[others]
+        queries = (a - lowest)[None, :] + shifts[others, None]
+        right = np.searchsorted(bands, queries, side="right")
+        tied = bands[right - 1] == queries
+        left = np.where(tied, run_start[right - 1], right)
+        right -= starts[others, None]
+        left -= starts[others, None]
+        mwu_stat = left.sum(axis=1) + 0.5 * (right - left).sum(axis=1)
+
+        # The KS distance is reached at a sample of either connection. A sample k of b has a_m <= b_k exactly when
+        # k >= left_m, so counting the lefts gives the CDF of a at all samples of b without another search.
+        at_a = np.abs(own_cdf[starts[i]:starts[i + 1]][None, :] - right / n_b[:, None]).max(axis=1)
+        tail = slice(starts[i + 1], starts[-1])
+        below = left < n_b[:, None]
+        count_a = np.cumsum(np.bincount((left + starts[others, None])[below] - starts[i + 1],
+                                        minlength=starts[-1] - starts[i + 1]))
+        count_a -= np.repeat(np.r_[0, count_a[starts[i + 2:-1] - starts[i + 1] - 1]], n_b)
+        diff_b = np.abs(count_a / n_a - own_cdf[tail])
+        at_b = np.maximum.reduceat(diff_b, starts[i + 1:-1] - starts[i + 1])
+        ks_stat = np.maximum(at_a, at_b)
+
+        # Expected counts of the other connections in the quantile bins of a, as in the notebook.
+        edges = np.unique(np.quantile(a, np.linspace(0, 1, bins + 1))) - lowest
+        share_a = np.diff(np.r_[np.searchsorted(a - lowest, edges[0], side="left"),
+                                np.searchsorted(a - lowest, edges[1:], side="right")]) / n_a
+        edge_queries = edges[None, :] + shifts[others, None]
+        cumulative = np.searchsorted(bands, edge_queries, side="right")
+        cumulative[:, 0] = np.searchsorted(bands, edge_queries[:, 0], side="left")
+        observed = np.diff(cumulative, axis=1)
+        expected = share_a[None, :] * observed.sum(axis=1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            chi2_stat = np.where(expected > 0, (observed - expected) ** 2 / expected, 0.0).sum(axis=1)
+        dof = np.count_nonzero(share_a) - 1
+
+        blocks.append(pd.DataFrame({"conn_a": conn_ids[i], "conn_b": conn_ids[others], "n_a": n_a, "n_b": n_b,
+                                    "ks_stat": ks_stat, "mwu_stat": mwu_stat, "chi2_stat": chi2_stat, "dof": dof}))
+
+    tests = pd.concat(blocks, ignore_index=True)
+    n_a, n_b = tests["n_a"].to_numpy(dtype=np.float64), tests["n_b"].to_numpy(dtype=np.float64)
+    tests["ks_p"] = kstwobign.sf(tests["ks_stat"].to_numpy() * np.sqrt(n_a * n_b / (n_a + n_b)))
+    tests["mwu_p"] = 2 * norm.sf(np.abs(tests["mwu_stat"].to_numpy() - n_a * n_b / 2) /
+                                 np.sqrt(n_a * n_b * (n_a + n_b + 1) / 12))
+    dof = tests["dof"].to_numpy()
+    tests["chi2_p"] = np.where(dof > 0, chi2.sf(tests["chi2_stat"].to_numpy(), np.maximum(dof, 1)), np.nan)
+    return tests[["conn_a", "conn_b", "ks_stat", "ks_p", "mwu_stat", "mwu_p", "chi2_stat", "chi2_p"]]
+
+
+def _matrix_json(matrix: pd.DataFrame) -> Dict:
+    return {"conn_ids": [int(conn_id) for conn_id in matrix.columns],
+            "values": np.where(np.isnan(matrix.to_numpy()), None, matrix.to_numpy()).tolist()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency analysis of a capture: summary quantiles, first-arrival "
+                                                 "share, lead/lag matrices and pairwise distribution tests.",
+                                     usage="python analysis.py path [options]")
+    parser.add_argument("path", type=str, help="Capture file, or directory with a capture file, chunks or pickles.")
+    parser.add_argument("-c", "--column", type=str, default="delay", choices=["delay", "corrected_delay"],
+                        help="Delay column of the summary and the pairwise tests, arrivals are always "
+                             "compared on delay. Default delay.")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="JSON file to write the report to. Default path/analysis.json for directories.")
+    parser.add_argument("--no_tests", action="store_true", help="Skip the pairwise distribution tests.")
+    cli_args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = load_samples(cli_args.path)
+    # Arrivals are compared on raw delays, see ALIGN_COLUMNS.
+    aligned_delays = align(data)
+    report = {
+        "path": cli_args.path,
+        "connections": int(data["conn_id"].nunique()),
+        "samples": len(data),
+        "updates": len(aligned_delays),
+        "summary": json.loads(summary(data, cli_args.column).to_json(orient="index")),
+        "first_arrival_share": {int(conn_id): share for conn_id, share in first_arrival_share(aligned_delays).items()},
+        "lead_lag_ms": _matrix_json(lead_lag(aligned_delays)),
+        "lead_share": _matrix_json(lead_share(aligned_delays))
+    }
+    if not cli_args.no_tests:
+        report["pairwise_tests"] = pairwise_tests(data, cli_args.column).to_dict(orient="records")
+    report["elapsed_s"] = time.perf_counter() - start
+
+    output = cli_args.output or os.path.join(cli_args.path if os.path.isdir(cli_args.path) else
+                                             os.path.dirname(cli_args.path), "analysis.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=float)
+    print(summary(data, cli_args.column).to_string())
+    print(first_arrival_share(aligned_delays).to_string())
+    getLogger(f"{__name__}.main").info(f"Analysed {report['samples']} samples of {report['connections']} connections "
+                                       f"in {report['elapsed_s']:.2f} s")
+    print(f"Analysis report had been saved at {output}")
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import sys
+import json
+import functools
+import math
+import time
+import asyncio
+import argparse
+import random
+import platform
+import resource
+import multiprocessing as mp
+from logging import getLogger
+from typing import Dict, List, Sequence
+
+# Project modules
+from binance_logger import init_logger
+from recorder import SampleRecorder
+
+__all__ = [
+    "bench_orderbook",
+    "percentile",
+    "run_case",
+    "run_suite"
+]
+
+METHODS = ("MWMT", "MWST", "SWST", "MWMP", "MWMT_BATCH")
+# Stages of the frames from socket receipt to recording, see stages.STAGES, reported with their total stages.HANDLING.
+HANDLING_STAGES = ("queue", "decode", "record")
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+
+    :param sorted_values: sorted sample
+    :type sorted_values: Sequence[float]
+    :param q: percentile in [0, 100]
+    :type q: float
+    :return float: percentile value, NaN for an empty sample
+    """
+    if not sorted_values:
+        return float("nan")
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def _serve(port: int, rate: float, ready) -> None:
+    # Local import, the server runs in its own process so that its CPU time is not charged to the runner.
+    from mock_server import MockFuturesServer
+
+    async def serve():
+        server = MockFuturesServer(port=port, rate=rate, seed=0)
+        await server.start()
+        ready.put(server.port)
+        await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def _measure(method: str, url: str, ticker: str, conn_num: int, duration: float, results) -> None:
+    from runner import run_MWMT, run_MWST, run_SWST, run_MWMP
+    from stages import HANDLING, LatencyBreakdown
+
+    runners = {"MWMT": run_MWMT, "MWST": run_MWST, "SWST": run_SWST, "MWMP": run_MWMP,
+               "MWMT_BATCH": functools.partial(run_MWMT, batch_size=256)}
+    # Receive to record time of every frame, by stage. The delay since the event time of the mock server would measure
+    # its pacing and clock instead of the handling cost of the method.
+    breakdown = LatencyBreakdown(conn_num)
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    columns = dict(zip(SampleRecorder.FIELDS, runners[method](ticker, duration, conn_num, url=url, stages=breakdown)))
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    # The runners end the stages with the collected samples, so their counts match the messages.
+    stages = breakdown.summary()["stages"]
+    messages = sum(len(update_ids) for update_ids in columns["update_id"])
+    # MWMP workers are joined by the runner, so their CPU time and peak memory are reported with the children.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    child_cpu = (children.ru_utime + children.ru_stime) - (children_start.ru_utime + children_start.ru_stime)
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({
+        "messages": messages,
+        "messages_per_sec": messages / wall if wall else 0.0,
+        "handling_us": {stage: {key: stages[stage][key] for key in ("count", "p50_us", "p99_us", "p999_us", "max_us")}
+                        for stage in HANDLING_STAGES + (HANDLING,)},
+        "cpu_us_per_message": (cpu + child_cpu) / messages * 1e6 if messages else float("nan"),
+        "child_cpu_us_per_message": child_cpu / messages * 1e6 if messages else float("nan"),
+        "max_rss_kb": rss_self,
+        "max_child_rss_kb": children.ru_maxrss
+    })
+    # Threaded websockets of MWMT never return, the parent terminates this process once results are read.
+
+
+def run_case(method: str, conn_num: int, rate: float, duration: float, ticker: str = "btcusdt",
+             port: int = 0) -> Dict:
+    """
+    Benchmark one connection method against a fresh local mock server, both in their own processes.
+
+    :param method: connection method, one of MWMT, MWST, SWST, MWMP, MWMT_BATCH [MWMT with batched decoding]
+    :type method: str
+    :param conn_num: number of connections
+    :type conn_num: int
+    :param rate: events per second generated by the mock server per stream
+    :type rate: float
+    :param duration: capture duration in seconds
+    :type duration: float
+    :param ticker: future's ticker
+    :type ticker: str
+    :param port: mock server port, 0 picks a free one
+    :type port: int
+    :return Dict: parameters and measurements of the case
+    """
+    ctx = mp.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    server = ctx.Process(target=_serve, args=(port, rate, ready), daemon=True)
+    server.start()
+    url = f"ws://127.0.0.1:{ready.get()}/ws"
+    # Not a daemon, MWMP spawns its own worker processes; it is terminated below in any case.
+    worker = ctx.Process(target=_measure, args=(method, url, ticker, conn_num, duration, results))
+    worker.start()
+    try:
+        measurements = results.get(timeout=duration + 60)
+    finally:
+        for proc in (worker, server):
+            proc.terminate()
+            proc.join()
+    case = {"method": method, "conn_num": conn_num, "rate": rate, "duration": duration}
+    case.update(measurements)
+    getLogger(f"{__name__}.run_case").info(f"Benchmark case finished: {json.dumps(case)}")
+    return case
+
+
+def bench_orderbook(num_updates: int = 200000, num_levels: int = 1000, levels_per_update: int = 10,
+                    seed: int = 0) -> Dict:
+    """
+    Benchmark the local order book alone: synthetic depth diffs around a random walk of the mid price, a tenth of the
+    level updates removing levels.
+
+    :param num_updates: number of depth events applied
+    :type num_updates: int
+    :param num_levels: width in ticks of the price range of each side
+    :type num_levels: int
+    :param levels_per_update: level updates per side of each event
+    :type levels_per_update: int
+    :param seed: seed of the generator
+    :type seed: int
+    :return Dict: parameters, throughput and final book size
+    """
+    from orderbook import LocalOrderBook
+
+    rng = random.Random(seed)
+    book = LocalOrderBook("BENCH")
+    book.load_snapshot({"lastUpdateId": 0, "bids": [], "asks": []})
+    events, mid = list(), 30000.0
+    for update_id in range(1, num_updates + 1):
+        mid += rng.choice((-0.1, 0.0, 0.1))
+        bids = [[f"{mid - 0.1 * rng.randint(1, num_levels):.1f}", "0" if rng.random() < 0.1 else
+                 f"{rng.uniform(0.001, 5):.3f}"] for _ in range(levels_per_update)]
+        asks = [[f"{mid + 0.1 * rng.randint(1, num_levels):.1f}", "0" if rng.random() < 0.1 else
+                 f"{rng.uniform(0.001, 5):.3f}"] for _ in range(levels_per_update)]
+        events.append({"E": 0, "U": update_id, "u": update_id, "pu": update_id - 1, "b": bids, "a": asks})
+    start = time.perf_counter()
+    for event in events:
+        book.on_event(0, event, 0)
+    elapsed = time.perf_counter() - start
+    return {
+        "num_updates": num_updates,
+        "num_levels": num_levels,
+        "levels_per_update": levels_per_update,
+        "updates_per_sec": num_updates / elapsed if elapsed else float("nan"),
+        "levels_per_sec": 2 * num_updates * levels_per_update / elapsed if elapsed else float("nan"),
+        "bid_levels": len(book.book.bids),
+        "ask_levels": len(book.book.asks)
+    }
+
+
+def run_suite(methods: Sequence[str], conn_nums: Sequence[int], rates: Sequence[float],
+              duration: float) -> Dict:
+    """
+    Benchmark every combination of methods, connection counts and message rates.
+
+    :return Dict: environment description and the list of case results
+    """
+    cases: List[Dict] = list()
+    for method in methods:
+        for conn_num in conn_nums:
+            for rate in rates:
+                cases.append(run_case(method, conn_num, rate, duration))
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cases": cases
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MWMT / MWST / SWST connection methods against the local "
+                                                 "mock server.",
+                                     usage="python bench.py [options]")
+    parser.add_argument("-m", "--methods", type=str, default=",".join(METHODS),
+                        help="Comma separated methods to benchmark. Default all of " + ",".join(METHODS) + ".")
+    parser.add_argument("-n", "--conn_nums", type=str, default="1,5,50,200",
+                        help="Comma separated connection counts. Default 1,5,50,200.")
+    parser.add_argument("-r", "--rates", type=str, default="100,1000",
+                        help="Comma separated events per second of the mock feed. Default 100,1000.")
+    parser.add_argument("-t", "--duration", type=float, default=10.0,
+                        help="Capture duration in seconds of each case. Default 10.")
+    parser.add_argument("-o", "--output", type=str, default="bench.json",
+                        help="JSON file to write the results to. Default bench.json.")
+    parser.add_argument("-b", "--book_updates", type=int, default=0,
+                        help="Number of depth events of the order book benchmark. Default 0, disabled.")
+    cli_args = parser.parse_args()
+
+    init_logger()
+    report = run_suite([method for method in cli_args.methods.split(",") if method in METHODS],
+                       [int(conn_num) for conn_num in cli_args.conn_nums.split(",")],
+                       [float(rate) for rate in cli_args.rates.split(",")], cli_args.duration)
+    if cli_args.book_updates:
+        report["orderbook"] = bench_orderbook(cli_args.book_updates)
+    with open(cli_args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results of {len(report['cases'])} cases had been saved at {cli_args.output}")
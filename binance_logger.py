@@ -1,18 +1,33 @@
 # -*- coding: utf-8 -*-
 
 # Standard modules
+import os
 import json
+import time
+import queue
+import atexit
+import threading
 import logging
-from logging import getLogger, FileHandler, Formatter, StreamHandler, Logger
+from logging import getLogger, FileHandler, Filter, Formatter, StreamHandler, Logger, LogRecord
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Tuple
 
 # Project modules
-from constants import ProjectConstants
+from settings import Settings
 
 __all__ = [
+    "BufferedRotatingFileHandler",
     "JsonFormatter",
-    "init_logger"
+    "RateLimitFilter",
+    "init_logger",
+    "init_worker_logger",
+    "stop_logger",
+    "worker_log_listener"
 ]
 
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
 
 class JsonFormatter(Formatter):
     """
@@ -68,20 +83,189 @@ class JsonFormatter(Formatter):
         return json.dumps(message_dict, default=str)
 
 
-def init_logger(log_file_path: str = ProjectConstants.LOG_FILE) -> Logger:
+class RateLimitFilter(Filter):
+    """
+    Lets through at most ``burst`` records per ``interval`` seconds from each call site, e.g. the open and close
+    messages of hundreds of sockets. The count of suppressed records is appended to the next record let through.
+    Records of ``max_level`` and above are never suppressed. The filter is attached to the queue handler, so it runs
+    in every logging thread and its counters are updated under a lock.
+    """
+
+    def __init__(self, burst: int = 10, interval: float = 1.0, max_level: int = logging.ERROR):
+        """
+        :param burst: records let through per call site and interval
+        :type burst: int
+        :param interval: length of the interval in seconds
+        :type interval: float
+        :param max_level: level from which records are always let through
+        :type max_level: int
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        # Call site: start of its current interval, records let through and suppressed since then.
+        self._sites: Dict[Tuple[str, int], list] = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno >= self.max_level:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get((record.pathname, record.lineno))
+            if site is None:
+                self._sites[(record.pathname, record.lineno)] = [now, 1, 0]
+                return True
+            if now - site[0] >= self.interval:
+                suppressed = site[2]
+                site[:] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    Size rotated log file written through a large buffer, flushed at most once per ``flush_interval`` seconds or on
+    errors instead of after every record. The file size in bytes is tracked while writing, since asking the stream for
+    its position would flush the buffer.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 buffer_size: int = 1 << 16, flush_interval: float = 1.0):
+        """
+        :param filename: log file
+        :type filename: str
+        :param max_bytes: size in bytes from which the file is rotated, 0 to never rotate
+        :type max_bytes: int
+        :param backup_count: number of rotated files kept
+        :type backup_count: int
+        :param buffer_size: size in bytes of the write buffer
+        :type buffer_size: int
+        :param flush_interval: maximal time in seconds a record stays in the buffer while records keep coming
+        :type flush_interval: float
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._size = 0
+        self._last_flush = time.monotonic()
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, encoding=self.encoding, buffering=self.buffer_size)
+        self._size = os.path.getsize(self.baseFilename)
+        return stream
+
+    def emit(self, record: LogRecord) -> None:
+        try:
+            msg = self.format(record) + self.terminator
+            # Sizes are in bytes of the file, which only ASCII messages have as many as characters.
+            size = len(msg) if msg.isascii() else len(msg.encode(self.encoding or "utf-8"))
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes and self._size and self._size + size > self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(msg)
+            self._size += size
+            now = time.monotonic()
+            if record.levelno >= logging.ERROR or now - self._last_flush >= self.flush_interval:
+                self.stream.flush()
+                self._last_flush = now
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _EnqueueHandler(QueueHandler):
+    """
+    Queue handler doing as little as possible in the logging thread: formatting is left to the listener thread, and
+    records stay in the process, so they are not copied.
+    """
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # Resolve the arguments now, they could change before the listener formats the record.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _FlushingQueueListener(QueueListener):
+    """
+    Queue listener which flushes its buffered handlers whenever no record comes for ``flush_interval`` seconds, so
+    the end of a quiet period reaches the log file.
+    """
+
+    def __init__(self, records: queue.SimpleQueue, *handlers, flush_interval: float = 1.0,
+                 respect_handler_level: bool = False):
+        super().__init__(records, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block: bool) -> LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+
+def stop_logger() -> None:
+    """
+    Detach the queue handler of ``init_logger(queued=True)`` from the root logger, then stop its background writer
+    once all enqueued records are written.
+    """
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def init_logger(log_file_path: str = Settings.log_file, queued: bool = True,
+                max_bytes: int = Settings.log_max_bytes, backup_count: int = Settings.log_backup_count,
+                rate_limit: Optional[RateLimitFilter] = None, verbose: int = Settings.verbose) -> Logger:
     """
-    Initialize logger.
+    Initialize logger. In queued mode logging threads only put records on a queue, while a background
+    ``QueueListener`` thread formats them and writes the console and a buffered, size rotated log file, so logging
+    never blocks the receive path on formatting or file I/O.
 
     :param log_file_path: Loging file.
+    :param queued: format and write records on a background thread
+    :type queued: bool
+    :param max_bytes: size in bytes from which the log file is rotated in queued mode, 0 to never rotate
+    :type max_bytes: int
+    :param backup_count: number of rotated log files kept in queued mode
+    :type backup_count: int
+    :param rate_limit: filter of repetitive records in queued mode, defaults to ``RateLimitFilter()``
+    :type rate_limit: Optional[RateLimitFilter]
+    :param verbose: verbosity from 0 [errors only] to 3
+    :type verbose: int
     :return logging.Logger: Logger object
     """
-    if ProjectConstants.VERBOSE == 3:
+    global _listener, _queue_handler
+    if verbose == 3:
         logging.getLogger().setLevel(logging.INFO)
-    elif ProjectConstants.VERBOSE == 2:
+    elif verbose == 2:
         logging.getLogger().setLevel(logging.DEBUG)
-    elif ProjectConstants.VERBOSE == 1:
+    elif verbose == 1:
         logging.getLogger().setLevel(logging.WARNING)
-    elif ProjectConstants.VERBOSE == 0:
+    elif verbose == 0:
         logging.getLogger().setLevel(logging.ERROR)
 
     logger = getLogger()
@@ -106,8 +290,64 @@ def init_logger(log_file_path: str = ProjectConstants.LOG_FILE) -> Logger:
 
     console_handler = StreamHandler()
     console_handler.setFormatter(console_formatter)
-    file_handler = FileHandler(log_file_path)
+    # A previous queued initialization would otherwise keep enqueueing every record for a stopped writer.
+    stop_logger()
+    if not queued:
+        file_handler = FileHandler(log_file_path)
+        file_handler.setFormatter(json_formatter)
+        logger.addHandler(console_handler)
+        logger.addHandler(file_handler)
+        return logger
+
+    file_handler = BufferedRotatingFileHandler(log_file_path, max_bytes, backup_count)
     file_handler.setFormatter(json_formatter)
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    records = queue.SimpleQueue()
+    _queue_handler = _EnqueueHandler(records)
+    _queue_handler.addFilter(rate_limit if rate_limit is not None else RateLimitFilter())
+    logger.addHandler(_queue_handler)
+    _listener = _FlushingQueueListener(records, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.unregister(stop_logger)
+    atexit.register(stop_logger)
+    return logger
+
+
+class _ForwardHandler(logging.Handler):
+    """
+    Hands records received from worker processes to the loggers of this process, with their handlers and filters.
+    """
+
+    def handle(self, record: LogRecord) -> bool:
+        getLogger(record.name).handle(record)
+        return True
+
+
+def init_worker_logger(records, level: int = logging.INFO) -> Logger:
+    """
+    Initialize the logger of a spawned worker process: its records are sent to the parent process, which writes them
+    with its own handlers, see ``worker_log_listener``. Workers never write the rotated log file themselves.
+
+    :param records: ``multiprocessing`` queue shared with the parent
+    :param level: level of the root logger of the worker
+    :type level: int
+    :return logging.Logger: Logger object
+    """
+    logger = getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(records))
+    logger.setLevel(level)
     return logger
+
+
+def worker_log_listener(records) -> QueueListener:
+    """
+    Start writing the records of worker processes initialized by ``init_worker_logger``. Stop the listener once the
+    workers have exited.
+
+    :param records: ``multiprocessing`` queue shared with the workers
+    :return QueueListener: started listener
+    """
+    listener = QueueListener(records, _ForwardHandler())
+    listener.start()
+    return listener
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import time
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+__all__ = [
+    "ClockOffsetEstimator",
+    "OffsetChannel",
+    "get_anchor",
+    "now_ns",
+    "set_anchor",
+    "shared_estimator"
+]
+
+# Offset of the wall clock against the monotonic clock, taken once at startup. Timestamps are monotonic and have
+# nanosecond resolution, but stay comparable with exchange event times, and NTP steps during a capture do not
+# corrupt the delays.
+_anchor_ns = time.time_ns() - time.perf_counter_ns()
+
+
+def now_ns() -> int:
+    """
+    :return int: current time in nanoseconds since the epoch, monotonic and anchored to wall time at startup
+    """
+    return time.perf_counter_ns() + _anchor_ns
+
+
+def get_anchor() -> int:
+    """
+    :return int: wall clock anchor of ``now_ns``, to be shared with worker processes
+    """
+    return _anchor_ns
+
+
+def set_anchor(anchor_ns: int) -> None:
+    """
+    Use the anchor of another process, so that timestamps of worker processes are directly comparable.
+    ``perf_counter`` is a system-wide monotonic clock on Linux, hence the same anchor yields the same timeline.
+
+    :param anchor_ns: anchor returned by ``get_anchor``
+    :type anchor_ns: int
+    """
+    global _anchor_ns
+    _anchor_ns = anchor_ns
+
+
+class OffsetChannel:
+    """
+    Samples of one connection, or of any other single thread, for a ``ClockOffsetEstimator``. The channel keeps the
+    lower envelope of its own samples over the sliding window in a monotonic deque, so an update is O(1) amortized and
+    takes no lock: only its own thread touches the deque, and the window minimum is published to the estimator with a
+    single store.
+    """
+
+    def __init__(self, estimator: "ClockOffsetEstimator", idx: int):
+        """
+        :param estimator: estimator combining the channels
+        :type estimator: ClockOffsetEstimator
+        :param idx: slot of the channel in the estimator
+        :type idx: int
+        """
+        self.estimator = estimator
+        self.idx = idx
+        self._window = deque()
+
+    def update(self, recv_ns: int, event_time_ms: int, transaction_time_ms: int = 0) -> int:
+        """
+        Add a sample.
+
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :param event_time_ms: exchange event time in milliseconds
+        :type event_time_ms: int
+        :param transaction_time_ms: exchange transaction time in milliseconds, 0 if the stream has none
+        :type transaction_time_ms: int
+        :return int: current offset estimate of all channels in nanoseconds
+        """
+        sample = recv_ns - (transaction_time_ms or event_time_ms) * 1_000_000
+        estimator = self.estimator
+        window = self._window
+        while window and window[-1][1] >= sample:
+            window.pop()
+        window.append((recv_ns, sample))
+        horizon = recv_ns - estimator.window_ns
+        while window[0][0] < horizon:
+            window.popleft()
+        front = window[0]
+        estimator._minima[self.idx] = front
+        if front[1] < estimator._min or recv_ns >= estimator._next_combine:
+            estimator.combine(recv_ns)
+        return estimator.offset_ns
+
+
+class ClockOffsetEstimator:
+    """
+    Running estimate of the offset of the local clock against the exchange clock. Every message gives a sample
+    ``receive time - origin time``, which is the one-way latency plus the clock offset; the origin is the transaction
+    time ``T`` of the update when the stream has one, else its event time ``E``. The lower envelope of the samples over
+    a sliding window strips the queueing noise, and minus the minimal one-way latency it estimates the offset.
+
+    The offset is a property of the local clock, not of a connection: all connections of a run must share one
+    estimator (see ``shared_estimator``), otherwise each connection's own best latency is subtracted from its samples
+    and the differences between connections disappear from the corrected delays. Each connection feeds it through its
+    own ``OffsetChannel``, so receive threads never contend on a lock; the window minima of the channels are combined
+    when a channel sees a new lowest sample, and at least every ``combine_interval_ns`` otherwise.
+    """
+
+    def __init__(self, window_ns: int = 60_000_000_000, min_latency_ns: int = 0,
+                 combine_interval_ns: int = 100_000_000):
+        """
+        :param window_ns: length of the sliding window in nanoseconds
+        :type window_ns: int
+        :param min_latency_ns: assumed minimal one-way latency to the exchange in nanoseconds, e.g. half of a
+            measured round trip; with 0 the corrected delay is the latency above the best observed one
+        :type min_latency_ns: int
+        :param combine_interval_ns: maximal age in nanoseconds of the combined offset while samples keep coming, the
+            time it takes to forget an expired minimum
+        :type combine_interval_ns: int
+        """
+        self.window_ns = window_ns
+        self.min_latency_ns = min_latency_ns
+        self.combine_interval_ns = combine_interval_ns
+        self.offset_ns = 0
+        # Window minimum (receive time, sample) of every channel, each slot written by its own channel only.
+        self._minima: List[Optional[Tuple[int, int]]] = list()
+        self._min = float("inf")
+        self._next_combine = 0
+        self._channel: Optional[OffsetChannel] = None
+        self._lock = threading.Lock()
+
+    def channel(self) -> OffsetChannel:
+        """
+        :return OffsetChannel: new channel, to be updated by a single thread
+        """
+        with self._lock:
+            self._minima.append(None)
+            return OffsetChannel(self, len(self._minima) - 1)
+
+    def combine(self, now: int) -> int:
+        """
+        Combine the window minima of all channels. Channels which received nothing during the window are skipped.
+
+        :param now: current time in nanoseconds
+        :type now: int
+        :return int: offset estimate in nanoseconds
+        """
+        horizon = now - self.window_ns
+        self._next_combine = now + self.combine_interval_ns
+        samples = [front[1] for front in list(self._minima) if front is not None and front[0] >= horizon]
+        if samples:
+            self._min = min(samples)
+            self.offset_ns = self._min - self.min_latency_ns
+        return self.offset_ns
+
+    def update(self, recv_ns: int, event_time_ms: int, transaction_time_ms: int = 0) -> int:
+        """
+        Add a sample through the default channel of the estimator, for single-threaded callers, e.g. offline
+        processing; connections use their own ``channel``.
+
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :param event_time_ms: exchange event time in milliseconds
+        :type event_time_ms: int
+        :param transaction_time_ms: exchange transaction time in milliseconds, 0 if the stream has none
+        :type transaction_time_ms: int
+        :return int: current offset estimate in nanoseconds
+        """
+        if self._channel is None:
+            self._channel = self.channel()
+        return self._channel.update(recv_ns, event_time_ms, transaction_time_ms)
+
+    def corrected_delay_ns(self, recv_ns: int, event_time_ms: int, transaction_time_ms: int = 0) -> int:
+        """
+        :return int: delay of a message since its origin with the clock offset removed
+        """
+        return recv_ns - (transaction_time_ms or event_time_ms) * 1_000_000 - self.offset_ns
+
+
+_shared_estimator: Optional[ClockOffsetEstimator] = None
+_shared_lock = threading.Lock()
+
+
+def shared_estimator() -> ClockOffsetEstimator:
+    """
+    :return ClockOffsetEstimator: clock offset estimator shared by all connections of the process
+    """
+    global _shared_estimator
+    with _shared_lock:
+        if _shared_estimator is None:
+            _shared_estimator = ClockOffsetEstimator()
+        return _shared_estimator
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import re
+import json
+import asyncio
+from logging import getLogger
+from typing import Callable, Optional, Union
+
+__all__ = [
+    "DECODERS",
+    "EVENT_LOOPS",
+    "decode_json",
+    "get_decoder",
+    "install_event_loop",
+    "stream_of"
+]
+
+Frame = Union[str, bytes]
+
+# Combined stream frames of Binance are serialized compactly with the stream name first, other serializations are
+# matched by the slower regular expression.
+_STREAM_PREFIX = '{"stream":"'
+_STREAM_RE = re.compile(r'\{\s*"stream"\s*:\s*"([^"]*)"')
+
+
+def _unwrap(parsed) -> Optional[dict]:
+    """
+    Return the event of a raw or combined stream frame, None for replies to requests.
+    """
+    if not isinstance(parsed, dict) or "id" in parsed:
+        return None
+    data = parsed.get("data", parsed)
+    return data if isinstance(data, dict) else None
+
+
+def decode_json(frame: Frame) -> Optional[dict]:
+    """
+    Decode a frame with the standard library ``json`` module.
+
+    :param frame: websocket text frame
+    :type frame: Frame
+    :return Optional[dict]: event, or None if the frame is a reply to a request
+    """
+    return _unwrap(json.loads(frame))
+
+
+def stream_of(frame: Frame) -> Optional[str]:
+    """
+    Stream name of a combined stream frame, read from its prefix without decoding the frame.
+
+    :param frame: websocket text frame
+    :type frame: Frame
+    :return Optional[str]: stream name, or None if the frame is not a combined stream frame
+    """
+    if not isinstance(frame, str):
+        frame = frame.decode()
+    if not frame.startswith(_STREAM_PREFIX):
+        match = _STREAM_RE.match(frame)
+        return match.group(1) if match is not None else None
+    end = frame.find('"', len(_STREAM_PREFIX))
+    return frame[len(_STREAM_PREFIX):end] if end > 0 else None
+
+
+def _orjson_decoder() -> Callable[[Frame], Optional[dict]]:
+    import orjson
+    loads = orjson.loads
+
+    def decode_orjson(frame: Frame) -> Optional[dict]:
+        return _unwrap(loads(frame))
+
+    return decode_orjson
+
+
+def _msgspec_decoder() -> Callable[[Frame], Optional[dict]]:
+    import msgspec
+    loads = msgspec.json.Decoder().decode
+
+    def decode_msgspec(frame: Frame) -> Optional[dict]:
+        return _unwrap(loads(frame))
+
+    return decode_msgspec
+
+
+DECODERS = ("json", "orjson", "msgspec")
+EVENT_LOOPS = ("asyncio", "uvloop", "auto")
+
+
+def get_decoder(name: str = "json") -> Callable[[Frame], Optional[dict]]:
+    """
+    Get a frame decoder by name. Decoders return the event dictionary of raw and combined stream frames alike, and
+    None for replies to requests. Optional backends fall back to ``json`` when their package is not installed.
+
+    :param name: one of ``DECODERS``
+    :type name: str
+    :return Callable[[Frame], Optional[dict]]: decoder
+    """
+    if name == "json":
+        return decode_json
+    factories = {"orjson": _orjson_decoder, "msgspec": _msgspec_decoder}
+    if name not in factories:
+        raise ValueError(f"Unknown decoder {name}, available decoders: {', '.join(DECODERS)}")
+    try:
+        return factories[name]()
+    except ImportError:
+        getLogger(f"{__name__}.get_decoder").warning(f"Decoder {name} is not installed, falling back to json!")
+        return decode_json
+
+
+def install_event_loop(name: str = "asyncio") -> str:
+    """
+    Install the event loop policy used by the asyncio connectors.
+
+    :param name: one of ``EVENT_LOOPS``; ``auto`` picks uvloop when it is installed
+    :type name: str
+    :return str: name of the installed event loop
+    """
+    if name not in EVENT_LOOPS:
+        raise ValueError(f"Unknown event loop {name}, available event loops: {', '.join(EVENT_LOOPS)}")
+    if name == "asyncio":
+        asyncio.set_event_loop_policy(None)
+        return name
+    try:
+        import uvloop
+    except ImportError:
+        if name == "uvloop":
+            getLogger(f"{__name__}.install_event_loop").warning("uvloop is not installed, using asyncio loop!")
+        asyncio.set_event_loop_policy(None)
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
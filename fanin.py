@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import threading
+from collections import deque
+from logging import getLogger
+from typing import Callable, List, Optional
+
+__all__ = [
+    "FirstArrivalFanIn"
+]
+
+
+class FirstArrivalFanIn:
+    """
+    Fan-in stage over redundant connections of the same stream. Every update id is emitted exactly once, at the moment
+    its first copy arrives, and later copies from the other connections are dropped. Already seen update ids are kept
+    in a bounded sliding window, so memory does not grow with the lifetime of the capture. Update ids of a stream only
+    grow, so the highest id which left the window is kept as a high-water mark and copies at or below it, too late for
+    the window, are dropped as well. The sink is called under the lock of the fan-in, so first arrivals reach it in the
+    order they were emitted; it must be quick and must not offer to the fan-in itself.
+    """
+
+    def __init__(self, num_conn: int, window: int = 4096,
+                 sink: Optional[Callable[[int, dict, int], None]] = None):
+        """
+        :param num_conn: number of connections feeding the fan-in
+        :type num_conn: int
+        :param window: number of latest update ids remembered for deduplication
+        :type window: int
+        :param sink: callback ``sink(conn_id, data, curr_time)`` called for every first arrival
+        :type sink: Optional[Callable[[int, dict, int], None]]
+        """
+        if window <= 0:
+            raise ValueError(f"Dedup window must be positive, got {window}!")
+        self.num_conn = num_conn
+        self.window = window
+        self.sink = sink
+        self.wins = [0] * num_conn
+        self.duplicates = [0] * num_conn
+        self.emitted = 0
+        self._seen = set()
+        self._order = deque()
+        self._floor: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def offer(self, conn_id: int, update_id: int, data: dict, curr_time: int) -> bool:
+        """
+        Offer a message received by connection ``conn_id``.
+
+        :param conn_id: index of the connection which received the message
+        :type conn_id: int
+        :param update_id: update id of the message
+        :type update_id: int
+        :param data: decoded message
+        :type data: dict
+        :param curr_time: client timestamp of the message
+        :type curr_time: int
+        :return bool: True if this is the first copy of the update, False if it is a duplicate
+        """
+        with self._lock:
+            if update_id in self._seen or (self._floor is not None and update_id <= self._floor):
+                self.duplicates[conn_id] += 1
+                return False
+            self._seen.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self.window:
+                evicted = self._order.popleft()
+                self._seen.discard(evicted)
+                if self._floor is None or evicted > self._floor:
+                    self._floor = evicted
+            self.wins[conn_id] += 1
+            self.emitted += 1
+            # Read once, the sink may be detached by another thread in between.
+            sink = self.sink
+            if sink is not None:
+                sink(conn_id, data, curr_time)
+        return True
+
+    def win_share(self) -> List[float]:
+        """
+        :return List[float]: fraction of emitted updates delivered first by each connection
+        """
+        if not self.emitted:
+            return [0.0] * self.num_conn
+        return [wins / self.emitted for wins in self.wins]
+
+    def log_summary(self) -> None:
+        for conn_id, (wins, share, dups) in enumerate(zip(self.wins, self.win_share(), self.duplicates)):
+            getLogger(f"{__name__}.log_summary").info(f"Connection {conn_id} delivered first {wins} of "
+                                                      f"{self.emitted} updates ({share:.2%}), "
+                                                      f"dropped duplicates: {dups}")
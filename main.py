@@ -2,15 +2,26 @@
 
 # Standard modules
 import os
+import json
+import asyncio
 import argparse
-
-# Third-party modules
-import pandas as pd
+from dataclasses import fields
+from logging import getLogger
 
 # Project modules
-from constants import ProjectConstants
 from binance_logger import init_logger
-from runner import run_SWST, run_MWST, run_MWMT
+from codec import DECODERS, EVENT_LOOPS, install_event_loop
+from runner import run_method
+from fanin import FirstArrivalFanIn
+from metrics import MetricsRegistry, MetricsReporter, MetricsServer
+from orderbook import LocalOrderBook
+from publisher import TickPublisher
+from recorder import SampleRecorder
+from sequence import SequenceTracker, log_sequence_summary, save_sequence_summary
+from stages import LatencyBreakdown
+from settings import CONFIG_FILE, ENV_PREFIX, Settings
+from subscriptions import STREAM_TYPES, stream_names, usdt_perpetual_symbols
+from supervisor import ConnectionSupervisor
 
 
 def get_args():
@@ -20,44 +31,199 @@ def get_args():
                                      usage='python main.py [options] arguments')
 
     parser.add_argument("-f", "--future", metavar="future", type=str, required=True, dest="future",
-                        help="""Specify future's ticker. Example: btcusdt.\n""")
+                        help="""Specify future's ticker. Example: btcusdt. The MULTI method takes comma separated
+                        tickers, or ALL for every USDT-M perpetual future.\n""")
     parser.add_argument("-n", "--number_of_connection", metavar="conn_num", type=int, required=False, dest="conn_num",
-                        default=1, help=f"""Specify number of concurrent connections. Default value 1.\n""")
-    parser.add_argument("-t", "--timeout", metavar="timeout", type=int, required=False, dest="timeout",
-                        default=60, help=f"""Specify timeout in seconds for each connection. Default 60.\n""")
+                        default=None, help=f"""Specify number of concurrent connections. Default CONN_NUM of the
+                        config.\n""")
+    parser.add_argument("-t", "--timeout", metavar="timeout", type=int, required=False, dest="conn_timeout",
+                        default=None, help=f"""Specify timeout in seconds for each connection. Default CONN_TIMEOUT of
+                        the config.\n""")
     parser.add_argument("-m", "--method", metavar="method", type=str, required=True, dest="method",
                         default="MWMT", help=f"""Specify which method to use for connection.\n Available methods: 
                         MWMT [multiple websockets, multiple threads], MWST [multiple websockets, single thread], 
-                        SWST [single websocket, single thread]
+                        SWST [single websocket, single thread], MWMP [multiple websockets, multiple processes],
+                        MULTI [many symbols and streams over as few websockets as possible]
                         """)
+    parser.add_argument("-p", "--workers", metavar="workers", type=int, required=False, dest="workers",
+                        default=None, help=f"""Specify number of worker processes of the MWMP method.
+                        Default WORKERS of the config, 0 for the number of CPUs.\n""")
+    parser.add_argument("-w", "--dedup_window", metavar="dedup_window", type=int, required=False,
+                        dest="dedup_window", default=None,
+                        help=f"""Specify size of the sliding window of update ids used to drop duplicates
+                        delivered by redundant connections. Default DEDUP_WINDOW of the config.\n""")
+    parser.add_argument("-s", "--stream", action="store_true", dest="stream",
+                        help=f"""Stream samples to chunked binary files during the capture instead of pickling
+                        them at the end of the run.\n""")
+    parser.add_argument("-c", "--chunk_rows", metavar="chunk_rows", type=int, required=False, dest="chunk_rows",
+                        default=None, help=f"""Specify number of rows per streamed chunk. Default CHUNK_ROWS of the
+                        config.\n""")
+    parser.add_argument("-o", "--output_format", metavar="output_format", type=str, required=False,
+                        dest="output_format", default="pkl", choices=["pkl", "capture"],
+                        help=f"""Specify output format: pkl [one pickled DataFrame per connection], capture [single
+                        memory-mappable capture file]. Default pkl.\n""")
+    parser.add_argument("-u", "--url", metavar="url", type=str, required=False, dest="binance_futures_ws",
+                        default=None, help=f"""Specify futures websocket endpoint, e.g. ws://127.0.0.1:8765/ws of the
+                        local mock server. Default BINANCE_FUTURES_WS of the config.\n""")
+    parser.add_argument("-d", "--decoder", metavar="decoder", type=str, required=False, dest="decoder",
+                        default=None, choices=DECODERS,
+                        help=f"""Specify frame decoder of MWMT, SWST and MWMP methods: json, orjson or msgspec
+                        [orjson and msgspec fall back to json when not installed]. Default DECODER of the config.\n""")
+    parser.add_argument("-l", "--loop", metavar="loop", type=str, required=False, dest="loop",
+                        default=None, choices=EVENT_LOOPS,
+                        help=f"""Specify event loop of MWST and SWST methods: asyncio, uvloop or auto [uvloop when
+                        installed]. Default LOOP of the config.\n""")
+    parser.add_argument("--metrics_port", metavar="metrics_port", type=int, required=False, dest="metrics_port",
+                        default=0, help=f"""Specify local port of the live latency metrics endpoint (/metrics in
+                        Prometheus text format, /metrics.json). Default 0, disabled.\n""")
+    parser.add_argument("--metrics_interval", metavar="metrics_interval", type=float, required=False,
+                        dest="metrics_interval", default=0,
+                        help=f"""Specify interval in seconds of the live latency metrics JSON log line.
+                        Default 0, disabled.\n""")
+    parser.add_argument("--supervise", action="store_true", dest="supervise",
+                        help=f"""Reconnect dropped connections with backoff and restart stalled or lagging ones.\n""")
+    parser.add_argument("--stall_ms", metavar="stall_ms", type=float, required=False, dest="stall_ms",
+                        default=None, help=f"""Specify silence in milliseconds after which a supervised connection
+                        is restarted. Default STALL_MS of the config.\n""")
+    parser.add_argument("--replace_interval", metavar="replace_interval", type=float, required=False,
+                        dest="replace_interval", default=None,
+                        help=f"""Specify interval in seconds between replacements of the slowest supervised
+                        connection by a fresh one, 0 to disable. Default REPLACE_INTERVAL of the config.\n""")
+    parser.add_argument("--streams", metavar="streams", type=str, required=False, dest="streams",
+                        default="bookTicker", help=f"""Specify comma separated stream types of the MULTI method:
+                        {', '.join(STREAM_TYPES)}. Default bookTicker.\n""")
+    parser.add_argument("--max_streams", metavar="max_streams", type=int, required=False, dest="max_streams",
+                        default=None, help=f"""Specify maximal number of streams per websocket of the MULTI method.
+                        Default MAX_STREAMS of the config.\n""")
+    parser.add_argument("--batch_size", metavar="batch_size", type=int, required=False, dest="batch_size",
+                        default=None, help=f"""Specify batch size of MWMT and MWMP methods: receive threads only
+                        stamp raw frames into a ring buffer, which a consumer thread decodes in batches, 0 to decode
+                        in the receive threads. Default BATCH_SIZE of the config.\n""")
+    parser.add_argument("-b", "--book", action="store_true", dest="book",
+                        help=f"""Maintain a local order book from the depth events of the MWST method and report its
+                        update latency.\n""")
+    parser.add_argument("--config", metavar="config", type=str, required=False, dest="config",
+                        default=CONFIG_FILE, help=f"""Specify JSON config file. Every setting can also be set by an
+                        environment variable, e.g. {ENV_PREFIX}BATCH_SIZE=256; options override both. Default
+                        config.json next to main.py.\n""")
+    parser.add_argument("--publish", metavar="name", type=str, required=False, dest="publish",
+                        default=None, help=f"""Publish the first arrival of every bookTicker update of the MWMT, SWST
+                        and MWMP methods to the shared memory ring buffer of this name, read it from other local
+                        processes with publisher.TickSubscriber. MWMP publishes ticks without prices, about two worker
+                        flush intervals late. Default disabled.\n""")
+    parser.add_argument("--stages", action="store_true", dest="stages",
+                        help=f"""Measure the latency of every frame per stage (wire, ring buffer queue, decode, record)
+                        together with event loop and thread scheduling lag, and save their histograms as stages.json
+                        next to the data.\n""")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = vars(get_args())
-    init_logger()
-
-    update_ids_l, client_timestamps_l, delays_l = None, None, None
-    if args["method"] == "MWMT":
-        update_ids_l, client_timestamps_l, delays_l = run_MWMT(args["future"], args["timeout"], args["conn_num"])
-        save_dir = os.path.join(ProjectConstants.DATA_DIR, "MWMT")
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-    elif args["method"] == "MWST":
-        update_ids_l, client_timestamps_l, delays_l = run_MWST(args["future"], args["timeout"], args["conn_num"])
-        save_dir = os.path.join(ProjectConstants.DATA_DIR, "MWST")
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-    elif args["method"] == "SWST":
-        update_ids_l, client_timestamps_l, delays_l = run_SWST(args["future"], args["timeout"], args["conn_num"])
-        save_dir = os.path.join(ProjectConstants.DATA_DIR, "SWST")
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-
-    # Saving data
-    for i, (update_ids, client_timestamps, delays) in enumerate(zip(update_ids_l, client_timestamps_l, delays_l)):
-        df = pd.DataFrame(list(zip(update_ids, client_timestamps, delays)),
-                          columns=["update_id", "client_timestamps", "delay"])
-        pth = os.path.join(save_dir, f"connection_{i}.pkl")
-        df.to_pickle(pth)
-        print(f"Data of connection {i} had been saved at {pth}")
+    # Options named after a setting override it, unset ones come from the environment or the config.
+    settings = Settings.load(args["config"], overrides={field.name: args[field.name] for field in fields(Settings)
+                                                        if field.name in args})
+    init_logger(settings.log_file, max_bytes=settings.log_max_bytes, backup_count=settings.log_backup_count,
+                verbose=settings.verbose)
+    install_event_loop(settings.loop)
+    fan_in = FirstArrivalFanIn(settings.conn_num, settings.dedup_window)
+    save_dir = os.path.join(settings.data_dir, args["method"])
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    with open(os.path.join(save_dir, "settings.json"), "w", encoding="utf-8") as f:
+        json.dump(settings.as_dict(), f, indent=2)
+    writer = None
+    if args["stream"]:
+        from storage import ChunkedCaptureWriter
+        writer = ChunkedCaptureWriter(save_dir, settings.chunk_rows, settings.chunk_flush_interval,
+                                      single_file=args["output_format"] == "capture")
+
+    metrics, metrics_server, metrics_reporter = None, None, None
+    if args["metrics_port"] or args["metrics_interval"]:
+        metrics = MetricsRegistry(settings.conn_num)
+    if args["metrics_port"]:
+        metrics_server = MetricsServer(metrics, args["metrics_port"]).start()
+    if args["metrics_interval"]:
+        metrics_reporter = MetricsReporter(metrics, args["metrics_interval"]).start()
+
+    supervisor = None
+    if args["supervise"]:
+        supervisor = ConnectionSupervisor(settings.conn_num, settings.stall_ms,
+                                          replace_interval_s=settings.replace_interval)
+
+    sequences = [SequenceTracker(conn_id) for conn_id in range(settings.conn_num)]
+    book = None
+    if args["book"]:
+        if args["method"] == "MWST":
+            book = LocalOrderBook(args["future"])
+        else:
+            getLogger(f"{__name__}.main").warning("Only the MWST method receives depth events, "
+                                                  "order book is disabled!")
+    publisher = None
+    if args["publish"]:
+        if args["method"] in ("MWMT", "SWST", "MWMP"):
+            publisher = TickPublisher(args["publish"], symbol=args["future"])
+            fan_in.sink = publisher.on_event
+        else:
+            getLogger(f"{__name__}.main").warning("Only the MWMT, SWST and MWMP methods feed bookTicker updates to the "
+                                                  "fan-in, publishing is disabled!")
+
+    stages = None
+    if args["stages"]:
+        if args["method"] != "MULTI":
+            stages = LatencyBreakdown(settings.conn_num).start()
+        else:
+            getLogger(f"{__name__}.main").warning("The MULTI method records streams, not connections, "
+                                                  "latency stages are disabled!")
+
+    target = args["future"]
+    if args["method"] == "MULTI":
+        symbols = asyncio.run(usdt_perpetual_symbols()) if args["future"].upper() == "ALL" else \
+            args["future"].split(",")
+        target = stream_names(symbols, args["streams"].split(","))
+        with open(os.path.join(save_dir, "streams.json"), "w", encoding="utf-8") as f:
+            json.dump(target, f, indent=2)
+    columns = run_method(args["method"], target, settings, fan_in, writer, metrics, supervisor, sequences, book,
+                         stages)
+
+    if metrics_reporter is not None:
+        metrics_reporter.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    if fan_in.emitted:
+        fan_in.log_summary()
+    if publisher is not None:
+        # Receive threads of unsupervised MWMT connections outlive the run, detach the ring before releasing it.
+        fan_in.sink = None
+        publisher.close()
+    if args["method"] != "MULTI":
+        log_sequence_summary(sequences)
+        save_sequence_summary(sequences, os.path.join(save_dir, "sequence.json"))
+    if book is not None:
+        book_summary = book.summary()
+        getLogger(f"{__name__}.main").info(f"Order book: {json.dumps(book_summary)}")
+        with open(os.path.join(save_dir, "orderbook.json"), "w", encoding="utf-8") as f:
+            json.dump(book_summary, f, indent=2)
+    if stages is not None:
+        stages.stop()
+        stages.save(os.path.join(save_dir, "stages.json"), stages.log_summary())
+
+    # Saving data. Local import, numpy and pandas are only needed from here on.
+    from storage import CAPTURE_FILE, CaptureWriter, samples_frame
+    if writer is not None:
+        print(f"Data of {settings.conn_num} connections had been streamed to {save_dir}")
+    elif args["output_format"] == "capture":
+        pth = os.path.join(save_dir, CAPTURE_FILE)
+        capture = CaptureWriter(pth, len(columns[0]))
+        for i, conn_columns in enumerate(zip(*columns)):
+            conn = dict(zip(SampleRecorder.FIELDS, conn_columns))
+            capture.write(i, conn["update_id"], conn["event_time"], conn["client_time_ns"], conn["transaction_time"],
+                          conn["offset_ns"])
+        capture.close()
+        print(f"Data of {len(columns[0])} connections had been saved at {pth}")
+    else:
+        for i, conn_columns in enumerate(zip(*columns)):
+            df = samples_frame(conn_columns)
+            pth = os.path.join(save_dir, f"connection_{i}.pkl")
+            df.to_pickle(pth)
+            print(f"Data of connection {i} had been saved at {pth}")
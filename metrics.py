@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import threading
+from array import array
+from logging import getLogger
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+# Project modules
+from clock import now_ns
+
+if TYPE_CHECKING:
+    # Only for annotations, numpy is imported when histograms are read or recorded in batches.
+    import numpy as np
+
+__all__ = [
+    "ConnectionMetrics",
+    "LogHistogram",
+    "MetricsRegistry",
+    "MetricsReporter",
+    "MetricsServer",
+    "quantiles"
+]
+
+
+class LogHistogram:
+    """
+    Fixed memory log-linear histogram of non-negative integers, in the spirit of HdrHistogram. Values below
+    ``2 ** sub_bits`` are counted exactly, larger ones in ``2 ** (sub_bits - 1)`` buckets per power of two, i.e. with a
+    relative error below ``2 ** (1 - sub_bits)``. Recording is a few integer operations and one array increment; the
+    counts are an int64 ``array``, so merges and quantiles run on zero-copy numpy views of it.
+    """
+
+    def __init__(self, sub_bits: int = 7):
+        """
+        :param sub_bits: bits of precision of each bucket
+        :type sub_bits: int
+        """
+        self.sub_bits = sub_bits
+        self.counts = array("q", bytes(8 * (64 << sub_bits)))
+        self.count = 0
+        self.max = 0
+
+    def value_at(self, index: int) -> int:
+        """
+        :return int: middle of the value range counted by bucket ``index``
+        """
+        shift = index >> self.sub_bits
+        if not shift:
+            return index
+        return ((index & ((1 << self.sub_bits) - 1)) << shift) + (1 << (shift - 1))
+
+    def record(self, value: int) -> None:
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - self.sub_bits
+        self.counts[value if shift <= 0 else (shift << self.sub_bits) + (value >> shift)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values: "np.ndarray") -> None:
+        """
+        Record a batch of values at once, e.g. the rows of a worker process.
+
+        :param values: int64 values
+        :type values: np.ndarray
+        """
+        import numpy as np
+        if not len(values):
+            return
+        values = np.maximum(values, 0)
+        # The exponent of frexp is the bit length, exactly for the values below 2 ** 53 a histogram holds.
+        shift = np.maximum(np.frexp(values.astype(np.float64))[1] - self.sub_bits, 0)
+        index = np.where(shift > 0, (shift.astype(np.int64) << self.sub_bits) + (values >> shift), values)
+        counts = np.frombuffer(self.counts, dtype=np.int64)
+        counts += np.bincount(index, minlength=len(counts))
+        self.count += len(values)
+        self.max = max(self.max, int(values.max()))
+
+    def filled(self) -> List[int]:
+        """
+        :return List[int]: indices of the non-empty buckets
+        """
+        # Local import, numpy is not needed until the histograms are read.
+        import numpy as np
+        return np.flatnonzero(np.frombuffer(self.counts, dtype=np.int64)).tolist()
+
+    def merge(self, other: "LogHistogram") -> None:
+        import numpy as np
+        counts = np.frombuffer(self.counts, dtype=np.int64)
+        counts += np.frombuffer(other.counts, dtype=np.int64)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def reset(self) -> None:
+        self.counts = array("q", bytes(8 * len(self.counts)))
+        self.count = 0
+        self.max = 0
+
+    def quantile(self, q: float) -> int:
+        """
+        :param q: quantile in [0, 1]
+        :type q: float
+        :return int: value of the quantile, 0 for an empty histogram
+        """
+        return quantiles([self], [q])[0]
+
+
+def quantiles(histograms: Sequence[LogHistogram], qs: Sequence[float]) -> List[int]:
+    """
+    Quantiles of the union of histograms of the same precision in one vectorized pass over their buckets, without
+    merging them into a new histogram.
+
+    :param histograms: histograms to combine
+    :type histograms: Sequence[LogHistogram]
+    :param qs: quantiles in [0, 1]
+    :type qs: Sequence[float]
+    :return List[int]: value of every quantile, 0 for empty histograms
+    """
+    import numpy as np
+    counts = np.frombuffer(histograms[0].counts, dtype=np.int64)
+    for hist in histograms[1:]:
+        counts = counts + np.frombuffer(hist.counts, dtype=np.int64)
+    cumulative = np.cumsum(counts)
+    # Receive threads may record while the buckets are read, so ranks come from the buckets rather than the counters.
+    total = int(cumulative[-1])
+    if not total:
+        return [0] * len(qs)
+    ranks = np.maximum(1, (np.asarray(qs, dtype=np.float64) * total + 0.5).astype(np.int64))
+    highest = max(hist.max for hist in histograms)
+    return [min(histograms[0].value_at(int(index)), highest) for index in np.searchsorted(cumulative, ranks)]
+
+
+class ConnectionMetrics:
+    """
+    Live metrics of one connection over a rolling window: latency histogram (microseconds), message rate and gaps,
+    i.e. silences longer than ``gap_ms`` between two frames. Two histograms are rotated every ``window_s`` seconds, so
+    the reported window covers between one and two windows of the latest data. Snapshots rotate the windows as well,
+    so a connection that stops receiving ages out of them, and report its silence since the last frame as an ongoing
+    gap.
+    """
+
+    def __init__(self, conn_id: int, window_s: float = 10.0, gap_ms: float = 1000.0):
+        """
+        :param conn_id: connection index
+        :type conn_id: int
+        :param window_s: length of the rolling window in seconds
+        :type window_s: float
+        :param gap_ms: minimal silence in milliseconds counted as a gap
+        :type gap_ms: float
+        """
+        self.conn_id = conn_id
+        self.window_ns = int(window_s * 1e9)
+        self.gap_ns = int(gap_ms * 1e6)
+        self.total = 0
+        self.total_gaps = 0
+        self._current = LogHistogram()
+        self._previous = LogHistogram()
+        self._current_gaps = 0
+        self._previous_gaps = 0
+        self._window_start = now_ns()
+        self._previous_start = self._window_start
+        self._last_recv = 0
+        # Windows are rotated by the receive path and by snapshots, the rare rotation is serialized.
+        self._rotate_lock = threading.Lock()
+
+    def record(self, recv_ns: int, delay_ns: int) -> None:
+        """
+        Record a frame. Called from the receive path of the connection.
+
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :param delay_ns: delay of the frame in nanoseconds
+        :type delay_ns: int
+        """
+        if recv_ns - self._window_start >= self.window_ns:
+            self._rotate(recv_ns)
+        if self._last_recv and recv_ns - self._last_recv >= self.gap_ns:
+            self._current_gaps += 1
+            self.total_gaps += 1
+        self._last_recv = recv_ns
+        self._current.record(delay_ns // 1000)
+        self.total += 1
+
+    def record_many(self, recv_ns: "np.ndarray", delay_ns: "np.ndarray") -> None:
+        """
+        Record a batch of frames in receive order, e.g. received by a worker process, as ``record`` would one by one.
+
+        :param recv_ns: int64 client receive times in nanoseconds, non-decreasing
+        :type recv_ns: np.ndarray
+        :param delay_ns: int64 delays of the frames in nanoseconds
+        :type delay_ns: np.ndarray
+        """
+        import numpy as np
+        if not len(recv_ns):
+            return
+        gaps = np.diff(recv_ns, prepend=self._last_recv or recv_ns[0]) >= self.gap_ns
+        start = 0
+        while start < len(recv_ns):
+            # Frames up to the end of the current window, the window is rotated at the first frame after it.
+            stop = start + int(np.searchsorted(recv_ns[start:], self._window_start + self.window_ns))
+            if stop == start:
+                self._rotate(int(recv_ns[start]))
+                continue
+            self._current.record_many(delay_ns[start:stop] // 1000)
+            window_gaps = int(np.count_nonzero(gaps[start:stop]))
+            self._current_gaps += window_gaps
+            self.total_gaps += window_gaps
+            start = stop
+        self._last_recv = int(recv_ns[-1])
+        self.total += len(recv_ns)
+
+    def _rotate(self, recv_ns: int) -> None:
+        with self._rotate_lock:
+            elapsed_ns = recv_ns - self._window_start
+            if elapsed_ns < self.window_ns:
+                # Rotated by another thread meanwhile.
+                return
+            self._previous, self._current = self._current, self._previous
+            self._current.reset()
+            self._previous_gaps, self._current_gaps = self._current_gaps, 0
+            if elapsed_ns >= 2 * self.window_ns:
+                # Silent for a whole window, the latest data is older than the rolling window.
+                self._previous.reset()
+                self._previous_gaps = 0
+            self._previous_start, self._window_start = self._window_start, recv_ns
+
+    def snapshot(self) -> Dict:
+        """
+        :return Dict: metrics of the rolling window, gaps include the ongoing silence if longer than ``gap_ms``
+        """
+        now = now_ns()
+        if now - self._window_start >= self.window_ns:
+            self._rotate(now)
+        silence_ns = now - self._last_recv if self._last_recv else 0
+        ongoing_gap = int(silence_ns >= self.gap_ns)
+        window = (self._previous, self._current)
+        count = self._previous.count + self._current.count
+        p50_us, p99_us = quantiles(window, (0.5, 0.99))
+        elapsed_s = max((now - self._previous_start) / 1e9, 1e-9)
+        return {
+            "conn_id": self.conn_id,
+            "messages": count,
+            "rate": count / elapsed_s,
+            "p50_us": p50_us,
+            "p99_us": p99_us,
+            "max_us": max(self._previous.max, self._current.max),
+            "gaps": self._previous_gaps + self._current_gaps + ongoing_gap,
+            "silence_ms": max(silence_ns, 0) / 1e6,
+            "total_messages": self.total,
+            "total_gaps": self.total_gaps + ongoing_gap
+        }
+
+
+class MetricsRegistry:
+    """
+    Metrics of all connections of a run.
+    """
+
+    def __init__(self, num_conn: int, window_s: float = 10.0, gap_ms: float = 1000.0):
+        self.connections = [ConnectionMetrics(conn_id, window_s, gap_ms) for conn_id in range(num_conn)]
+
+    def snapshot(self) -> List[Dict]:
+        return [conn.snapshot() for conn in self.connections]
+
+    def prometheus_text(self) -> str:
+        """
+        :return str: snapshot in the Prometheus text exposition format
+        """
+        metrics = {
+            "binance_ws_window_messages": ("gauge", "messages", "Messages received in the rolling window."),
+            "binance_ws_message_rate": ("gauge", "rate", "Messages per second in the rolling window."),
+            "binance_ws_latency_p50_microseconds": ("gauge", "p50_us", "Median latency in the rolling window."),
+            "binance_ws_latency_p99_microseconds": ("gauge", "p99_us",
+                                                    "99th percentile latency in the rolling window."),
+            "binance_ws_latency_max_microseconds": ("gauge", "max_us", "Maximal latency in the rolling window."),
+            "binance_ws_window_gaps": ("gauge", "gaps", "Silences longer than the gap threshold in the rolling window, "
+                                                        "including the ongoing one."),
+            "binance_ws_silence_milliseconds": ("gauge", "silence_ms", "Time since the last message."),
+            "binance_ws_messages_total": ("counter", "total_messages", "Messages received."),
+            "binance_ws_gaps_total": ("counter", "total_gaps", "Silences longer than the gap threshold.")
+        }
+        snapshot = self.snapshot()
+        lines = list()
+        for name, (kind, key, help_text) in metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for conn in snapshot:
+                lines.append(f'{name}{{conn_id="{conn["conn_id"]}"}} {conn[key]}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint serving the registry as Prometheus text on ``/metrics`` and as JSON on ``/metrics.json``.
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry_.prometheus_text().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry_.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "MetricsServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+        getLogger(f"{__name__}.start").info(f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsReporter:
+    """
+    Periodically logs the snapshot of the registry as one JSON line.
+    """
+
+    def __init__(self, registry: MetricsRegistry, interval: float = 10.0):
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            getLogger(f"{__name__}.report").info(json.dumps({"metrics": self.registry.snapshot()}))
+
+    def start(self) -> "MetricsReporter":
+        self._thread = threading.Thread(target=self._run, name="MetricsReporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
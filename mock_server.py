@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from logging import getLogger
+from typing import Dict, List, Optional, Sequence, Set
+from urllib.parse import urlparse, parse_qs
+
+# Third-party modules
+import websockets
+
+__all__ = [
+    "MockFuturesServer"
+]
+
+
+class _Client:
+    """
+    State of one client connection: subscriptions, combined property and the jittered send queue.
+    """
+
+    def __init__(self, ws, conn_idx: int, combined: bool, jitter_ms: float, rng: random.Random):
+        self.ws = ws
+        self.conn_idx = conn_idx
+        self.combined = combined
+        self.jitter_ms = jitter_ms
+        self.rng = rng
+        self.streams: Set[str] = set()
+        self.queue = asyncio.Queue()
+        self.last_due = 0.0
+
+    def push(self, raw: str, combined: str, now: float) -> None:
+        due = now + (self.rng.expovariate(1000.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0)
+        # Frames of one connection are never reordered, jitter only delays them.
+        self.last_due = max(self.last_due, due)
+        self.queue.put_nowait((self.last_due, combined if self.combined else raw))
+
+
+class MockFuturesServer:
+    """
+    Local stand-in for the Binance futures websocket API. It speaks the ``SUBSCRIBE``/``UNSUBSCRIBE``/
+    ``LIST_SUBSCRIPTIONS``/``SET_PROPERTY``/``GET_PROPERTY`` protocol on ``/ws`` (raw streams by default) and
+    ``/stream?streams=...`` (combined streams), and generates ``bookTicker``, ``depth``, ``aggTrade`` and ``markPrice``
+    events at a fixed rate per stream or replays them from a recorded capture file. Books of the generated depth
+    streams are kept, so that the websocket API ``depth`` request returns consistent snapshots. Every connection delays
+    its frames by a random exponential jitter, configurable per connection, so benchmarks of the connection methods are
+    reproducible on one box.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, rate: float = 100.0,
+                 jitter_ms: Sequence[float] = (0.0,), replay_path: Optional[str] = None, replay_speed: float = 1.0,
+                 seed: Optional[int] = None):
+        """
+        :param host: interface to listen on
+        :type host: str
+        :param port: port to listen on, 0 picks a free one
+        :type port: int
+        :param rate: generated events per second per stream
+        :type rate: float
+        :param jitter_ms: mean extra delay in milliseconds of each connection, cycled over connections in the order
+            they are accepted
+        :type jitter_ms: Sequence[float]
+        :param replay_path: capture file whose update ids and inter-arrival times are replayed instead of generating
+            events at ``rate``
+        :type replay_path: Optional[str]
+        :param replay_speed: replay speed multiplier
+        :type replay_speed: float
+        :param seed: seed of the jitter and price generators, each stream and connection has its own generator, so
+            that it repeats whatever else is subscribed or connected; unseeded if None
+        :type seed: Optional[int]
+        """
+        if rate <= 0:
+            raise ValueError(f"Message rate must be positive, got {rate}!")
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.jitter_ms = list(jitter_ms) or [0.0]
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        self.seed = seed
+        self.accepted = 0
+        self.frames_sent = 0
+        self._clients: List[_Client] = list()
+        self._generators: Dict[str, asyncio.Task] = dict()
+        self._books: Dict[str, dict] = dict()
+        self._book_streams: Dict[str, str] = dict()
+        self._server = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+    def _random(self, name: str) -> random.Random:
+        # Own generators, so that seeding the server does not change the random state of the process.
+        return random.Random(f"{self.seed}:{name}") if self.seed is not None else random.Random()
+
+    @property
+    def url(self) -> str:
+        """
+        :return str: raw stream endpoint, a drop-in replacement of ``wss://fstream.binance.com/ws``
+        """
+        return f"ws://{self.host}:{self.port}/ws"
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._server = await websockets.serve(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        getLogger(f"{__name__}.start").info(f"Mock futures server is listening on {self.url}")
+
+    async def close(self) -> None:
+        for task in self._generators.values():
+            task.cancel()
+        self._generators.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_in_thread(self) -> "MockFuturesServer":
+        """
+        Run the server on its own event loop in a daemon thread, e.g. next to a benchmarked runner.
+
+        :return MockFuturesServer: self, once the server is listening
+        """
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            self._started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="MockFuturesServer", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    async def _handle(self, ws, path: Optional[str] = None) -> None:
+        if path is None:
+            path = ws.path if hasattr(ws, "path") else ws.request.path
+        url = urlparse(path)
+        # Newer clients put a category before the combined endpoint, e.g. /public/stream.
+        client = _Client(ws, self.accepted, url.path.rstrip("/").endswith("/stream"),
+                         self.jitter_ms[self.accepted % len(self.jitter_ms)], self._random(f"conn:{self.accepted}"))
+        self.accepted += 1
+        self._clients.append(client)
+        initial_streams = parse_qs(url.query).get("streams", [""])[0]
+        if url.path.startswith("/ws/"):
+            initial_streams = url.path[len("/ws/"):]
+        self._subscribe(client, [stream for stream in initial_streams.split("/") if stream])
+
+        sender = asyncio.create_task(self._send_loop(client))
+        try:
+            async for message in ws:
+                reply = self._handle_request(client, message)
+                if reply is not None:
+                    await ws.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            self._clients.remove(client)
+
+    def _handle_request(self, client: _Client, message: str) -> Optional[dict]:
+        try:
+            request = json.loads(message)
+            method, params, req_id = request["method"], request.get("params", []), request["id"]
+        except (ValueError, KeyError, TypeError):
+            return {"error": {"code": 3, "msg": "Invalid JSON"}}
+        if method == "SUBSCRIBE":
+            self._subscribe(client, params)
+            return {"result": None, "id": req_id}
+        if method == "UNSUBSCRIBE":
+            client.streams.difference_update(params)
+            return {"result": None, "id": req_id}
+        if method == "LIST_SUBSCRIPTIONS":
+            return {"result": sorted(client.streams), "id": req_id}
+        if method == "SET_PROPERTY" and len(params) == 2 and params[0] == "combined":
+            client.combined = bool(params[1])
+            return {"result": None, "id": req_id}
+        if method == "GET_PROPERTY" and params == ["combined"]:
+            return {"result": client.combined, "id": req_id}
+        if method == "depth" and isinstance(params, dict) and "symbol" in params:
+            return {"id": req_id, "status": 200,
+                    "result": self._snapshot(params["symbol"].upper(), int(params.get("limit", 1000)))}
+        return {"error": {"code": 2, "msg": f"Invalid request: {method} {params}"}, "id": req_id}
+
+    def _subscribe(self, client: _Client, streams: Sequence[str]) -> None:
+        for stream in streams:
+            client.streams.add(stream)
+            if stream not in self._generators:
+                self._generators[stream] = asyncio.create_task(self._generate(stream))
+
+    def _snapshot(self, symbol: str, limit: int) -> dict:
+        book = self._books.get(symbol, {"lastUpdateId": 0, "bids": dict(), "asks": dict()})
+        event_time = time.time_ns() // 1_000_000
+        return {"lastUpdateId": book["lastUpdateId"], "E": event_time, "T": event_time,
+                "bids": [[price, qty] for price, qty in
+                         sorted(book["bids"].items(), key=lambda level: -float(level[0]))[:limit]],
+                "asks": [[price, qty] for price, qty in
+                         sorted(book["asks"].items(), key=lambda level: float(level[0]))[:limit]]}
+
+    def _update_book(self, event: dict) -> None:
+        book = self._books.setdefault(event["s"], {"lastUpdateId": 0, "bids": dict(), "asks": dict()})
+        for side, levels in (("bids", event["b"]), ("asks", event["a"])):
+            for price, qty in levels:
+                if float(qty) == 0.0:
+                    book[side].pop(price, None)
+                else:
+                    book[side][price] = qty
+        book["lastUpdateId"] = event["u"]
+
+    async def _send_loop(self, client: _Client) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            due, frame = await client.queue.get()
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await client.ws.send(frame)
+            self.frames_sent += 1
+
+    def _publish(self, stream: str, event: dict) -> None:
+        # Compact like the frames of Binance, whose stream name prefix the stream router reads.
+        raw = json.dumps(event, separators=(",", ":"))
+        combined = f'{{"stream":"{stream}","data":{raw}}}'
+        now = self._loop.time()
+        for client in self._clients:
+            if stream in client.streams:
+                client.push(raw, combined, now)
+
+    def _schedule(self, rng: random.Random):
+        """
+        Yield the inter-arrival times in seconds and update ids of the events of one stream.
+
+        :param rng: generator of the stream
+        :type rng: random.Random
+        """
+        if self.replay_path is None:
+            update_id = 1
+            while True:
+                yield 1.0 / self.rate, update_id
+                update_id += rng.randint(1, 3)
+        # Local import, numpy is only needed for replays.
+        from storage import open_capture
+        records = open_capture(self.replay_path)
+        update_ids, first = list(), dict()
+        for update_id, event_time in zip(records["update_id"].tolist(), records["event_time"].tolist()):
+            if update_id not in first:
+                first[update_id] = event_time
+                update_ids.append(update_id)
+        update_ids.sort()
+        prev_time = first[update_ids[0]] if update_ids else 0
+        for update_id in update_ids:
+            yield max(first[update_id] - prev_time, 0) / 1000.0 / self.replay_speed, update_id
+            prev_time = max(prev_time, first[update_id])
+
+    async def _generate(self, stream: str) -> None:
+        symbol, _, kind = stream.partition("@")
+        symbol = symbol.upper()
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        mid, prev_u, rng = 30000.0, 0, self._random(stream)
+        for interval, update_id in self._schedule(rng):
+            next_time += interval
+            delay = next_time - loop.time()
+            # Sleep only when ahead of schedule, events that are already due are emitted in a burst.
+            if delay > 0:
+                await asyncio.sleep(delay)
+            event_time = time.time_ns() // 1_000_000
+            mid += rng.choice((-0.1, 0.0, 0.1))
+            if kind == "bookTicker":
+                event = {"e": "bookTicker", "u": update_id, "s": symbol, "b": f"{mid - 0.05:.2f}",
+                         "B": f"{rng.uniform(0.001, 5):.3f}", "a": f"{mid + 0.05:.2f}",
+                         "A": f"{rng.uniform(0.001, 5):.3f}", "T": event_time, "E": event_time}
+            elif kind.startswith("depth"):
+                event = {"e": "depthUpdate", "E": event_time, "T": event_time, "s": symbol,
+                         "U": prev_u + 1, "u": update_id, "pu": prev_u,
+                         "b": [[f"{mid - 0.05 - 0.1 * rng.randint(0, 20):.2f}", f"{rng.uniform(0, 5):.3f}"]],
+                         "a": [[f"{mid + 0.05 + 0.1 * rng.randint(0, 20):.2f}", f"{rng.uniform(0, 5):.3f}"]]}
+                # Depth streams of a symbol have their own update ids here, snapshots follow the first one.
+                if self._book_streams.setdefault(symbol, stream) == stream:
+                    # Levels left on the wrong side of the moving mid price are removed, so the book never crosses.
+                    book = self._books.get(symbol)
+                    if book is not None:
+                        event["b"] += [[price, "0.000"] for price in book["bids"] if float(price) >= mid]
+                        event["a"] += [[price, "0.000"] for price in book["asks"] if float(price) <= mid]
+                    self._update_book(event)
+            elif kind.startswith("aggTrade"):
+                event = {"e": "aggTrade", "E": event_time, "s": symbol, "a": update_id, "p": f"{mid:.2f}",
+                         "q": f"{rng.uniform(0.001, 5):.3f}", "f": update_id, "l": update_id, "T": event_time,
+                         "m": rng.random() < 0.5}
+            elif kind.startswith("markPrice"):
+                event = {"e": "markPriceUpdate", "E": event_time, "s": symbol, "p": f"{mid:.2f}",
+                         "i": f"{mid:.2f}", "P": f"{mid:.2f}", "r": "0.00010000", "T": event_time}
+            else:
+                event = {"e": kind, "E": event_time, "s": symbol, "u": update_id}
+            prev_u = update_id
+            self._publish(stream, event)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the Binance futures websocket API.",
+                                     usage="python mock_server.py [options]")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on. Default 127.0.0.1.")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port to listen on. Default 8765.")
+    parser.add_argument("-r", "--rate", type=float, default=100.0,
+                        help="Generated events per second per stream. Default 100.")
+    parser.add_argument("-j", "--jitter", type=str, default="0",
+                        help="Comma separated mean jitter in ms of each connection, cycled. Default 0.")
+    parser.add_argument("--replay", type=str, default=None, help="Capture file to replay instead of generating.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier. Default 1.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the generated events and jitter, repeated per stream and connection. "
+                             "Default unseeded.")
+    cli_args = parser.parse_args()
+
+    async def serve():
+        server = MockFuturesServer(cli_args.host, cli_args.port, cli_args.rate,
+                                   [float(jitter) for jitter in cli_args.jitter.split(",")],
+                                   cli_args.replay, cli_args.speed, cli_args.seed)
+        await server.start()
+        await asyncio.Future()
+
+    asyncio.run(serve())
@@ -1,18 +1,28 @@
 # -*- coding: utf-8 -*-
 
 # Standard modules
-import time
 import json
 import _thread
-import queue
 import asyncio
 from logging import getLogger
-from typing import Tuple, List
+from functools import partial
+from typing import TYPE_CHECKING, Tuple, List, Optional, Callable, Dict, Sequence
 
-# Third-party modules
-import websocket
-import websockets
-from binance import AsyncClient, BinanceSocketManager
+# Project modules
+from clock import now_ns, shared_estimator
+from codec import decode_json
+from fanin import FirstArrivalFanIn
+from metrics import ConnectionMetrics, MetricsRegistry
+from recorder import SampleRecorder, collect_columns
+from ring import FrameRing, RingConsumer
+from sequence import SequenceTracker
+from stages import StageHistograms
+from subscriptions import StreamRouter, SubscriptionManager
+from supervisor import ConnectionSupervisor
+
+if TYPE_CHECKING:
+    # Only for annotations, ThreadedWS imports websocket-client when a connection is opened.
+    import websocket
 
 __all__ = [
     "ThreadedWS",
@@ -21,25 +31,69 @@ __all__ = [
 ]
 
 
-class ThreadedWS(websocket.WebSocketApp):
-    def __init__(self, url, ticker: str, client_timestamp: queue.Queue, delays: queue.Queue, update_ids: queue.Queue):
-        super().__init__(url, on_open=self.on_open, on_message=self.on_message,
-                         on_close=self.on_close, on_error=self.on_error)
+class ThreadedWS:
+    def __init__(self, url, ticker: str, recorder: SampleRecorder, conn_id: int = 0,
+                 fan_in: Optional[FirstArrivalFanIn] = None, decoder: Callable[[str], Optional[dict]] = decode_json,
+                 metrics: Optional[ConnectionMetrics] = None, supervisor: Optional[ConnectionSupervisor] = None,
+                 sequence: Optional[SequenceTracker] = None, consumer: Optional[RingConsumer] = None,
+                 ring_capacity: int = 65536, stages: Optional[StageHistograms] = None):
+        """
+        With a ``consumer`` the receive thread only stamps every raw frame with its receive time and pushes it to a
+        ``ring.FrameRing`` of the connection; the ``ring.RingConsumer`` thread decodes and records the frames in
+        batches, so processing stalls do not delay the next read of the socket. With ``stages`` the time each frame
+        spends in the ring, in the decoder and in recording is measured as well.
+        """
+        # Local import, only the threaded connectors need websocket-client.
+        import websocket
+        self.ring = FrameRing(ring_capacity) if consumer is not None else None
+        self.app = websocket.WebSocketApp(url, on_open=self.on_open,
+                                          on_message=self.on_message if self.ring is None else self.on_frame,
+                                          on_close=self.on_close, on_error=self.on_error)
         self.url = url
         self.ticker = ticker
-        self.client_timestamp = client_timestamp
-        self.delays = delays
-        self.update_ids = update_ids
+        self.recorder = recorder
+        self.conn_id = conn_id
+        self.fan_in = fan_in
+        self.decoder = decoder
+        self.metrics = metrics
+        self.supervisor = supervisor
+        self.sequence = sequence
+        self.stages = stages
+        self.clock_offset = shared_estimator().channel()
         self.thread_id = None
-        self.run_forever()
+        if consumer is not None:
+            consumer.add(self.ring, self.handle_frame)
+        if supervisor is None:
+            self.app.run_forever()
+        else:
+            supervisor.run_blocking(conn_id, self.app.run_forever, self.app.close)
+
+    def on_frame(self, ws, message):
+        self.ring.push(message, now_ns())
 
     def on_message(self, ws, message):
-        curr_time = time.time_ns() // 1e6
-        data = json.loads(message)
+        self.handle_frame(message, now_ns())
+
+    def handle_frame(self, message, curr_time: int) -> None:
+        start = now_ns() if self.stages is not None else 0
+        data = self.decoder(message)
         if data is not None:
-            self.update_ids.put(data["u"])
-            self.delays.put(curr_time - data["E"])
-            self.client_timestamp.put(curr_time)
+            decoded = now_ns() if self.stages is not None else 0
+            transaction_time = data.get("T", 0)
+            offset_ns = self.clock_offset.update(curr_time, data["E"], transaction_time)
+            corrected_ns = curr_time - (transaction_time or data["E"]) * 1_000_000 - offset_ns
+            self.recorder.append((data["u"], data["E"], transaction_time, curr_time, offset_ns))
+            if self.metrics is not None:
+                self.metrics.record(curr_time, corrected_ns)
+            if self.supervisor is not None:
+                self.supervisor.heartbeat(self.conn_id, curr_time, data["u"], curr_time - data["E"] * 1_000_000)
+            if self.sequence is not None:
+                self.sequence.update(data)
+            if self.fan_in is not None:
+                self.fan_in.offer(self.conn_id, data["u"], data, curr_time)
+            if self.stages is not None:
+                self.stages.add(corrected_ns, decoded - start, now_ns() - decoded,
+                                start - curr_time if self.ring is not None else -1)
 
     def on_error(self, ws, error):
         getLogger(f"{__name__}.on_close").info(f"Error occurred in socket {ws}!\n"
@@ -48,7 +102,7 @@ class ThreadedWS(websocket.WebSocketApp):
     def on_close(self, ws):
         getLogger(f"{__name__}.on_close").info(f"Socket {ws} close connection!")
 
-    def on_open(self, ws: websocket.WebSocketApp) -> None:
+    def on_open(self, ws: "websocket.WebSocketApp") -> None:
         def run(*args):
             # Subscribe to the ticker@bookTicker stream
             ws.send(json.dumps({"method": "SUBSCRIBE", "params": [f"{self.ticker}@bookTicker"], "id": 1}))
@@ -60,117 +114,150 @@ class ThreadedWS(websocket.WebSocketApp):
 
 
 class AsyncWSv1:
-    def __init__(self, ticker: str):
+    def __init__(self, ticker: str, conn_id: int = 0, fan_in: Optional[FirstArrivalFanIn] = None,
+                 url: Optional[str] = None, metrics: Optional[ConnectionMetrics] = None,
+                 supervisor: Optional[ConnectionSupervisor] = None, sequence: Optional[SequenceTracker] = None,
+                 stages: Optional[StageHistograms] = None):
         self.ticker = ticker
+        self.url = url
+        self.metrics = metrics
+        self.supervisor = supervisor
+        self.sequence = sequence
+        self.stages = stages
+        self.conn_id = conn_id
+        self.fan_in = fan_in
         self.client = None
         self.socket = None
-        self.client_timestamps = asyncio.Queue()
-        self.delays = asyncio.Queue()
-        self.update_ids = asyncio.Queue()
+        self.recorder = SampleRecorder()
+        self.clock_offset = shared_estimator().channel()
 
-    async def put_data(self, data, curr_time):
+    def put_data(self, data, curr_time):
         if data is not None:
-            await self.update_ids.put(data["u"])
-            await self.delays.put(curr_time - data["E"])
-            await self.client_timestamps.put(curr_time)
+            transaction_time = data.get("T", 0)
+            offset_ns = self.clock_offset.update(curr_time, data["E"], transaction_time)
+            corrected_ns = curr_time - (transaction_time or data["E"]) * 1_000_000 - offset_ns
+            self.recorder.append((data["u"], data["E"], transaction_time, curr_time, offset_ns))
+            if self.metrics is not None:
+                self.metrics.record(curr_time, corrected_ns)
+            if self.supervisor is not None:
+                self.supervisor.heartbeat(self.conn_id, curr_time, data["u"], curr_time - data["E"] * 1_000_000)
+            if self.sequence is not None:
+                self.sequence.update(data)
+            if self.fan_in is not None:
+                self.fan_in.offer(self.conn_id, data["u"], data, curr_time)
+            if self.stages is not None:
+                # python-binance decodes the frame before handing it over.
+                self.stages.add(corrected_ns, -1, now_ns() - curr_time)
 
     async def connect(self):
-        self.client = await AsyncClient.create()
-        self.socket = BinanceSocketManager(self.client)
+        if self.supervisor is None:
+            await self._listen()
+        else:
+            await self.supervisor.run_async(self.conn_id, self._listen)
+
+    async def _listen(self):
+        # Local import, python-binance and its aiohttp stack are only needed by this connector.
+        from binance import AsyncClient, BinanceSocketManager
+        if self.url is None:
+            self.client = await AsyncClient.create()
+            self.socket = BinanceSocketManager(self.client)
+        else:
+            # Custom endpoint (e.g. the local mock server): skip the REST ping of AsyncClient.create and point the
+            # futures streams of the socket manager to the base of the given raw stream url.
+            self.client = AsyncClient()
+            self.socket = BinanceSocketManager(self.client)
+            base_url = self.url.rstrip("/")
+            if base_url.endswith("/ws"):
+                base_url = base_url[:-len("/ws")]
+            self.socket.FSTREAM_URL = base_url + "/"
 
-        async with self.socket.futures_depth_socket(self.ticker) as stream:
-            while True:
-                message = await stream.recv()
-                curr_time = time.time_ns() // 1e6
-                await self.put_data(message["data"], curr_time)
+        try:
+            async with self.socket.futures_depth_socket(self.ticker) as stream:
+                while True:
+                    message = await stream.recv()
+                    curr_time = now_ns()
+                    self.put_data(message["data"], curr_time)
+        finally:
+            # A supervised connection opens a new client for every session.
+            if self.supervisor is not None:
+                await self.client.close_connection()
 
     async def close_connection(self):
         await self.client.close_connection()
 
-    @staticmethod
-    async def consume_queue(q: asyncio.Queue):
-        data_l = []
-        while not q.empty():
-            item = await q.get()
-            data_l.append(item)
-        return data_l
-
-    async def get_data(self) -> Tuple[List[int], ...]:
-        update_ids, client_timestamps, delays = await asyncio.gather(
-            AsyncWSv1.consume_queue(self.update_ids),
-            AsyncWSv1.consume_queue(self.client_timestamps),
-            AsyncWSv1.consume_queue(self.delays)
-        )
-        return update_ids, client_timestamps, delays
+    def get_data(self) -> Tuple[List[int], ...]:
+        return self.recorder.columns()
 
 
 class AsyncWSv2:
-    def __init__(self, url, ticker, num_subs):
+    """
+    Single websocket multiplexing ``num_subs`` subscribers. The socket is the only connection of a
+    ``subscriptions.SubscriptionManager``, which switches it to combined payloads with ``SET_PROPERTY``; its receive
+    loop routes every frame by its stream prefix through a ``subscriptions.StreamRouter``, which decodes the frame once
+    and hands the event to all subscribers of that stream. Subscribers of one stream record identical rows, so each
+    frame is offered to the fan-in once, by the first subscriber of its stream.
+    """
+
+    def __init__(self, url, ticker, num_subs, fan_in: Optional[FirstArrivalFanIn] = None,
+                 decoder: Callable[[str], Optional[dict]] = decode_json, metrics: Optional[MetricsRegistry] = None,
+                 supervisor: Optional[ConnectionSupervisor] = None,
+                 sequences: Optional[List[SequenceTracker]] = None, streams: Optional[Sequence[str]] = None,
+                 stages: Optional[List[StageHistograms]] = None):
         self.url = url
         self.ticker = ticker
-        self.num_subs = num_subs
-        self.socket = websockets.connect(url)
-        self.client_timestamps_l = [asyncio.Queue() for _ in range(num_subs)]
-        self.delays_l = [asyncio.Queue() for _ in range(num_subs)]
-        self.update_ids_l = [asyncio.Queue() for _ in range(num_subs)]
+        # Stream of every subscriber, by default all of them share the bookTicker stream of the ticker.
+        self.streams = list(streams) if streams is not None else [f"{ticker}@bookTicker"] * num_subs
+        self.num_subs = len(self.streams)
+        self.fan_in = fan_in
+        self.decoder = decoder
+        self.metrics = metrics
+        self.supervisor = supervisor
+        self.sequences = sequences
+        self.stages = stages
+        subscribers: Dict[str, Tuple[int, ...]] = dict()
+        for idx, stream in enumerate(self.streams):
+            subscribers[stream] = subscribers.get(stream, ()) + (idx,)
+        self.router = StreamRouter(decoder=decoder)
+        for stream, idxs in subscribers.items():
+            self.router.add(stream, partial(self.put_data, idxs=idxs))
+        self.manager = SubscriptionManager(url, list(subscribers), self.router, max_streams=len(subscribers),
+                                           negotiate=True)
+        self.recorders = [SampleRecorder() for _ in range(self.num_subs)]
+        self.clock_offset = shared_estimator().channel()
 
-    async def put_data(self, data, curr_time, idx):
-        if data is not None:
-            await self.update_ids_l[idx].put(data["u"])
-            await self.delays_l[idx].put(curr_time - data["E"])
-            await self.client_timestamps_l[idx].put(curr_time)
-
-    async def set_combined(self):
-        set_combined = json.dumps({"method": "SET_PROPERTY", "params": ["combined", True], "id": 201})
-        async with self.socket as sock:
-            await sock.send(set_combined)
-            return await sock.recv()
-
-    async def get_combined(self):
-        get_combined = json.dumps({"method": "GET_PROPERTY", "params": ["combined"], "id": 202})
-        async with self.socket as sock:
-            await sock.send(get_combined)
-            return await sock.recv()
-
-    async def subscribe(self, idx):
-        sub_future = json.dumps({"method": "SUBSCRIBE", "params": [f"{self.ticker}@bookTicker"], "id": idx})
-        async with self.socket as sock:
-            await sock.send(sub_future)
-            combined = json.loads(await self.get_combined())["result"]
-            while True:
-                resp = await sock.recv()
-                if not combined:
-                    resp = json.loads(resp)
-                else:
-                    resp = json.loads(resp)["data"]
-                if "id" not in resp.keys():
-                    curr_time = time.time_ns() // 1e6
-                    await self.put_data(resp, curr_time, idx)
-
-    async def make_multiple_subscriptions(self):
-        await asyncio.gather(*[self.subscribe(idx) for idx in range(self.num_subs)])
-
-    @staticmethod
-    async def consume_queue(q: asyncio.Queue):
-        data_l = []
-        while not q.empty():
-            item = await q.get()
-            data_l.append(item)
-        return data_l
-
-    async def get_data(self) -> Tuple[List[List[int]], ...]:
-        client_timestamps_l = [list() for _ in range(self.num_subs)]
-        delays_l = [list() for _ in range(self.num_subs)]
-        update_ids_l = [list() for _ in range(self.num_subs)]
-
-        for idx in range(self.num_subs):
-            update_ids_l[idx], client_timestamps_l[idx], delays_l[idx] = await asyncio.gather(
-                AsyncWSv2.consume_queue(self.update_ids_l[idx]),
-                AsyncWSv2.consume_queue(self.client_timestamps_l[idx]),
-                AsyncWSv2.consume_queue(self.delays_l[idx])
-            )
-        return update_ids_l, client_timestamps_l, delays_l
+    def put_data(self, data, curr_time, idxs: Tuple[int, ...]):
+        # Called right after the frame is routed and decoded.
+        decoded = now_ns() if self.stages is not None else 0
+        update_id, event_time, transaction_time = data["u"], data["E"], data.get("T", 0)
+        offset_ns = self.clock_offset.update(curr_time, event_time, transaction_time)
+        row = (update_id, event_time, transaction_time, curr_time, offset_ns)
+        delay_ns = curr_time - event_time * 1_000_000
+        corrected_ns = curr_time - (transaction_time or event_time) * 1_000_000 - offset_ns
+        for idx in idxs:
+            self.recorders[idx].append(row)
+            if self.metrics is not None:
+                self.metrics.connections[idx].record(curr_time, corrected_ns)
+            if self.supervisor is not None:
+                self.supervisor.heartbeat(idx, curr_time, update_id, delay_ns)
+            if self.sequences is not None:
+                self.sequences[idx].update(data)
+        if self.fan_in is not None:
+            self.fan_in.offer(idxs[0], update_id, data, curr_time)
+        if self.stages is not None:
+            recorded = now_ns()
+            for idx in idxs:
+                self.stages[idx].add(corrected_ns, decoded - curr_time, recorded - decoded)
+
+    async def run(self):
+        session = partial(self.manager.session, 0)
+        if self.supervisor is None:
+            await session()
+        else:
+            # One physical socket, supervised as connection 0.
+            await self.supervisor.run_async(0, session)
+
+    def get_data(self) -> Tuple[List[List[int]], ...]:
+        return collect_columns(self.recorders)
 
     async def close_socket(self):
-        async with self.socket as sock:
-            await sock.close()
+        await self.manager.close()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import asyncio
+from bisect import bisect_left, insort
+from collections import deque
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Project modules
+from clock import now_ns
+from metrics import LogHistogram
+
+__all__ = [
+    "BookSide",
+    "LocalOrderBook",
+    "OrderBook",
+    "binance_snapshot_source",
+    "ws_snapshot_source"
+]
+
+Level = Tuple[float, float]
+
+
+class BookSide:
+    """
+    Price levels of one side of a book: a dict from price to quantity and the sorted list of its keys. Keys of the bid
+    side are negated prices, so that the best level of both sides is the first key. Lookups are binary searches in
+    O(log n), insertions or removals of a level are O(n) list shifts rather than the O(log n) of a balanced tree; with a
+    few thousand levels they are a single memmove, cheaper in CPython than any pure Python tree.
+    """
+
+    def __init__(self, descending: bool = False):
+        """
+        :param descending: True for bids, best price first being the highest one
+        :type descending: bool
+        """
+        self.sign = -1.0 if descending else 1.0
+        self.keys: List[float] = list()
+        self.levels: Dict[float, float] = dict()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def clear(self) -> None:
+        self.keys.clear()
+        self.levels.clear()
+
+    def update(self, price: float, qty: float) -> None:
+        """
+        Set the quantity of a level, a zero quantity removes it.
+        """
+        if qty == 0.0:
+            if self.levels.pop(price, None) is not None:
+                del self.keys[bisect_left(self.keys, self.sign * price)]
+        else:
+            if price not in self.levels:
+                insort(self.keys, self.sign * price)
+            self.levels[price] = qty
+
+    def apply(self, levels: Iterable[Sequence[str]]) -> None:
+        """
+        :param levels: ``[price, quantity]`` string pairs of a depth event or snapshot
+        :type levels: Iterable[Sequence[str]]
+        """
+        for price, qty in levels:
+            self.update(float(price), float(qty))
+
+    def best(self) -> Optional[Level]:
+        if not self.keys:
+            return None
+        price = self.sign * self.keys[0]
+        return price, self.levels[price]
+
+    def top(self, n: int) -> List[Level]:
+        """
+        :return List[Level]: best ``n`` levels, best first
+        """
+        levels = self.levels
+        return [(price, levels[price]) for price in (self.sign * key for key in self.keys[:n])]
+
+
+class OrderBook:
+    """
+    Price level book of one symbol.
+    """
+
+    def __init__(self):
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide()
+
+    def load(self, bids: Iterable[Sequence[str]], asks: Iterable[Sequence[str]]) -> None:
+        self.bids.clear()
+        self.asks.clear()
+        self.bids.apply(bids)
+        self.asks.apply(asks)
+
+    def apply(self, data: dict) -> None:
+        """
+        :param data: depth event with ``b`` and ``a`` level updates
+        :type data: dict
+        """
+        self.bids.apply(data["b"])
+        self.asks.apply(data["a"])
+
+    def best_bid(self) -> Optional[Level]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[Level]:
+        return self.asks.best()
+
+    def top(self, n: int = 10) -> Tuple[List[Level], List[Level]]:
+        """
+        :return Tuple[List[Level], List[Level]]: best ``n`` bid and ask levels
+        """
+        return self.bids.top(n), self.asks.top(n)
+
+
+class LocalOrderBook:
+    """
+    Local book maintained from a diff depth stream, following the Binance futures procedure: events are buffered until
+    a snapshot is loaded, events older than the snapshot are dropped, the first applied one must straddle the
+    snapshot's ``lastUpdateId`` and every next one must continue the ``pu`` / ``u`` chain. A break of the chain drops
+    the book and triggers a new snapshot. ``on_event`` has the fan-in sink signature, so the book can be fed with the
+    first arrivals of redundant connections. It is not thread-safe and has to be fed from the event loop of
+    ``maintain``.
+    """
+
+    def __init__(self, symbol: str, max_buffer: int = 10000):
+        """
+        :param symbol: symbol of the book
+        :type symbol: str
+        :param max_buffer: maximal number of events buffered while waiting for a snapshot
+        :type max_buffer: int
+        """
+        self.symbol = symbol.upper()
+        self.book = OrderBook()
+        self.synced = False
+        self.last_u = 0
+        self.applied = 0
+        self.dropped = 0
+        self.resyncs = 0
+        # Event time to book updated, and receive to book updated, in microseconds.
+        self.update_latency = LogHistogram()
+        self.apply_latency = LogHistogram()
+        self._expect_first = False
+        self._buffer = deque(maxlen=max_buffer)
+        self._need_snapshot: Optional[asyncio.Event] = None
+
+    def on_event(self, conn_id: int, data: dict, recv_ns: int) -> None:
+        """
+        Feed a depth event.
+
+        :param conn_id: index of the connection which received the event
+        :type conn_id: int
+        :param data: decoded depth event
+        :type data: dict
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        """
+        if self.synced:
+            self._apply(data, recv_ns, True)
+        else:
+            self._buffer.append((data, recv_ns))
+
+    def _apply(self, data: dict, recv_ns: int, live: bool) -> None:
+        if self._expect_first:
+            if data["u"] < self.last_u:
+                self.dropped += 1
+                return
+            if data["U"] > self.last_u and data["pu"] != self.last_u:
+                self._resync(data, recv_ns, "snapshot is older than the stream")
+                return
+            self._expect_first = False
+        elif data["pu"] != self.last_u:
+            self._resync(data, recv_ns, f"pu {data['pu']} does not continue u {self.last_u}")
+            return
+        self.book.apply(data)
+        self.last_u = data["u"]
+        self.applied += 1
+        if live:
+            done = now_ns()
+            self.update_latency.record((done - data["E"] * 1_000_000) // 1000)
+            self.apply_latency.record((done - recv_ns) // 1000)
+
+    def _resync(self, data: dict, recv_ns: int, reason: str) -> None:
+        getLogger(f"{__name__}.resync").warning(f"Order book of {self.symbol} out of sync: {reason}")
+        self.synced = False
+        self.resyncs += 1
+        self._buffer.clear()
+        self._buffer.append((data, recv_ns))
+        if self._need_snapshot is not None:
+            self._need_snapshot.set()
+
+    def load_snapshot(self, snapshot: dict) -> bool:
+        """
+        Load a snapshot and apply the buffered events on top of it.
+
+        :param snapshot: ``lastUpdateId``, ``bids`` and ``asks`` of a depth snapshot
+        :type snapshot: dict
+        :return bool: True if the book is in sync afterwards
+        """
+        self.book.load(snapshot["bids"], snapshot["asks"])
+        self.last_u = snapshot["lastUpdateId"]
+        self.synced, self._expect_first = True, True
+        events = list(self._buffer)
+        self._buffer.clear()
+        for data, recv_ns in events:
+            if self.synced:
+                self._apply(data, recv_ns, False)
+            else:
+                self._buffer.append((data, recv_ns))
+        return self.synced
+
+    async def maintain(self, snapshot_source: Callable[[], Awaitable[dict]], retry_s: float = 1.0) -> None:
+        """
+        Load a snapshot at start and after every loss of sync, until cancelled.
+
+        :param snapshot_source: coroutine function returning a depth snapshot
+        :type snapshot_source: Callable[[], Awaitable[dict]]
+        :param retry_s: pause in seconds before a new snapshot after a failed one
+        :type retry_s: float
+        """
+        self._need_snapshot = asyncio.Event()
+        self._need_snapshot.set()
+        while True:
+            await self._need_snapshot.wait()
+            self._need_snapshot.clear()
+            try:
+                snapshot = await snapshot_source()
+            except Exception as e:
+                getLogger(f"{__name__}.maintain").error(f"Failed to get snapshot of {self.symbol}: {e}")
+                snapshot = None
+            if snapshot is None or not self.load_snapshot(snapshot):
+                await asyncio.sleep(retry_s)
+                self._need_snapshot.set()
+
+    def summary(self, levels: int = 5) -> Dict:
+        """
+        :param levels: number of top levels of each side to include
+        :type levels: int
+        :return Dict: state, counters and latency percentiles in microseconds of the book
+        """
+        bids, asks = self.book.top(levels)
+        return {
+            "symbol": self.symbol,
+            "synced": self.synced,
+            "last_update_id": self.last_u,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "bids": bids,
+            "asks": asks,
+            "update_latency_us": {"p50": self.update_latency.quantile(0.5),
+                                  "p99": self.update_latency.quantile(0.99), "max": self.update_latency.max},
+            "apply_latency_us": {"p50": self.apply_latency.quantile(0.5),
+                                 "p99": self.apply_latency.quantile(0.99), "max": self.apply_latency.max}
+        }
+
+
+def binance_snapshot_source(symbol: str, limit: int = 1000) -> Callable[[], Awaitable[dict]]:
+    """
+    :return Callable[[], Awaitable[dict]]: coroutine function fetching a snapshot from the futures REST API
+    """
+
+    async def fetch() -> dict:
+        # Local import, the REST client is only needed for live books.
+        from binance import AsyncClient
+        client = await AsyncClient.create()
+        try:
+            return await client.futures_order_book(symbol=symbol.upper(), limit=limit)
+        finally:
+            await client.close_connection()
+
+    return fetch
+
+
+def ws_snapshot_source(url: str, symbol: str, limit: int = 1000) -> Callable[[], Awaitable[dict]]:
+    """
+    :return Callable[[], Awaitable[dict]]: coroutine function fetching a snapshot with a websocket API ``depth``
+        request, e.g. from the local mock server
+    """
+
+    async def fetch() -> dict:
+        import websockets
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps({"method": "depth", "params": {"symbol": symbol.upper(), "limit": limit},
+                                      "id": 1}))
+            return json.loads(await ws.recv())["result"]
+
+    return fetch
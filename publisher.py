@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import time
+import struct
+import argparse
+import threading
+from logging import getLogger
+from multiprocessing import shared_memory
+from typing import Iterator, List, NamedTuple
+
+# Project modules
+from clock import now_ns
+
+__all__ = [
+    "DEFAULT_NAME",
+    "Tick",
+    "TickPublisher",
+    "TickSubscriber"
+]
+
+DEFAULT_NAME = "bfc_ticks"
+
+# Header: magic, capacity, slot size and sequence number of the last published tick, padded to a cache line.
+_HEADER = struct.Struct("<8sqqq32x")
+_MAGIC = b"BFCTICK1"
+_HEAD_OFFSET = 24
+# Slot: sequence number, symbol, update id, bid price, bid qty, ask price, ask qty, event time, receive time.
+_SLOT = struct.Struct("<q16sqddddqq")
+_SEQ = struct.Struct("<q")
+# Blocks created by publishers of this process, whose registration for removal at exit subscribers must keep.
+_CREATED = set()
+
+
+class Tick(NamedTuple):
+    seq: int
+    symbol: str
+    update_id: int
+    bid_price: float
+    bid_qty: float
+    ask_price: float
+    ask_qty: float
+    event_time: int
+    recv_ns: int
+
+
+class TickPublisher:
+    """
+    Single-producer multi-consumer ring of ``bookTicker`` updates in shared memory. Every slot starts with the
+    sequence number of its tick, written negated before the tick and positive after it, and the header holds the
+    sequence number of the last complete tick. Subscribers read slots in place and check both sequence numbers, so
+    there is no serialization, lock or socket between the feed and the consumer processes. A slow subscriber is
+    overrun rather than slowing down the publisher.
+    """
+
+    def __init__(self, name: str = DEFAULT_NAME, capacity: int = 65536, symbol: str = ""):
+        """
+        :param name: name of the shared memory block, subscribers attach to it by name
+        :type name: str
+        :param capacity: number of slots of the ring
+        :type capacity: int
+        :param symbol: symbol of events without an ``s`` field
+        :type symbol: str
+        """
+        if capacity <= 0:
+            raise ValueError(f"Ring capacity must be positive, got {capacity}!")
+        self.name = name
+        self.capacity = capacity
+        self.symbol = symbol.upper()
+        self.seq = 0
+        self.shm = shared_memory.SharedMemory(name, create=True, size=_HEADER.size + capacity * _SLOT.size)
+        _CREATED.add(name)
+        self._buf = self.shm.buf
+        _HEADER.pack_into(self._buf, 0, _MAGIC, capacity, _SLOT.size, 0)
+        # Fan-in sinks are called by several receive threads, the ring needs a single producer.
+        self._lock = threading.Lock()
+
+    def publish(self, symbol: str, update_id: int, bid_price: float, bid_qty: float, ask_price: float, ask_qty: float,
+                event_time: int, recv_ns: int) -> int:
+        """
+        :return int: sequence number of the published tick, 0 once the publisher is closed
+        """
+        with self._lock:
+            if self._buf is None:
+                return 0
+            seq = self.seq + 1
+            offset = _HEADER.size + (seq % self.capacity) * _SLOT.size
+            _SLOT.pack_into(self._buf, offset, -seq, symbol.encode(), update_id, bid_price, bid_qty, ask_price,
+                            ask_qty, event_time, recv_ns)
+            _SEQ.pack_into(self._buf, offset, seq)
+            _SEQ.pack_into(self._buf, _HEAD_OFFSET, seq)
+            self.seq = seq
+        return seq
+
+    def on_event(self, conn_id: int, data: dict, recv_ns: int) -> None:
+        """
+        Fan-in sink publishing every first arrival of a ``bookTicker`` event, see ``fanin.FirstArrivalFanIn``. Prices
+        missing from the event, e.g. of MWMP workers which only send update ids and timestamps, are published as NaN.
+        The fan-in calls it under its lock, so ticks are published in the order the updates first arrived.
+        """
+        self.publish(data.get("s", self.symbol), data["u"], float(data.get("b", "nan")), float(data.get("B", "nan")),
+                     float(data.get("a", "nan")), float(data.get("A", "nan")), data["E"], recv_ns)
+
+    def close(self) -> None:
+        """
+        Release and remove the shared memory block; attached subscribers keep their mapping until they close. Ticks
+        published afterwards, e.g. by receive threads still running, are discarded.
+        """
+        with self._lock:
+            if self._buf is None:
+                return
+            self._buf.release()
+            self._buf = None
+        self.shm.close()
+        self.shm.unlink()
+        _CREATED.discard(self.name)
+        getLogger(f"{__name__}.close").info(f"Published {self.seq} ticks to shared memory {self.name}")
+
+
+class TickSubscriber:
+    """
+    Reader of a ``TickPublisher`` ring from any local process. Ticks are read in publication order; ticks overwritten
+    before they were read are counted in ``lost``.
+    """
+
+    def __init__(self, name: str = DEFAULT_NAME, from_start: bool = False):
+        """
+        :param name: name of the shared memory block of the publisher
+        :type name: str
+        :param from_start: start with the oldest tick still in the ring instead of the next published one
+        :type from_start: bool
+        """
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 an attached block is registered for removal at exit, as if it had been created here.
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name)
+            if name not in _CREATED:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self._buf = self.shm.buf
+        magic, self.capacity, slot_size, head = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC or slot_size != _SLOT.size:
+            raise ValueError(f"Shared memory {name} is not a tick ring of this version!")
+        self.name = name
+        self.lost = 0
+        self.next_seq = max(1, head - self.capacity + 1) if from_start else head + 1
+
+    def poll(self, max_ticks: int = 0) -> List[Tick]:
+        """
+        :param max_ticks: maximal number of ticks to read, 0 for all available
+        :type max_ticks: int
+        :return List[Tick]: ticks published since the previous call, oldest first
+        """
+        buf, capacity = self._buf, self.capacity
+        head = _SEQ.unpack_from(buf, _HEAD_OFFSET)[0]
+        if head - self.next_seq >= capacity:
+            self.lost += head - capacity + 1 - self.next_seq
+            self.next_seq = head - capacity + 1
+        last = head if not max_ticks else min(head, self.next_seq + max_ticks - 1)
+        ticks = list()
+        while self.next_seq <= last:
+            offset = _HEADER.size + (self.next_seq % capacity) * _SLOT.size
+            record = _SLOT.unpack_from(buf, offset)
+            # Both sequence numbers match only if the slot was not rewritten while it was read.
+            if record[0] == self.next_seq and _SEQ.unpack_from(buf, offset)[0] == self.next_seq:
+                ticks.append(Tick(record[0], record[1].rstrip(b"\0").decode(), *record[2:]))
+            else:
+                self.lost += 1
+            self.next_seq += 1
+        return ticks
+
+    def ticks(self, poll_interval: float = 0.0001) -> Iterator[Tick]:
+        """
+        :param poll_interval: pause in seconds when no tick is available, 0 to spin
+        :type poll_interval: float
+        :return Iterator[Tick]: endless iterator over published ticks
+        """
+        while True:
+            ticks = self.poll()
+            if not ticks and poll_interval:
+                time.sleep(poll_interval)
+            yield from ticks
+
+    def close(self) -> None:
+        self._buf.release()
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subscribe to the ticks published by main.py --publish and report "
+                                                 "their rate and hand-off latency.",
+                                     usage="python publisher.py [name] [options]")
+    parser.add_argument("name", type=str, nargs="?", default=DEFAULT_NAME, help=f"Shared memory name. Default "
+                                                                                f"{DEFAULT_NAME}.")
+    parser.add_argument("-i", "--interval", type=float, default=1.0, help="Report interval in seconds. Default 1.")
+    parser.add_argument("-t", "--timeout", type=float, default=0, help="Run time in seconds. Default 0, forever.")
+    cli_args = parser.parse_args()
+
+    subscriber = TickSubscriber(cli_args.name)
+    start = report_at = time.monotonic()
+    received, latencies, last_tick = 0, list(), None
+    try:
+        for tick in subscriber.ticks():
+            # Both processes anchor now_ns to the same wall clock, so the difference is the hand-off latency.
+            latencies.append(now_ns() - tick.recv_ns)
+            received += 1
+            last_tick = tick
+            now = time.monotonic()
+            if now >= report_at + cli_args.interval:
+                latencies.sort()
+                p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+                print(f"{received} ticks, lost {subscriber.lost}, hand-off p50 {p50 / 1e3:.1f} us, "
+                      f"p99 {p99 / 1e3:.1f} us, last {last_tick}")
+                latencies, report_at = list(), now
+            if cli_args.timeout and now - start >= cli_args.timeout:
+                break
+    finally:
+        subscriber.close()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+from array import array
+from typing import List, Sequence, Tuple
+
+__all__ = [
+    "SampleRecorder",
+    "collect_columns"
+]
+
+
+class SampleRecorder:
+    """
+    Compact recorder of per-message samples. Rows are stored back to back in a single growable int64 buffer, so
+    recording a message is one ``extend`` call without locks or boxed Python objects kept alive per value.
+    Columns are sliced out of the buffer only when the data is read.
+    """
+    FIELDS = ("update_id", "event_time", "transaction_time", "client_time_ns", "offset_ns")
+
+    def __init__(self, fields: Sequence[str] = FIELDS):
+        """
+        :param fields: names of the int64 columns of each row
+        :type fields: Sequence[str]
+        """
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self._buf = array("q")
+        # Hot path: ``append((update_id, event_time, ...))`` goes straight to ``array.extend``.
+        self.append = self._buf.extend
+
+    def __len__(self) -> int:
+        return len(self._buf) // self.width
+
+    def column(self, name: str) -> array:
+        """
+        :param name: column name
+        :type name: str
+        :return array: int64 values of the column
+        """
+        return self._buf[self.fields.index(name)::self.width]
+
+    def pop_rows(self, num_rows: int) -> array:
+        """
+        Remove the oldest ``num_rows`` rows from the recorder and return them. Safe to call from another thread while
+        the connection keeps appending, since both operations are single calls on the buffer under the GIL and
+        appends only touch its end.
+
+        :param num_rows: number of rows to remove
+        :type num_rows: int
+        :return array: removed rows, flat
+        """
+        num_values = num_rows * self.width
+        rows = self._buf[:num_values]
+        del self._buf[:num_values]
+        return rows
+
+    def extend_rows(self, rows: bytes) -> None:
+        """
+        Append flat rows in the raw int64 layout of ``pop_rows``, e.g. received from another process.
+
+        :param rows: raw bytes of flat rows
+        :type rows: bytes
+        """
+        self._buf.frombytes(rows)
+
+    def columns(self) -> Tuple[List[int], ...]:
+        """
+        :return Tuple[List[int], ...]: all columns, in the order of ``fields``
+        """
+        return tuple(self._buf[i::self.width].tolist() for i in range(self.width))
+
+
+def collect_columns(recorders: Sequence[SampleRecorder]) -> Tuple[List[List[int]], ...]:
+    """
+    Transpose the columns of several recorders into per-field lists, e.g. ``update_ids_l, event_times_l, ...`` for
+    the default fields.
+
+    :param recorders: one recorder per connection
+    :type recorders: Sequence[SampleRecorder]
+    :return Tuple[List[List[int]], ...]: for each field, the list of its columns over all recorders
+    """
+    if not recorders:
+        return tuple(list() for _ in SampleRecorder.FIELDS)
+    return tuple(list(field_columns) for field_columns in zip(*[recorder.columns() for recorder in recorders]))
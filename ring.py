@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import time
+import threading
+from logging import getLogger
+from typing import Any, Callable, List, Tuple
+
+__all__ = [
+    "FrameRing",
+    "RingConsumer"
+]
+
+
+class FrameRing:
+    """
+    Fixed capacity single-producer single-consumer ring of raw frames and their receive times. The producer only
+    writes its slots and then advances ``head``, the consumer only reads slots below ``head`` and then advances
+    ``tail``, so neither side takes a lock: every index update is a single attribute store under the GIL. A full ring
+    drops the new frame instead of blocking the receive thread, and counts it in ``dropped``.
+    """
+
+    def __init__(self, capacity: int = 65536):
+        """
+        :param capacity: maximal number of frames waiting for the consumer
+        :type capacity: int
+        """
+        if capacity <= 0:
+            raise ValueError(f"Ring capacity must be positive, got {capacity}!")
+        self.capacity = capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self._times: List[int] = [0] * capacity
+        self._frames: List[Any] = [None] * capacity
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def push(self, frame, recv_ns: int) -> bool:
+        """
+        Producer side, called by the receive thread only.
+
+        :param frame: raw websocket frame
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :return bool: False if the ring was full and the frame was dropped
+        """
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = head % self.capacity
+        self._frames[slot] = frame
+        self._times[slot] = recv_ns
+        self.head = head + 1
+        return True
+
+    def drain(self, max_frames: int = 0) -> Tuple[List[int], List[Any]]:
+        """
+        Consumer side, called by the consumer thread only.
+
+        :param max_frames: maximal number of frames to take, 0 for all available
+        :type max_frames: int
+        :return Tuple[List[int], List[Any]]: receive times and frames, oldest first
+        """
+        tail, head = self.tail, self.head
+        if max_frames:
+            head = min(head, tail + max_frames)
+        if head == tail:
+            return [], []
+        start, stop = tail % self.capacity, head % self.capacity
+        # Drained slots are cleared before they are handed back to the producer, so the ring does not keep every frame
+        # of the last ``capacity`` alive.
+        if start < stop:
+            times, frames = self._times[start:stop], self._frames[start:stop]
+            self._frames[start:stop] = [None] * (stop - start)
+        else:
+            times = self._times[start:] + self._times[:stop]
+            frames = self._frames[start:] + self._frames[:stop]
+            self._frames[start:] = [None] * (self.capacity - start)
+            self._frames[:stop] = [None] * stop
+        self.tail = head
+        return times, frames
+
+
+class RingConsumer(threading.Thread):
+    """
+    Daemon thread draining any number of ``FrameRing``, in batches and round robin, and passing every frame to the
+    handler of its ring. One consumer serves all connections of a run, so the receive threads share a single extra
+    thread. It polls with a short sleep when all rings are empty, so the producers never have to signal it.
+    """
+
+    def __init__(self, batch_size: int = 256, poll_interval: float = 0.001):
+        """
+        :param batch_size: maximal number of frames taken from one ring at once
+        :type batch_size: int
+        :param poll_interval: pause in seconds when all rings are empty
+        :type poll_interval: float
+        """
+        super().__init__(daemon=True)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.batches = 0
+        self.max_backlog = 0
+        self._rings: Tuple[Tuple[FrameRing, Callable[[Any, int], Any]], ...] = ()
+        self._stop_event = threading.Event()
+
+    def add(self, ring: FrameRing, handle: Callable[[Any, int], Any]) -> None:
+        """
+        :param ring: ring to drain, filled by one producer thread
+        :type ring: FrameRing
+        :param handle: called as ``handle(frame, recv_ns)`` for every frame of the ring, in receive order
+        :type handle: Callable[[Any, int], Any]
+        """
+        # Replaced at once, the running loop keeps iterating over the previous tuple.
+        self._rings = self._rings + ((ring, handle),)
+
+    def _drain_all(self) -> int:
+        handled = 0
+        for ring, handle in self._rings:
+            backlog = len(ring)
+            if not backlog:
+                continue
+            if backlog > self.max_backlog:
+                self.max_backlog = backlog
+            times, frames = ring.drain(self.batch_size)
+            self.batches += 1
+            handled += len(frames)
+            for frame, recv_ns in zip(frames, times):
+                try:
+                    handle(frame, recv_ns)
+                except Exception as e:
+                    getLogger(f"{__name__}._drain_all").exception(f"Failed to handle frame {frame!r}: {e}")
+        return handled
+
+    def run(self) -> None:
+        while True:
+            if not self._drain_all():
+                if self._stop_event.is_set():
+                    return
+                time.sleep(self.poll_interval)
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Handle the frames still in the rings, then end the thread.
+
+        :param timeout: maximal time in seconds to wait for the thread
+        :type timeout: float
+        """
+        self._stop_event.set()
+        self.join(timeout)
+        dropped = sum(ring.dropped for ring, _ in self._rings)
+        if dropped:
+            getLogger(f"{__name__}.stop").warning(f"Ring overflow dropped {dropped} frames, max backlog "
+                                                  f"{self.max_backlog} of {self._rings[0][0].capacity}")
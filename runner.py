@@ -1,24 +1,53 @@
 # -*- coding: utf-8 -*-
 
 # Standard modules
+import os
 import time
+import heapq
+import logging
 import threading
 import asyncio
-import queue
-from typing import List, Tuple
+import multiprocessing as mp
+from multiprocessing.connection import Connection, wait
+from typing import TYPE_CHECKING, List, Tuple, Optional, Sequence, Union
 
 # Project-modules
 from network import ThreadedWS, AsyncWSv1, AsyncWSv2
-from constants import ProjectConstants
+from binance_logger import init_worker_logger, worker_log_listener
+from clock import get_anchor, now_ns, set_anchor, shared_estimator
+from codec import get_decoder
+from fanin import FirstArrivalFanIn
+from metrics import MetricsRegistry
+from orderbook import LocalOrderBook, binance_snapshot_source, ws_snapshot_source
+from recorder import SampleRecorder, collect_columns
+from ring import RingConsumer
+from sequence import SequenceTracker
+from settings import BINANCE_FUTURES_WS, Settings
+from stages import LatencyBreakdown, StageHistograms
+from subscriptions import MAX_STREAMS_PER_CONNECTION, StreamRouter, SubscriptionManager, recording_handler
+from supervisor import ConnectionSupervisor
+
+if TYPE_CHECKING:
+    # Only for annotations, storage pulls in numpy.
+    import numpy as np
+    from storage import ChunkedCaptureWriter
 
 __all__ = [
+    "run_method",
+    "run_MWMP",
     "run_MWMT",
+    "run_MULTI",
     "run_MWST",
     "run_SWST"
 ]
 
 
-def run_MWMT(ticker: str, timeout: int, num_thread: int) -> Tuple[List[List[int]], ...]:
+def run_MWMT(ticker: str, timeout: int, num_thread: int, fan_in: Optional[FirstArrivalFanIn] = None,
+             writer: Optional["ChunkedCaptureWriter"] = None, url: str = BINANCE_FUTURES_WS,
+             decoder: str = "json", metrics: Optional[MetricsRegistry] = None,
+             supervisor: Optional[ConnectionSupervisor] = None,
+             sequences: Optional[List[SequenceTracker]] = None, batch_size: int = 0,
+             ring_capacity: int = 65536, stages: Optional[LatencyBreakdown] = None) -> Tuple[List[List[int]], ...]:
     """
     Run multiple websockets via multiple threads. For each connection will be opened a new websocket,
     which will be managed by his own thread.
@@ -29,31 +58,76 @@ def run_MWMT(ticker: str, timeout: int, num_thread: int) -> Tuple[List[List[int]
     :type timeout: int
     :param num_thread: number of connections
     :type num_thread: int
-    :return Tuple[List[List[int]], ...]: list of update ids, client timestamps and delays for each connection
+    :param fan_in: optional first-arrival fan-in fed by all connections
+    :type fan_in: Optional[FirstArrivalFanIn]
+    :param writer: optional writer streaming samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param url: futures websocket endpoint, e.g. of the local mock server
+    :type url: str
+    :param decoder: name of the frame decoder, see ``codec.DECODERS``
+    :type decoder: str
+    :param metrics: optional live metrics of the connections
+    :type metrics: Optional[MetricsRegistry]
+    :param supervisor: optional supervisor reconnecting and replacing unhealthy connections
+    :type supervisor: Optional[ConnectionSupervisor]
+    :param sequences: optional update id sequence trackers, one per connection
+    :type sequences: Optional[List[SequenceTracker]]
+    :param batch_size: if positive, receive threads only stamp and queue raw frames, which a single consumer thread
+        decodes and records in batches of this size
+    :type batch_size: int
+    :param ring_capacity: maximal number of frames waiting in the ring buffer of each connection in batched mode
+    :type ring_capacity: int
+    :param stages: optional per-stage latency breakdown of the connections, its thread probe is run by the caller
+    :type stages: Optional[LatencyBreakdown]
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every connection
     """
     threads_l = list()
-    client_timestamps_l = [queue.Queue() for _ in range(num_thread)]
-    delays_l = [queue.Queue() for _ in range(num_thread)]
-    update_ids_l = [queue.Queue() for _ in range(num_thread)]
+    recorders = [SampleRecorder() for _ in range(num_thread)]
+    consumer = RingConsumer(batch_size) if batch_size > 0 else None
+
+    if writer is not None:
+        writer.start(recorders)
+    if supervisor is not None:
+        supervisor.start()
+    if consumer is not None:
+        consumer.start()
 
-    for client_timestamps, delays, update_ids in zip(client_timestamps_l, delays_l, update_ids_l):
+    for conn_id, recorder in enumerate(recorders):
         thr = threading.Thread(target=ThreadedWS, args=(
-            ProjectConstants.BINANCE_FUTURES_WS, ticker,
-            client_timestamps, delays, update_ids))
+            url, ticker, recorder, conn_id, fan_in, get_decoder(decoder),
+            metrics.connections[conn_id] if metrics is not None else None, supervisor,
+            sequences[conn_id] if sequences is not None else None, consumer, ring_capacity,
+            stages.connections[conn_id] if stages is not None else None))
         threads_l.append(thr)
         thr.start()
 
     time.sleep(timeout)
+    if supervisor is not None:
+        # Closes the supervised sockets, so that their threads can end.
+        supervisor.stop()
     for thr in threads_l:
         thr.join(0)
+    if consumer is not None:
+        # Records the frames received before the end of the run.
+        consumer.stop()
 
-    client_timestamps_l = [list(time_q.queue) for time_q in client_timestamps_l]
-    delays_l = [list(delays_q.queue) for delays_q in delays_l]
-    update_ids_l = [list(updates_q.queue) for updates_q in update_ids_l]
-    return update_ids_l, client_timestamps_l, delays_l
+    if writer is not None:
+        writer.stop()
 
+    columns = collect_columns(recorders)
+    if stages is not None:
+        # The threads keep receiving, the stages end with the collected samples.
+        stages.detach()
+    return columns
 
-def run_MWST(ticker: str, timeout: int, num_coro: int) -> Tuple[List[List[int]], ...]:
+
+def run_MWST(ticker: str, timeout: int, num_coro: int, fan_in: Optional[FirstArrivalFanIn] = None,
+             writer: Optional["ChunkedCaptureWriter"] = None, url: str = BINANCE_FUTURES_WS,
+             metrics: Optional[MetricsRegistry] = None,
+             supervisor: Optional[ConnectionSupervisor] = None,
+             sequences: Optional[List[SequenceTracker]] = None,
+             book: Optional[LocalOrderBook] = None,
+             stages: Optional[LatencyBreakdown] = None) -> Tuple[List[List[int]], ...]:
     """
     Run multiple websockets via single threads. For each connection will be opened a new websocket,
     and each socket will recive data asyncronously .
@@ -64,41 +138,83 @@ def run_MWST(ticker: str, timeout: int, num_coro: int) -> Tuple[List[List[int]],
     :type timeout: int
     :param num_coro: number of coroutines
     :type num_coro: int
-    :return Tuple[List[List[int]], ...]: list of update ids, client timestamps and delays for each connection
+    :param fan_in: optional first-arrival fan-in fed by all connections
+    :type fan_in: Optional[FirstArrivalFanIn]
+    :param writer: optional writer streaming samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param url: futures websocket endpoint, e.g. of the local mock server
+    :type url: str
+    :param metrics: optional live metrics of the connections
+    :type metrics: Optional[MetricsRegistry]
+    :param supervisor: optional supervisor reconnecting and replacing unhealthy connections
+    :type supervisor: Optional[ConnectionSupervisor]
+    :param sequences: optional update id sequence trackers, one per connection
+    :type sequences: Optional[List[SequenceTracker]]
+    :param book: optional local order book maintained from the depth events, fed with the first arrivals of
+        ``fan_in`` (whose sink it replaces, a fan-in is created if none is given)
+    :type book: Optional[LocalOrderBook]
+    :param stages: optional per-stage latency breakdown of the connections, its thread probe is run by the caller
+    :type stages: Optional[LatencyBreakdown]
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every connection
     """
 
+    if book is not None:
+        fan_in = fan_in if fan_in is not None else FirstArrivalFanIn(num_coro)
+        fan_in.sink = book.on_event
+
     async def runner():
         async_sockets = []
-        tasks = []
+        book_task = None
+        if book is not None:
+            snapshot_source = binance_snapshot_source(ticker) if url == BINANCE_FUTURES_WS else \
+                ws_snapshot_source(url, ticker)
+            book_task = asyncio.create_task(book.maintain(snapshot_source))
+        probe_task = asyncio.create_task(stages.probe_loop()) if stages is not None else None
 
-        for _ in range(num_coro):
-            async_sockets.append(AsyncWSv1(ticker))
-            tasks = [asyncio.create_task(ws.connect()) for ws in async_sockets]
+        for conn_id in range(num_coro):
+            async_sockets.append(AsyncWSv1(ticker, conn_id, fan_in,
+                                           None if url == BINANCE_FUTURES_WS else url,
+                                           metrics.connections[conn_id] if metrics is not None else None,
+                                           supervisor, sequences[conn_id] if sequences is not None else None,
+                                           stages.connections[conn_id] if stages is not None else None))
+        tasks = [asyncio.create_task(ws.connect()) for ws in async_sockets]
+
+        if writer is not None:
+            writer.start([ws.recorder for ws in async_sockets])
+        if supervisor is not None:
+            supervisor.start()
 
         try:
             await asyncio.wait_for(asyncio.gather(*tasks), timeout=timeout)
         except TimeoutError:
+            if supervisor is not None:
+                supervisor.stop()
             await asyncio.gather(*[ws.close_connection() for ws in async_sockets])
             for task in tasks:
                 task.cancel()
+        if book_task is not None:
+            book_task.cancel()
+        if probe_task is not None:
+            probe_task.cancel()
 
-        results = await asyncio.gather(*[ws.get_data() for ws in async_sockets])
-        update_ids, client_timestamps, delays = list(), list(), list()
-
-        for ws_result in results:
-            update_ids.append(ws_result[0])
-            client_timestamps.append(ws_result[1])
-            delays.append(ws_result[2])
-
-        return update_ids, client_timestamps, delays
+        if writer is not None:
+            writer.stop()
+        return collect_columns([ws.recorder for ws in async_sockets])
 
     return asyncio.run(runner())
 
 
-def run_SWST(ticker: str, timeout: int, num_subs: int) -> Tuple[List[List[int]], ...]:
+def run_SWST(ticker: str, timeout: int, num_subs: int, fan_in: Optional[FirstArrivalFanIn] = None,
+             writer: Optional["ChunkedCaptureWriter"] = None, url: str = BINANCE_FUTURES_WS,
+             decoder: str = "json", metrics: Optional[MetricsRegistry] = None,
+             supervisor: Optional[ConnectionSupervisor] = None,
+             sequences: Optional[List[SequenceTracker]] = None,
+             stages: Optional[LatencyBreakdown] = None) -> Tuple[List[List[int]], ...]:
     """
-    Run single websockets via single threads. All subscriptions will be made via single websocket,
-    which will recive data asyncronously. Each coroutione has his own id, and returns hiw own result data.
+    Run single websockets via single threads. All subscriptions will be made via single websocket, read by a single
+    receive loop which hands every frame to all subscribers. Each subscriber has his own id, and returns his own
+    result data. The socket switches to combined payloads once with ``SET_PROPERTY``, and offers every frame to the
+    fan-in once, since its subscribers all record the same rows.
 
     :param ticker: future's ticker
     :type ticker: str
@@ -106,16 +222,396 @@ def run_SWST(ticker: str, timeout: int, num_subs: int) -> Tuple[List[List[int]],
     :type timeout: int
     :param num_subs: number of coroutines
     :type num_subs: int
-    :return Tuple[List[List[int]], ...]: list of update ids, client timestamps and delays for each connection
+    :param fan_in: optional first-arrival fan-in fed once per frame of the socket
+    :type fan_in: Optional[FirstArrivalFanIn]
+    :param writer: optional writer streaming samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param url: futures websocket endpoint, e.g. of the local mock server
+    :type url: str
+    :param decoder: name of the frame decoder, see ``codec.DECODERS``
+    :type decoder: str
+    :param metrics: optional live metrics of the connections
+    :type metrics: Optional[MetricsRegistry]
+    :param supervisor: optional supervisor reconnecting and replacing unhealthy connections
+    :type supervisor: Optional[ConnectionSupervisor]
+    :param sequences: optional update id sequence trackers, one per connection
+    :type sequences: Optional[List[SequenceTracker]]
+    :param stages: optional per-stage latency breakdown of the connections, its thread probe is run by the caller
+    :type stages: Optional[LatencyBreakdown]
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every connection
     """
 
     async def runner():
-        async_socket = AsyncWSv2(ProjectConstants.BINANCE_FUTURES_WS, ticker, num_subs)
-        task = asyncio.create_task(async_socket.make_multiple_subscriptions())
+        async_socket = AsyncWSv2(url, ticker, num_subs, fan_in, get_decoder(decoder), metrics, supervisor, sequences,
+                                 stages=stages.connections if stages is not None else None)
+        probe_task = asyncio.create_task(stages.probe_loop()) if stages is not None else None
+        if writer is not None:
+            writer.start(async_socket.recorders)
+        if supervisor is not None:
+            supervisor.start()
+        task = asyncio.create_task(async_socket.run())
         try:
             await asyncio.wait_for(task, timeout=timeout)
         except TimeoutError:
+            if supervisor is not None:
+                supervisor.stop()
             task.cancel()
-            return await asyncio.create_task(async_socket.get_data())
+        if probe_task is not None:
+            probe_task.cancel()
+        if writer is not None:
+            writer.stop()
+        return async_socket.get_data()
 
     return asyncio.run(runner())
+
+
+def run_MULTI(streams: Sequence[str], timeout: int, writer: Optional["ChunkedCaptureWriter"] = None,
+              url: str = BINANCE_FUTURES_WS, max_streams: int = MAX_STREAMS_PER_CONNECTION,
+              batch_size: int = 200) -> Tuple[List[List[int]], ...]:
+    """
+    Run many streams of many symbols over as few combined stream websockets as Binance limits allow, subscribed with
+    batched requests. Frames are routed by stream name, each stream has its own recorder.
+
+    :param streams: stream names, e.g. ``btcusdt@bookTicker``, see ``subscriptions.stream_names``
+    :type streams: Sequence[str]
+    :param timeout: lifetime in seconds of each connection
+    :type timeout: int
+    :param writer: optional writer streaming samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param url: futures websocket endpoint, e.g. of the local mock server
+    :type url: str
+    :param max_streams: maximal number of streams of one connection
+    :type max_streams: int
+    :param batch_size: maximal number of streams of one ``SUBSCRIBE`` request
+    :type batch_size: int
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every stream
+    """
+    recorders = [SampleRecorder() for _ in streams]
+    router = StreamRouter()
+    # All streams are handled by the event loop thread, they feed the clock offset estimator through one channel.
+    clock_offset = shared_estimator().channel()
+    for stream, recorder in zip(streams, recorders):
+        router.add(stream, recording_handler(recorder, stream, clock_offset))
+
+    async def runner():
+        manager = SubscriptionManager(url, streams, router, max_streams, batch_size)
+        if writer is not None:
+            writer.start(recorders)
+        task = asyncio.create_task(manager.run())
+        try:
+            await asyncio.wait_for(task, timeout=timeout)
+        except TimeoutError:
+            await manager.close()
+        if writer is not None:
+            writer.stop()
+
+    asyncio.run(runner())
+    return collect_columns(recorders)
+
+
+def _mwmp_worker(ticker: str, timeout: int, conn_ids: Sequence[int], url: str, pipe: Connection,
+                 flush_interval: float, decoder: str, clock_anchor: int,
+                 supervisor_config: Optional[dict] = None, batch_size: int = 0, ring_capacity: int = 65536,
+                 stages: bool = False, probe_interval: float = 0.005, log_records=None,
+                 log_level: int = logging.INFO) -> None:
+    """
+    Worker process of ``run_MWMP``: runs the threaded websockets of its shard and sends their samples back to the
+    parent in batches of raw recorder rows, followed by the sequence trackers, stage histograms and thread lag probe
+    of the shard. Each worker supervises its own shard and sends its log records to the parent through
+    ``log_records``.
+
+    After the rows of every round the worker sends its watermark, an integer: all frames received before it have
+    been sent. It is the time of the previous round, frames are recorded well within a flush interval of their
+    receipt.
+    """
+    if log_records is not None:
+        init_worker_logger(log_records, log_level)
+    set_anchor(clock_anchor)
+    recorders = [SampleRecorder() for _ in conn_ids]
+    decode = get_decoder(decoder)
+    supervisor = ConnectionSupervisor(**supervisor_config).start() if supervisor_config is not None else None
+    sequences = [SequenceTracker(conn_id) for conn_id in conn_ids]
+    stage_histograms = [StageHistograms(conn_id) if stages else None for conn_id in conn_ids]
+    # Scheduling of the receive threads of this process, the probe of the parent only sees the parent.
+    probe = LatencyBreakdown(0, probe_interval).start() if stages else None
+    consumer = RingConsumer(batch_size) if batch_size > 0 else None
+    if consumer is not None:
+        consumer.start()
+    for conn_id, recorder, sequence, conn_stages in zip(conn_ids, recorders, sequences, stage_histograms):
+        # Daemon threads, so that the worker exits once its shard has been sent back.
+        threading.Thread(target=ThreadedWS, args=(url, ticker, recorder, conn_id, None, decode, None, supervisor,
+                                                  sequence, consumer, ring_capacity, conn_stages), daemon=True).start()
+
+    watermark = 0
+
+    def send_batches():
+        nonlocal watermark
+        round_start = now_ns()
+        for conn_id, recorder in zip(conn_ids, recorders):
+            num_rows = len(recorder)
+            if num_rows:
+                pipe.send((conn_id, recorder.pop_rows(num_rows).tobytes()))
+        pipe.send(watermark)
+        watermark = round_start
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(min(flush_interval, max(0.0, deadline - time.monotonic())))
+        send_batches()
+    if consumer is not None:
+        consumer.stop()
+        send_batches()
+    if stages:
+        # The receive threads keep recording, the stages of the shard end with its last batch.
+        stage_histograms = [conn_stages.copy() for conn_stages in stage_histograms]
+    if supervisor is not None:
+        supervisor.stop()
+    if probe is not None:
+        probe.stop()
+    # The sequence trackers, stage histograms and probes of the shard close the stream.
+    pipe.send({"sequences": sequences, "stages": stage_histograms if stages else None,
+               "probes": {"thread_lag": probe.probes["thread_lag"]} if probe is not None else None})
+    pipe.close()
+
+
+def _apply_shared_offset(values: "np.ndarray", worker_idx: int, worker_offsets: List[Optional[int]]) -> None:
+    # Each worker estimates the clock offset over its shard; the offset of all connections is the lowest estimate of
+    # the workers. The rows keep the estimate of their own worker when it is lower than the latest one of the others.
+    offset_ns = SampleRecorder.FIELDS.index("offset_ns")
+    others = [offset for idx, offset in enumerate(worker_offsets) if idx != worker_idx and offset is not None]
+    worker_offsets[worker_idx] = int(values[-1, offset_ns])
+    if others:
+        import numpy as np
+        np.minimum(values[:, offset_ns], min(others), out=values[:, offset_ns])
+
+
+class _ArrivalMerger:
+    """
+    Offers the rows of the MWMP workers to a first-arrival fan-in in receive time order. Workers send their rows one
+    flush interval apart, so rows are held back until they are older than the watermark of every running worker;
+    only then no other worker can still send an earlier copy of their update. Every batch is sorted once on arrival,
+    and the released part of the batches is merged.
+    """
+
+    def __init__(self, fan_in: FirstArrivalFanIn, num_workers: int):
+        self.fan_in = fan_in
+        self.watermarks = [0] * num_workers
+        self._batches: List[Tuple[int, "np.ndarray"]] = list()
+        fields = SampleRecorder.FIELDS
+        self._columns = [fields.index(field) for field in ("client_time_ns", "update_id", "event_time",
+                                                           "transaction_time")]
+
+    def add(self, conn_id: int, values: "np.ndarray") -> None:
+        """
+        :param conn_id: connection of the rows
+        :type conn_id: int
+        :param values: rows in the layout of ``SampleRecorder.FIELDS``, one per line
+        :type values: np.ndarray
+        """
+        import numpy as np
+        if not len(values):
+            return
+        columns = values[:, self._columns]
+        self._batches.append((conn_id, columns[np.lexsort((columns[:, 1], columns[:, 0]))]))
+
+    def advance(self, worker_idx: int, watermark: float) -> None:
+        """
+        :param worker_idx: index of the worker
+        :type worker_idx: int
+        :param watermark: receive time before which the worker has sent all its rows, infinity once it finished
+        :type watermark: float
+        """
+        import numpy as np
+        self.watermarks[worker_idx] = watermark
+        released = min(self.watermarks)
+        runs, pending = list(), list()
+        for conn_id, batch in self._batches:
+            stop = int(np.searchsorted(batch[:, 0], released))
+            if stop:
+                runs.append([(curr_time, conn_id, update_id, event_time, transaction_time) for
+                             curr_time, update_id, event_time, transaction_time in batch[:stop].tolist()])
+            if stop < len(batch):
+                pending.append((conn_id, batch[stop:]))
+        self._batches = pending
+        offer = self.fan_in.offer
+        for curr_time, conn_id, update_id, event_time, transaction_time in heapq.merge(*runs):
+            # Workers only send ids and times back, the prices of a published tick are NaN.
+            offer(conn_id, update_id, {"u": update_id, "E": event_time, "T": transaction_time}, curr_time)
+
+
+def _record_batch_metrics(metrics: MetricsRegistry, conn_id: int, values: "np.ndarray") -> None:
+    # Workers run in other processes, so their frames reach the live metrics one batch later.
+    import numpy as np
+    event_time, transaction_time, client_time_ns, offset_ns = (SampleRecorder.FIELDS.index(field) for field in (
+        "event_time", "transaction_time", "client_time_ns", "offset_ns"))
+    recv_ns = values[:, client_time_ns]
+    origin_ms = np.where(values[:, transaction_time] != 0, values[:, transaction_time], values[:, event_time])
+    metrics.connections[conn_id].record_many(recv_ns, recv_ns - origin_ms * 1_000_000 - values[:, offset_ns])
+
+
+def run_MWMP(ticker: str, timeout: int, num_conn: int, num_workers: Optional[int] = None,
+             writer: Optional["ChunkedCaptureWriter"] = None, url: str = BINANCE_FUTURES_WS,
+             flush_interval: float = 0.1, decoder: str = "json",
+             metrics: Optional[MetricsRegistry] = None,
+             supervisor: Optional[ConnectionSupervisor] = None,
+             sequences: Optional[List[SequenceTracker]] = None, batch_size: int = 0,
+             ring_capacity: int = 65536, stages: Optional[LatencyBreakdown] = None,
+             fan_in: Optional[FirstArrivalFanIn] = None) -> Tuple[List[List[int]], ...]:
+    """
+    Run multiple websockets via multiple processes. Connections are sharded round robin across worker processes,
+    each one running its websockets in threads as ``run_MWMT`` does, so JSON parsing of different shards does not
+    contend for one GIL. Workers stream their samples back through pipes in batches, which are merged per connection.
+    The parent handles each batch with a few vectorized numpy operations, not per row: the clock offset estimates of
+    the workers are combined, and live metrics and the fan-in take the batch at once.
+
+    :param ticker: future's ticker
+    :type ticker: str
+    :param timeout: lifetime in seconds of each connection
+    :type timeout: int
+    :param num_conn: number of connections
+    :type num_conn: int
+    :param num_workers: number of worker processes, defaults to the number of CPUs
+    :type num_workers: Optional[int]
+    :param writer: optional writer streaming merged samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param url: futures websocket endpoint, e.g. of the local mock server
+    :type url: str
+    :param flush_interval: interval in seconds between batches sent by the workers
+    :type flush_interval: float
+    :param decoder: name of the frame decoder, see ``codec.DECODERS``
+    :type decoder: str
+    :param metrics: optional live metrics of the connections
+    :type metrics: Optional[MetricsRegistry]
+    :param supervisor: optional supervisor reconnecting and replacing unhealthy connections; its configuration is
+        used by a supervisor in each worker, which compares the connections of its shard only
+    :type supervisor: Optional[ConnectionSupervisor]
+    :param sequences: optional update id sequence trackers, one per connection
+    :type sequences: Optional[List[SequenceTracker]]
+    :param batch_size: if positive, frames are decoded in batches off the receive threads, see ``run_MWMT``
+    :type batch_size: int
+    :param ring_capacity: maximal number of frames waiting in the ring buffer of each connection in batched mode
+    :type ring_capacity: int
+    :param stages: optional per-stage latency breakdown of the connections, measured in the workers and merged at the
+        end of the run; its thread probe is run by the caller, the thread probes of the workers are merged into it
+    :type stages: Optional[LatencyBreakdown]
+    :param fan_in: optional first-arrival fan-in fed by all connections; the rows of the workers are offered to it in
+        receive time order once no worker can send an earlier copy, i.e. about two flush intervals late
+    :type fan_in: Optional[FirstArrivalFanIn]
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every connection
+    """
+    # Local import, numpy is only needed by the parent of the workers.
+    import numpy as np
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1, num_conn))
+    recorders = [SampleRecorder() for _ in range(num_conn)]
+    if writer is not None:
+        writer.start(recorders)
+
+    ctx = mp.get_context("spawn")
+    log_records = ctx.Queue()
+    log_listener = worker_log_listener(log_records)
+    merger = _ArrivalMerger(fan_in, num_workers) if fan_in is not None else None
+    worker_offsets: List[Optional[int]] = [None] * num_workers
+    pipes, workers = dict(), list()
+    for worker_idx in range(num_workers):
+        parent_end, child_end = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_mwmp_worker, args=(ticker, timeout, list(range(worker_idx, num_conn, num_workers)),
+                                                      url, child_end, flush_interval, decoder, get_anchor(),
+                                                      supervisor.config if supervisor is not None else None,
+                                                      batch_size, ring_capacity, stages is not None,
+                                                      stages.probe_interval if stages is not None else 0.005,
+                                                      log_records, logging.getLogger().getEffectiveLevel()),
+                           daemon=True)
+        proc.start()
+        child_end.close()
+        pipes[parent_end] = worker_idx
+        workers.append(proc)
+
+    while pipes:
+        for pipe in wait(list(pipes)):
+            try:
+                batch = pipe.recv()
+            except EOFError:
+                batch = None
+            if isinstance(batch, int):
+                if merger is not None:
+                    merger.advance(pipes[pipe], batch)
+                continue
+            if batch is None or isinstance(batch, dict):
+                if batch and sequences is not None:
+                    for tracker in batch["sequences"]:
+                        sequences[tracker.conn_id].merge(tracker)
+                if batch and stages is not None:
+                    stages.merge_connections(batch["stages"])
+                    stages.merge_probes(batch["probes"])
+                if merger is not None:
+                    merger.advance(pipes[pipe], float("inf"))
+                worker_offsets[pipes[pipe]] = None
+                del pipes[pipe]
+                continue
+            conn_id, rows = batch
+            # One copy into a writable view of the rows, which the parent only touches with vectorized operations.
+            values = np.frombuffer(rows, dtype=np.int64).reshape(-1, len(SampleRecorder.FIELDS)).copy()
+            if not len(values):
+                continue
+            _apply_shared_offset(values, pipes[pipe], worker_offsets)
+            recorders[conn_id].extend_rows(values.tobytes())
+            if metrics is not None:
+                _record_batch_metrics(metrics, conn_id, values)
+            if merger is not None:
+                merger.add(conn_id, values)
+
+    for proc in workers:
+        proc.join()
+    log_listener.stop()
+    if writer is not None:
+        writer.stop()
+    return collect_columns(recorders)
+
+
+def run_method(method: str, target: Union[str, Sequence[str]], settings: Settings,
+               fan_in: Optional[FirstArrivalFanIn] = None, writer: Optional["ChunkedCaptureWriter"] = None,
+               metrics: Optional[MetricsRegistry] = None, supervisor: Optional[ConnectionSupervisor] = None,
+               sequences: Optional[List[SequenceTracker]] = None,
+               book: Optional[LocalOrderBook] = None,
+               stages: Optional[LatencyBreakdown] = None) -> Tuple[List[List[int]], ...]:
+    """
+    Run a connection method with the endpoint, connection count, timeout and performance knobs of ``settings``.
+
+    :param method: connection method, one of MWMT, MWST, SWST, MWMP, MULTI
+    :type method: str
+    :param target: future's ticker, or stream names of the MULTI method
+    :type target: Union[str, Sequence[str]]
+    :param settings: runtime settings
+    :type settings: Settings
+    :param fan_in: optional first-arrival fan-in fed by all connections, unused by MULTI
+    :type fan_in: Optional[FirstArrivalFanIn]
+    :param writer: optional writer streaming samples to disk during the run; streamed rows are not returned
+    :type writer: Optional[ChunkedCaptureWriter]
+    :param metrics: optional live metrics of the connections, unused by MULTI
+    :type metrics: Optional[MetricsRegistry]
+    :param supervisor: optional supervisor reconnecting and replacing unhealthy connections, unused by MULTI
+    :type supervisor: Optional[ConnectionSupervisor]
+    :param sequences: optional update id sequence trackers, one per connection, unused by MULTI
+    :type sequences: Optional[List[SequenceTracker]]
+    :param book: optional local order book of the MWST method
+    :type book: Optional[LocalOrderBook]
+    :param stages: optional per-stage latency breakdown of the connections, unused by MULTI
+    :type stages: Optional[LatencyBreakdown]
+    :return Tuple[List[List[int]], ...]: for each of ``SampleRecorder.FIELDS``, its column of every connection
+    """
+    timeout, num_conn, url = settings.conn_timeout, settings.conn_num, settings.binance_futures_ws
+    if method == "MWMT":
+        return run_MWMT(target, timeout, num_conn, fan_in, writer, url, settings.decoder, metrics, supervisor,
+                        sequences, settings.batch_size, settings.ring_capacity, stages)
+    if method == "MWST":
+        return run_MWST(target, timeout, num_conn, fan_in, writer, url, metrics, supervisor, sequences, book, stages)
+    if method == "SWST":
+        return run_SWST(target, timeout, num_conn, fan_in, writer, url, settings.decoder, metrics, supervisor,
+                        sequences, stages)
+    if method == "MWMP":
+        return run_MWMP(target, timeout, num_conn, settings.workers or None, writer, url,
+                        settings.worker_flush_interval, settings.decoder, metrics, supervisor, sequences,
+                        settings.batch_size, settings.ring_capacity, stages, fan_in)
+    if method == "MULTI":
+        return run_MULTI(target, timeout, writer, url, settings.max_streams, settings.subscribe_batch_size)
+    raise ValueError(f"Unknown method {method}!")
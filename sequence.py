@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+from logging import getLogger
+from typing import Dict, List, Sequence
+
+__all__ = [
+    "SequenceTracker",
+    "log_sequence_summary",
+    "save_sequence_summary"
+]
+
+
+class SequenceTracker:
+    """
+    Incremental update id checks of one connection, O(1) per message. Depth streams carry the previous final update id
+    ``pu`` of every event, so a break of the ``pu`` / ``u`` chain is a gap, i.e. missed events. Streams without ``pu``
+    (e.g. ``bookTicker``) skip update ids by design, hence only their monotonicity is checked. In both cases an update
+    id equal to the last one is a duplicate and a smaller one is out of order; neither moves the tracker forward.
+    """
+
+    OK = 0
+    GAP = 1
+    DUPLICATE = 2
+    OUT_OF_ORDER = 3
+
+    def __init__(self, conn_id: int = 0):
+        """
+        :param conn_id: connection index
+        :type conn_id: int
+        """
+        self.conn_id = conn_id
+        self.last_u = 0
+        self.messages = 0
+        self.gaps = 0
+        self.missed = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+
+    def update(self, data: dict) -> int:
+        """
+        Check the next event of the connection.
+
+        :param data: decoded event with at least ``u``, and ``pu`` for depth streams
+        :type data: dict
+        :return int: one of ``OK``, ``GAP``, ``DUPLICATE``, ``OUT_OF_ORDER``
+        """
+        u = data["u"]
+        last_u = self.last_u
+        self.messages += 1
+        if u <= last_u:
+            if u == last_u:
+                self.duplicates += 1
+                return self.DUPLICATE
+            self.out_of_order += 1
+            return self.OUT_OF_ORDER
+        self.last_u = u
+        pu = data.get("pu")
+        if pu is not None and last_u and pu != last_u:
+            self.gaps += 1
+            # Number of skipped events is unknown, the first update id of the event bounds the skipped range.
+            first_u = data.get("U", pu + 1)
+            self.missed += max(0, first_u - last_u - 1)
+            return self.GAP
+        return self.OK
+
+    def merge(self, other: "SequenceTracker") -> None:
+        """
+        Add the counters of a tracker of the same connection, e.g. sent back by a worker process.
+        """
+        self.last_u = max(self.last_u, other.last_u)
+        self.messages += other.messages
+        self.gaps += other.gaps
+        self.missed += other.missed
+        self.duplicates += other.duplicates
+        self.out_of_order += other.out_of_order
+
+    def snapshot(self) -> Dict:
+        """
+        :return Dict: counters of the connection and its gap rate per thousand messages
+        """
+        return {
+            "conn_id": self.conn_id,
+            "messages": self.messages,
+            "sequence_gaps": self.gaps,
+            "missed_update_ids": self.missed,
+            "duplicates": self.duplicates,
+            "out_of_order": self.out_of_order,
+            "gaps_per_1000": self.gaps * 1000 / self.messages if self.messages else 0.0
+        }
+
+
+def log_sequence_summary(trackers: Sequence[SequenceTracker]) -> List[Dict]:
+    """
+    Log the counters of every connection.
+
+    :param trackers: sequence trackers of the connections of a run
+    :type trackers: Sequence[SequenceTracker]
+    :return List[Dict]: snapshots of the trackers
+    """
+    logger = getLogger(f"{__name__}.log_sequence_summary")
+    snapshots = [tracker.snapshot() for tracker in trackers]
+    for snap in snapshots:
+        logger.info(f"Connection {snap['conn_id']}: {snap['messages']} messages, {snap['sequence_gaps']} gaps "
+                    f"({snap['gaps_per_1000']:.3f} per 1000), {snap['duplicates']} duplicates, "
+                    f"{snap['out_of_order']} out of order")
+    return snapshots
+
+
+def save_sequence_summary(trackers: Sequence[SequenceTracker], path: str) -> None:
+    """
+    Save the counters of every connection as JSON next to the captured data.
+
+    :param trackers: sequence trackers of the connections of a run
+    :type trackers: Sequence[SequenceTracker]
+    :param path: path of the JSON file
+    :type path: str
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([tracker.snapshot() for tracker in trackers], f, indent=2)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, Mapping, Optional
+
+# Project modules
+from codec import DECODERS, EVENT_LOOPS
+
+__all__ = [
+    "BINANCE_FUTURES_WS",
+    "CONFIG_FILE",
+    "ENV_PREFIX",
+    "Settings"
+]
+
+BINANCE_FUTURES_WS = "wss://fstream.binance.com/ws"
+CONFIG_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), "config.json")
+ENV_PREFIX = "BFC_"
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+def _coerce(name: str, kind: type, value: Any) -> Any:
+    """
+    Convert a value of the config file or an environment string to the type of its setting.
+    """
+    if kind is bool and isinstance(value, str):
+        if value.strip().lower() not in _TRUE + _FALSE:
+            raise ValueError(f"Setting {name} must be a boolean, got {value}!")
+        return value.strip().lower() in _TRUE
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Setting {name} must be of type {kind.__name__}, got {value!r}!") from None
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Typed runtime settings of a capture. ``Settings.load`` reads them from ``config.json`` (upper case keys of any
+    section), then from ``BFC_`` prefixed environment variables and finally from explicit overrides such as command
+    line options, each source overriding the previous ones.
+    """
+    verbose: int = 3
+    log_file: str = "binance.log"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    conn_num: int = 1
+    conn_timeout: int = 60
+    binance_futures_ws: str = BINANCE_FUTURES_WS
+    data_dir: str = "data"
+    # Frame decoder and event loop, see ``codec.DECODERS`` and ``codec.EVENT_LOOPS``.
+    decoder: str = "json"
+    loop: str = "asyncio"
+    # Worker processes of MWMP, 0 for the number of CPUs, and interval in seconds between their batches.
+    workers: int = 0
+    worker_flush_interval: float = 0.1
+    # Frames per decoded batch of MWMT and MWMP, 0 to decode in the receive threads, and frames per ring buffer.
+    batch_size: int = 0
+    ring_capacity: int = 65536
+    # Rows per streamed chunk and interval in seconds between checks for complete chunks.
+    chunk_rows: int = 65536
+    chunk_flush_interval: float = 1.0
+    dedup_window: int = 4096
+    max_streams: int = 1024
+    subscribe_batch_size: int = 200
+    stall_ms: float = 5000
+    replace_interval: float = 0
+
+    def __post_init__(self):
+        # Windows style paths of older configs, e.g. ".\\data".
+        object.__setattr__(self, "data_dir", os.path.normpath(self.data_dir.replace("\\", "/")))
+        if self.decoder not in DECODERS:
+            raise ValueError(f"Unknown decoder {self.decoder}, expected one of {', '.join(DECODERS)}!")
+        if self.loop not in EVENT_LOOPS:
+            raise ValueError(f"Unknown event loop {self.loop}, expected one of {', '.join(EVENT_LOOPS)}!")
+        for name in ("conn_num", "conn_timeout", "ring_capacity", "chunk_rows", "dedup_window", "max_streams",
+                     "subscribe_batch_size"):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"Setting {name} must be positive, got {getattr(self, name)}!")
+
+    @classmethod
+    def load(cls, path: Optional[str] = CONFIG_FILE, environ: Mapping[str, str] = os.environ,
+             overrides: Optional[Mapping[str, Any]] = None) -> "Settings":
+        """
+        :param path: JSON config file, None or a missing file to skip it
+        :type path: Optional[str]
+        :param environ: environment variables, e.g. ``BFC_BATCH_SIZE=256``
+        :type environ: Mapping[str, str]
+        :param overrides: explicit values by field name, None values are ignored
+        :type overrides: Optional[Mapping[str, Any]]
+        :return Settings: settings of all sources
+        """
+        values: Dict[str, Any] = dict()
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for section in json.load(f).values():
+                    values.update({key.lower(): value for key, value in section.items()})
+        for field in fields(cls):
+            if ENV_PREFIX + field.name.upper() in environ:
+                values[field.name] = environ[ENV_PREFIX + field.name.upper()]
+        if overrides is not None:
+            values.update({key: value for key, value in overrides.items() if value is not None})
+
+        types = {field.name: field.type for field in fields(cls)}
+        unknown = sorted(set(values) - set(types))
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(unknown)}!")
+        return cls(**{name: _coerce(name, types[name], value) for name, value in values.items()})
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        :return Dict[str, Any]: values of all settings by name
+        """
+        return asdict(self)
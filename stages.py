@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import copy
+import json
+import time
+import asyncio
+import threading
+from logging import getLogger
+from typing import Dict, List, Optional
+
+# Project modules
+from clock import now_ns
+from metrics import LogHistogram, quantiles
+
+__all__ = [
+    "HANDLING",
+    "PROBES",
+    "STAGES",
+    "LatencyBreakdown",
+    "StageHistograms"
+]
+
+# Update origin at the exchange to socket receipt (offset corrected), receipt to decode start (ring buffer of batched
+# decoding), decode, and recording with the bookkeeping of metrics, supervisor, sequence tracker and fan-in.
+STAGES = ("wire", "queue", "decode", "record")
+# Socket receipt to the end of recording of each frame, i.e. its queue, decode and record stages together.
+HANDLING = "handling"
+# Oversleep of a periodic coroutine on the event loop and of a periodic thread.
+PROBES = ("loop_lag", "thread_lag")
+QUANTILES = {"p50_us": 0.5, "p90_us": 0.9, "p99_us": 0.99, "p999_us": 0.999}
+
+
+def _describe(hist: LogHistogram) -> Dict:
+    described = {"count": hist.count}
+    described.update({key: value / 1e3 for key, value in zip(QUANTILES, quantiles([hist], list(QUANTILES.values())))})
+    described["max_us"] = hist.max / 1e3
+    return described
+
+
+def _buckets(hist: LogHistogram) -> Dict:
+    # Sparse histogram in nanoseconds, to compare or merge runs afterwards.
+    filled = hist.filled()
+    return {"value_ns": [hist.value_at(index) for index in filled], "count": [hist.counts[index] for index in filled]}
+
+
+class StageHistograms:
+    """
+    Nanosecond histograms of the stages of the frames of one connection, see ``STAGES``, and of their total
+    ``HANDLING`` time. Stages a connector cannot observe, e.g. the decode inside python-binance, are left empty.
+    """
+
+    def __init__(self, conn_id: int = 0):
+        self.conn_id = conn_id
+        self.histograms = {name: LogHistogram() for name in STAGES + (HANDLING,)}
+        self._wire, self._queue, self._decode, self._record, self._handling = self.histograms.values()
+
+    def add(self, wire_ns: int, decode_ns: int, record_ns: int, queue_ns: int = -1) -> None:
+        """
+        Record the stages of a frame. Called from the receive path of the connection.
+
+        :param wire_ns: exchange origin time of the update to socket receipt, corrected by the clock offset
+        :type wire_ns: int
+        :param decode_ns: decode time, negative if not measured
+        :type decode_ns: int
+        :param record_ns: recording and bookkeeping time
+        :type record_ns: int
+        :param queue_ns: socket receipt to decode start, negative if frames are decoded on receipt
+        :type queue_ns: int
+        """
+        self._wire.record(wire_ns)
+        handling_ns = record_ns
+        if queue_ns >= 0:
+            self._queue.record(queue_ns)
+            handling_ns += queue_ns
+        if decode_ns >= 0:
+            self._decode.record(decode_ns)
+            handling_ns += decode_ns
+        self._record.record(record_ns)
+        self._handling.record(handling_ns)
+
+    def merge(self, other: "StageHistograms") -> None:
+        for name, hist in self.histograms.items():
+            hist.merge(other.histograms[name])
+
+    def copy(self) -> "StageHistograms":
+        """
+        :return StageHistograms: histograms of the frames recorded so far, not updated by the connection any more
+        """
+        # A copy of the count arrays, without numpy, so that few frames are recorded while it is taken.
+        return copy.deepcopy(self)
+
+    def snapshot(self) -> Dict:
+        snap = {"conn_id": self.conn_id}
+        snap.update({name: _describe(hist) for name, hist in self.histograms.items()})
+        return snap
+
+
+class LatencyBreakdown:
+    """
+    Per-stage latency of all connections of a run, to tell transport, event loop scheduling, parsing and bookkeeping
+    apart in the single ``delay`` of a sample. ``start`` runs the thread scheduling probe; asynchronous runners run
+    ``probe_loop`` on their event loop.
+    """
+
+    def __init__(self, num_conn: int, probe_interval: float = 0.005):
+        """
+        :param num_conn: number of connections
+        :type num_conn: int
+        :param probe_interval: sleep in seconds of the probes, whose oversleep is recorded
+        :type probe_interval: float
+        """
+        self.connections = [StageHistograms(conn_id) for conn_id in range(num_conn)]
+        self.probes = {probe: LogHistogram() for probe in PROBES}
+        self.probe_interval = probe_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def probe_loop(self) -> None:
+        """
+        Record how late the event loop resumes a periodic coroutine, until cancelled.
+        """
+        lag, interval_ns = self.probes["loop_lag"], int(self.probe_interval * 1e9)
+        while True:
+            start = now_ns()
+            await asyncio.sleep(self.probe_interval)
+            lag.record(now_ns() - start - interval_ns)
+
+    def _probe_thread(self) -> None:
+        lag, interval_ns = self.probes["thread_lag"], int(self.probe_interval * 1e9)
+        while not self._stop_event.is_set():
+            start = now_ns()
+            time.sleep(self.probe_interval)
+            lag.record(now_ns() - start - interval_ns)
+
+    def start(self) -> "LatencyBreakdown":
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._probe_thread, name="ThreadLagProbe", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def summary(self) -> Dict:
+        """
+        :return Dict: stages of all connections, of every connection and the probes, with the sparse histograms
+        """
+        merged = StageHistograms()
+        for conn in self.connections:
+            merged.merge(conn)
+        return {
+            "stages": {name: _describe(hist) for name, hist in merged.histograms.items()},
+            "probes": {probe: _describe(hist) for probe, hist in self.probes.items()},
+            "connections": [conn.snapshot() for conn in self.connections],
+            "histograms": {name: _buckets(hist) for name, hist in
+                           list(merged.histograms.items()) + list(self.probes.items())}
+        }
+
+    def log_summary(self) -> Dict:
+        """
+        Log the stages of all connections and the probes.
+
+        :return Dict: summary of the breakdown
+        """
+        summary = self.summary()
+        logger = getLogger(f"{__name__}.log_summary")
+        for name, described in list(summary["stages"].items()) + list(summary["probes"].items()):
+            if described["count"]:
+                logger.info(f"{name}: {described['count']} samples, p50 {described['p50_us']:.1f} us, "
+                            f"p99 {described['p99_us']:.1f} us, max {described['max_us']:.1f} us")
+        return summary
+
+    def save(self, path: str, summary: Optional[Dict] = None) -> None:
+        """
+        :param path: path of the JSON file
+        :type path: str
+        :param summary: summary to save, computed if not given
+        :type summary: Optional[Dict]
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary if summary is not None else self.summary(), f, indent=2)
+
+    def detach(self) -> None:
+        """
+        Replace the histograms of the connections by copies, so that frames the connections still receive after the
+        end of a run, e.g. by the threads of MWMT that are not joined, do not enter its summary.
+        """
+        self.connections = [conn.copy() for conn in self.connections]
+
+    def merge_connections(self, connections: List[StageHistograms]) -> None:
+        """
+        Merge stages recorded in other processes, e.g. by the MWMP workers.
+        """
+        for conn in connections:
+            self.connections[conn.conn_id].merge(conn)
+
+    def merge_probes(self, probes: Dict[str, LogHistogram]) -> None:
+        """
+        Merge probes run in other processes, e.g. the thread probes of the MWMP workers, whose receive threads do not
+        share the scheduling of the threads of this process.
+        """
+        for probe, hist in probes.items():
+            self.probes[probe].merge(hist)
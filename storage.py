@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import re
+import sys
+import json
+import glob
+import struct
+import argparse
+import threading
+from array import array
+from logging import getLogger
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+# Third-party modules
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Project modules
+from recorder import SampleRecorder
+
+__all__ = [
+    "CAPTURE_DTYPE",
+    "CaptureWriter",
+    "ChunkedCaptureWriter",
+    "convert_pickles",
+    "open_capture",
+    "read_chunks",
+    "samples_frame"
+]
+
+META_FILE = "chunks_meta.json"
+CAPTURE_FILE = "capture.bin"
+
+# Capture file layout: fixed 32 bytes header followed by fixed-width little-endian records. Version 2 added the
+# transaction time and the clock offset estimate to the records of version 1.
+CAPTURE_MAGIC = b"BFCCAP01"
+CAPTURE_VERSION = 2
+CAPTURE_HEADER = struct.Struct("<8sIIII8x")
+CAPTURE_DTYPES = {
+    1: np.dtype([("conn_id", "<i8"), ("update_id", "<i8"), ("event_time", "<i8"), ("client_time_ns", "<i8")]),
+    2: np.dtype([("conn_id", "<i8"), ("update_id", "<i8"), ("event_time", "<i8"), ("transaction_time", "<i8"),
+                 ("client_time_ns", "<i8"), ("offset_ns", "<i8")])
+}
+CAPTURE_DTYPE = CAPTURE_DTYPES[CAPTURE_VERSION]
+
+
+def samples_frame(columns: Sequence[Sequence[int]], fields: Sequence[str] = SampleRecorder.FIELDS) -> "pd.DataFrame":
+    """
+    Build the DataFrame of one connection from its recorder columns. Besides the raw columns it holds the derived
+    millisecond columns of the pickled captures: ``client_timestamps``, ``delay`` and the clock offset corrected
+    ``corrected_delay`` since the origin of the update, its transaction time when known, see
+    ``clock.ClockOffsetEstimator``.
+
+    :param columns: recorder columns of one connection
+    :type columns: Sequence[Sequence[int]]
+    :param fields: names of the columns
+    :type fields: Sequence[str]
+    :return pd.DataFrame: samples of the connection
+    """
+    # Local import, pandas is only needed once the capture is saved or analysed.
+    import pandas as pd
+    df = pd.DataFrame({field: np.asarray(column, dtype=np.int64) for field, column in zip(fields, columns)})
+    df["client_timestamps"] = df["client_time_ns"] / 1e6
+    df["delay"] = (df["client_time_ns"] - df["event_time"] * 1_000_000) / 1e6
+    origin_ms = df["transaction_time"].where(df["transaction_time"] > 0, df["event_time"])
+    df["corrected_delay"] = (df["client_time_ns"] - origin_ms * 1_000_000 - df["offset_ns"]) / 1e6
+    return df
+
+
+class CaptureWriter:
+    """
+    Writer of the single-file capture format: a header followed by ``CAPTURE_DTYPE`` records of all connections.
+    Records of different connections are interleaved in the order their chunks were written.
+    """
+
+    def __init__(self, path: str, num_conn: int, fields: Sequence[str] = SampleRecorder.FIELDS):
+        """
+        :param path: capture file path, truncated if it exists
+        :type path: str
+        :param num_conn: number of connections in the capture
+        :type num_conn: int
+        :param fields: fields of the recorder rows passed to ``write_rows``
+        :type fields: Sequence[str]
+        """
+        self.path = path
+        self.num_conn = num_conn
+        self.fields = tuple(fields)
+        self.num_records = 0
+        self._file = open(path, "wb")
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_HEADER.size,
+                                             CAPTURE_DTYPE.itemsize, num_conn))
+
+    def write(self, conn_id: int, update_ids, event_times, client_times_ns, transaction_times=0,
+              offsets_ns=0) -> None:
+        """
+        Append records of one connection.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param update_ids: update ids
+        :param event_times: exchange event times in milliseconds
+        :param client_times_ns: client receive times in nanoseconds
+        :param transaction_times: exchange transaction times in milliseconds, 0 when unknown
+        :param offsets_ns: clock offset estimates in nanoseconds, 0 when unknown
+        """
+        records = np.empty(len(update_ids), dtype=CAPTURE_DTYPE)
+        records["conn_id"] = conn_id
+        records["update_id"] = update_ids
+        records["event_time"] = event_times
+        records["transaction_time"] = transaction_times
+        records["client_time_ns"] = client_times_ns
+        records["offset_ns"] = offsets_ns
+        records.tofile(self._file)
+        self.num_records += len(records)
+
+    def write_rows(self, conn_id: int, rows: array) -> None:
+        """
+        Append flat rows popped from a ``SampleRecorder`` of connection ``conn_id``.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param rows: flat recorder rows
+        :type rows: array
+        """
+        values = np.frombuffer(rows, dtype=np.int64).reshape(-1, len(self.fields))
+        self.write(conn_id, *[values[:, self.fields.index(field)] for field in
+                              ("update_id", "event_time", "client_time_ns", "transaction_time", "offset_ns")])
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def open_capture(path: str) -> np.memmap:
+    """
+    Map a capture file into memory without reading or copying it.
+
+    :param path: capture file path
+    :type path: str
+    :return np.memmap: read-only structured array of records, ``CAPTURE_DTYPES`` of the file version
+    """
+    with open(path, "rb") as f:
+        magic, version, header_size, record_size, num_conn = CAPTURE_HEADER.unpack(f.read(CAPTURE_HEADER.size))
+    if magic != CAPTURE_MAGIC or version not in CAPTURE_DTYPES:
+        raise ValueError(f"{path} is not a capture file of a supported version!")
+    dtype = CAPTURE_DTYPES[version]
+    if record_size != dtype.itemsize:
+        raise ValueError(f"Unexpected record size {record_size} in {path}!")
+    num_records = (os.path.getsize(path) - header_size) // record_size
+    if not num_records:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=header_size, shape=(num_records,))
+
+
+def convert_pickles(src_dir: str, dst_path: str) -> int:
+    """
+    Migrate a directory of ``connection_{i}.pkl`` captures into a single capture file. Pickles of ``samples_frame``
+    keep their raw columns, legacy ones are rebuilt from their millisecond ``client_timestamps`` (``client_timestamp``
+    in the historical captures) and ``delay``.
+
+    :param src_dir: directory with pickled captures
+    :type src_dir: str
+    :param dst_path: capture file to write
+    :type dst_path: str
+    :return int: number of converted records
+    """
+    import pandas as pd
+    pickles = dict()
+    for pth in glob.glob(os.path.join(src_dir, "connection_*.pkl")):
+        pickles[int(re.search(r"connection_(\d+)\.pkl$", pth).group(1))] = pth
+    writer = CaptureWriter(dst_path, max(pickles) + 1 if pickles else 0)
+    try:
+        for conn_id in sorted(pickles):
+            df = pd.read_pickle(pickles[conn_id])
+            if "client_time_ns" in df:
+                writer.write(conn_id, *[df[field].to_numpy(dtype=np.int64) for field in
+                                        ("update_id", "event_time", "client_time_ns", "transaction_time", "offset_ns")])
+                continue
+            # Historical captures name the column client_timestamp and store float milliseconds, so the event time
+            # is rounded only after the subtraction.
+            client_ms = df["client_timestamps" if "client_timestamps" in df else "client_timestamp"]
+            client_ms = client_ms.to_numpy(dtype=np.float64)
+            event_times = np.round(client_ms - df["delay"].to_numpy(dtype=np.float64)).astype(np.int64)
+            whole_ms = np.floor(client_ms)
+            client_times_ns = whole_ms.astype(np.int64) * 1_000_000 + np.round((client_ms - whole_ms) * 1e6).astype(
+                np.int64)
+            writer.write(conn_id, df["update_id"].to_numpy(dtype=np.int64), event_times, client_times_ns)
+    finally:
+        writer.close()
+    return writer.num_records
+
+
+class ChunkedCaptureWriter:
+    """
+    Streams recorded samples to disk while the capture is running. A background thread periodically moves every
+    complete chunk of ``chunk_rows`` rows out of each connection's recorder and appends it to ``connection_{i}.bin``
+    as flat native-endian int64 rows (or to a single capture file), so memory stays bounded and a crash loses at most
+    the unflushed tail. The remaining partial chunks are written on ``stop``.
+    """
+
+    def __init__(self, save_dir: str, chunk_rows: int = 65536, flush_interval: float = 1.0,
+                 single_file: bool = False):
+        """
+        :param save_dir: directory where chunk files are written
+        :type save_dir: str
+        :param chunk_rows: number of rows written per chunk
+        :type chunk_rows: int
+        :param flush_interval: interval in seconds between checks for complete chunks
+        :type flush_interval: float
+        :param single_file: write all connections into one ``capture.bin`` capture file instead of chunk files
+        :type single_file: bool
+        """
+        if chunk_rows <= 0:
+            raise ValueError(f"Chunk size must be positive, got {chunk_rows}!")
+        self.save_dir = save_dir
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.single_file = single_file
+        self.recorders: List[SampleRecorder] = list()
+        self.rows_written: List[int] = list()
+        self._files = list()
+        self._capture: Optional[CaptureWriter] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, recorders: Sequence[SampleRecorder]) -> None:
+        """
+        Start streaming the given recorders, one chunk file per recorder.
+
+        :param recorders: one recorder per connection
+        :type recorders: Sequence[SampleRecorder]
+        """
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+        self.recorders = list(recorders)
+        self.rows_written = [0] * len(self.recorders)
+        fields = self.recorders[0].fields if self.recorders else SampleRecorder.FIELDS
+        if self.single_file:
+            self._capture = CaptureWriter(os.path.join(self.save_dir, CAPTURE_FILE), len(self.recorders), fields)
+        else:
+            with open(os.path.join(self.save_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"fields": list(fields), "dtype": "<i8" if sys.byteorder == "little" else ">i8",
+                           "num_conn": len(self.recorders)}, f)
+            self._files = [open(os.path.join(self.save_dir, f"connection_{i}.bin"), "wb")
+                           for i in range(len(self.recorders))]
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ChunkedCaptureWriter", daemon=True)
+        self._thread.start()
+
+    def _flush(self, min_rows: int) -> None:
+        for i, recorder in enumerate(self.recorders):
+            pending = len(recorder)
+            num_rows = pending - pending % min_rows
+            if not num_rows:
+                continue
+            if self._capture is not None:
+                self._capture.write_rows(i, recorder.pop_rows(num_rows))
+                self._capture.flush()
+            else:
+                recorder.pop_rows(num_rows).tofile(self._files[i])
+                self._files[i].flush()
+            self.rows_written[i] += num_rows
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self._flush(self.chunk_rows)
+            except Exception as e:
+                getLogger(f"{__name__}._run").error(f"Failed to flush chunks to {self.save_dir}: {e}")
+
+    def stop(self) -> None:
+        """
+        Stop the background thread, write the remaining rows and close the chunk files.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._flush(1)
+        for f in self._files:
+            f.close()
+        self._files = list()
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        getLogger(f"{__name__}.stop").info(f"Streamed {sum(self.rows_written)} rows of {len(self.recorders)} "
+                                           f"connections to {self.save_dir}")
+
+
+def read_chunks(save_dir: str) -> List["pd.DataFrame"]:
+    """
+    Read the chunk files written by ``ChunkedCaptureWriter`` back into one DataFrame per connection, with the same
+    columns as the pickled captures, see ``samples_frame``.
+
+    :param save_dir: directory with the chunk files
+    :type save_dir: str
+    :return List[pd.DataFrame]: data of each connection
+    """
+    with open(os.path.join(save_dir, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    fields = meta["fields"]
+    frames = list()
+    for i in range(meta["num_conn"]):
+        values = np.fromfile(os.path.join(save_dir, f"connection_{i}.bin"), dtype=meta["dtype"])
+        frames.append(samples_frame(values.reshape(-1, len(fields)).T, fields))
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a directory of pickled connection captures into a single "
+                                                 "memory-mappable capture file.",
+                                     usage="python storage.py src_dir [dst_path]")
+    parser.add_argument("src_dir", type=str, help="Directory with connection_{i}.pkl files.")
+    parser.add_argument("dst_path", type=str, nargs="?", default=None,
+                        help=f"Capture file to write. Default src_dir/{CAPTURE_FILE}.")
+    cli_args = parser.parse_args()
+    dst = cli_args.dst_path or os.path.join(cli_args.src_dir, CAPTURE_FILE)
+    print(f"Converted {convert_pickles(cli_args.src_dir, dst)} records of {cli_args.src_dir} into {dst}")
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import asyncio
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Project modules
+from clock import OffsetChannel, now_ns, shared_estimator
+from codec import stream_of
+from recorder import SampleRecorder
+
+__all__ = [
+    "MAX_REQUESTS_PER_SECOND",
+    "MAX_STREAMS_PER_CONNECTION",
+    "STREAM_TYPES",
+    "StreamRouter",
+    "SubscriptionManager",
+    "batch_requests",
+    "combined_url",
+    "plan_connections",
+    "raw_url",
+    "recording_handler",
+    "stream_names",
+    "usdt_perpetual_symbols"
+]
+
+STREAM_TYPES = ("bookTicker", "depth@100ms", "aggTrade", "markPrice")
+
+# Binance futures limits: streams per connection and incoming messages per second per connection.
+MAX_STREAMS_PER_CONNECTION = 1024
+MAX_REQUESTS_PER_SECOND = 10
+
+# Field of each stream type recorded as its update id; mark price events have none.
+UPDATE_ID_FIELDS = {"bookTicker": "u", "depth": "u", "aggTrade": "a", "markPrice": None}
+
+Handler = Callable[[dict, int], Any]
+
+
+def stream_names(symbols: Sequence[str], stream_types: Sequence[str]) -> List[str]:
+    """
+    :param symbols: futures symbols, e.g. ``btcusdt``
+    :type symbols: Sequence[str]
+    :param stream_types: stream types, e.g. ``STREAM_TYPES``
+    :type stream_types: Sequence[str]
+    :return List[str]: stream name of every symbol and stream type, e.g. ``btcusdt@bookTicker``
+    """
+    return [f"{symbol.lower()}@{stream_type}" for symbol in symbols for stream_type in stream_types]
+
+
+def plan_connections(streams: Sequence[str], max_streams: int = MAX_STREAMS_PER_CONNECTION) -> List[List[str]]:
+    """
+    Pack streams into as few connections as the per-connection stream limit allows, spreading them evenly.
+
+    :param streams: stream names
+    :type streams: Sequence[str]
+    :param max_streams: maximal number of streams of one connection
+    :type max_streams: int
+    :return List[List[str]]: streams of each connection
+    """
+    if max_streams <= 0:
+        raise ValueError(f"Streams per connection must be positive, got {max_streams}!")
+    num_conn = max(1, -(-len(streams) // max_streams))
+    return [list(streams[i::num_conn]) for i in range(num_conn)]
+
+
+def batch_requests(streams: Sequence[str], batch_size: int = 200, first_id: int = 1) -> List[dict]:
+    """
+    :param streams: stream names of one connection
+    :type streams: Sequence[str]
+    :param batch_size: maximal number of streams of one ``SUBSCRIBE`` request
+    :type batch_size: int
+    :param first_id: id of the first request, the next ones are consecutive
+    :type first_id: int
+    :return List[dict]: ``SUBSCRIBE`` requests covering all streams
+    """
+    return [{"method": "SUBSCRIBE", "params": list(streams[i:i + batch_size]), "id": first_id + i // batch_size}
+            for i in range(0, len(streams), batch_size)]
+
+
+def combined_url(url: str) -> str:
+    """
+    :param url: raw stream endpoint, e.g. ``wss://fstream.binance.com/ws``
+    :type url: str
+    :return str: combined stream endpoint of the same host, e.g. ``wss://fstream.binance.com/stream``
+    """
+    base_url = url.rstrip("/")
+    if base_url.endswith("/stream"):
+        return base_url
+    if base_url.endswith("/ws"):
+        base_url = base_url[:-len("/ws")]
+    return base_url + "/stream"
+
+
+def raw_url(url: str) -> str:
+    """
+    :param url: combined stream endpoint, e.g. ``wss://fstream.binance.com/stream``
+    :type url: str
+    :return str: raw stream endpoint of the same host, e.g. ``wss://fstream.binance.com/ws``
+    """
+    base_url = url.rstrip("/")
+    if base_url.endswith("/ws"):
+        return base_url
+    if base_url.endswith("/stream"):
+        base_url = base_url[:-len("/stream")]
+    return base_url + "/ws"
+
+
+def recording_handler(recorder: SampleRecorder, stream: str,
+                      clock_offset: Optional[OffsetChannel] = None) -> Handler:
+    """
+    :param recorder: recorder of the stream
+    :type recorder: SampleRecorder
+    :param stream: stream name, its type selects the update id field
+    :type stream: str
+    :param clock_offset: channel of the shared clock offset estimator, which handlers run by the same thread can
+        share; a new one by default
+    :type clock_offset: Optional[OffsetChannel]
+    :return Handler: handler appending the samples of the stream to the recorder
+    """
+    stream_type = stream.partition("@")[2]
+    id_field = UPDATE_ID_FIELDS.get(stream_type, UPDATE_ID_FIELDS.get(stream_type.partition("@")[0], "u"))
+    clock_offset = clock_offset if clock_offset is not None else shared_estimator().channel()
+    append = recorder.append
+
+    def handle(data: dict, recv_ns: int) -> None:
+        transaction_time = data.get("T", 0)
+        offset_ns = clock_offset.update(recv_ns, data["E"], transaction_time)
+        append((data.get(id_field, 0) if id_field else 0, data["E"], transaction_time, recv_ns, offset_ns))
+
+    return handle
+
+
+class StreamRouter:
+    """
+    Routes combined stream frames ``{"stream": ..., "data": ...}`` to the handlers of their stream with one dict
+    lookup. Every frame is parsed once, whatever the number of handlers of its stream. With a ``decoder`` frames are
+    routed by their stream prefix, see ``codec.stream_of``, and only the frames of routed streams are decoded by it.
+    """
+
+    def __init__(self, loads: Callable[[Any], Any] = json.loads,
+                 decoder: Optional[Callable[[Any], Optional[dict]]] = None):
+        """
+        :param loads: JSON parser of the frames
+        :type loads: Callable[[Any], Any]
+        :param decoder: optional event decoder of routed frames, see ``codec.get_decoder``; frames without a routed
+            stream prefix, e.g. replies to requests, are still parsed by ``loads``
+        :type decoder: Optional[Callable[[Any], Optional[dict]]]
+        """
+        self.loads = loads
+        self.decoder = decoder
+        self.handlers: Dict[str, Tuple[Handler, ...]] = dict()
+        self.unrouted = 0
+
+    def add(self, stream: str, handler: Handler) -> None:
+        """
+        :param stream: stream name as sent in the ``stream`` field of combined frames
+        :type stream: str
+        :param handler: called as ``handler(data, recv_ns)`` for every event of the stream
+        :type handler: Handler
+        """
+        self.handlers[stream] = self.handlers.get(stream, ()) + (handler,)
+
+    def dispatch(self, frame, recv_ns: int) -> bool:
+        """
+        :param frame: websocket text frame
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :return bool: True if the frame was routed to at least one handler
+        """
+        if self.decoder is not None:
+            handlers = self.handlers.get(stream_of(frame))
+            if handlers is not None:
+                data = self.decoder(frame)
+                # Events the decoder rejects, e.g. without update id, are not handed over.
+                if data is None:
+                    return False
+                for handler in handlers:
+                    handler(data, recv_ns)
+                return True
+        message = self.loads(frame)
+        handlers = self.handlers.get(message.get("stream"))
+        if handlers is None:
+            if "id" in message:
+                self.on_reply(message)
+            else:
+                self.unrouted += 1
+            return False
+        data = message["data"]
+        for handler in handlers:
+            handler(data, recv_ns)
+        return True
+
+    def on_reply(self, message: dict) -> None:
+        if message.get("result") is not None or "error" in message:
+            getLogger(f"{__name__}.on_reply").warning(f"Unexpected reply to request {message.get('id')}: {message}")
+
+
+class SubscriptionManager:
+    """
+    Subscribes many streams over as few combined stream connections as Binance limits allow. Each connection sends its
+    ``SUBSCRIBE`` requests in batches, paced below the incoming message limit, while its receive loop already routes
+    the frames through the shared ``StreamRouter``. Connections either use the combined stream endpoint, or negotiate
+    combined payloads on the raw endpoint with a ``SET_PROPERTY`` request sent before subscribing.
+    """
+
+    def __init__(self, url: str, streams: Sequence[str], router: StreamRouter,
+                 max_streams: int = MAX_STREAMS_PER_CONNECTION, batch_size: int = 200,
+                 request_interval: float = 1.0 / MAX_REQUESTS_PER_SECOND + 0.01, negotiate: bool = False):
+        """
+        :param url: raw or combined stream endpoint
+        :type url: str
+        :param streams: stream names to subscribe
+        :type streams: Sequence[str]
+        :param router: router of the received frames
+        :type router: StreamRouter
+        :param max_streams: maximal number of streams of one connection
+        :type max_streams: int
+        :param batch_size: maximal number of streams of one ``SUBSCRIBE`` request
+        :type batch_size: int
+        :param request_interval: pause in seconds between two requests of one connection
+        :type request_interval: float
+        :param negotiate: connect to the raw stream endpoint and set its ``combined`` property once per connection
+        :type negotiate: bool
+        """
+        self.url = raw_url(url) if negotiate else combined_url(url)
+        self.negotiate = negotiate
+        self.router = router
+        self.batch_size = batch_size
+        self.request_interval = request_interval
+        self.plan = plan_connections(streams, max_streams)
+        self.frames = [0] * len(self.plan)
+        self._sockets: List[Optional[Any]] = [None] * len(self.plan)
+
+    async def _subscribe(self, ws, streams: Sequence[str]) -> None:
+        requests = batch_requests(streams, self.batch_size)
+        if self.negotiate:
+            # Handled before the subscriptions, so every stream frame already comes combined.
+            requests.insert(0, {"method": "SET_PROPERTY", "params": ["combined", True], "id": 0})
+        for request in requests:
+            await ws.send(json.dumps(request))
+            await asyncio.sleep(self.request_interval)
+
+    async def session(self, conn_id: int) -> None:
+        """
+        Connect, subscribe and route the frames of one connection until cancelled or disconnected. Supervisors rerun
+        it to reconnect.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        """
+        # Local import, only the connections need websockets.
+        import websockets
+        dispatch = self.router.dispatch
+        async with websockets.connect(self.url, max_size=None) as ws:
+            self._sockets[conn_id] = ws
+            getLogger(f"{__name__}.session").info(f"Connection {conn_id} subscribes "
+                                                  f"{len(self.plan[conn_id])} streams on {self.url}")
+            sender = asyncio.create_task(self._subscribe(ws, self.plan[conn_id]))
+            try:
+                while True:
+                    frame = await ws.recv()
+                    dispatch(frame, now_ns())
+                    self.frames[conn_id] += 1
+            finally:
+                sender.cancel()
+
+    async def run(self) -> None:
+        """
+        Run all connections until cancelled.
+        """
+        await asyncio.gather(*[self.session(conn_id) for conn_id in range(len(self.plan))])
+
+    async def close(self) -> None:
+        await asyncio.gather(*[ws.close() for ws in self._sockets if ws is not None])
+
+
+async def usdt_perpetual_symbols() -> List[str]:
+    """
+    :return List[str]: lower case symbols of all trading USDT-M perpetual futures
+    """
+    # Local import, the REST client is only needed to list the universe.
+    from binance import AsyncClient
+    client = await AsyncClient.create()
+    try:
+        info = await client.futures_exchange_info()
+    finally:
+        await client.close_connection()
+    return [symbol["symbol"].lower() for symbol in info["symbols"]
+            if symbol.get("quoteAsset") == "USDT" and symbol.get("contractType") == "PERPETUAL"
+            and symbol.get("status") == "TRADING"]
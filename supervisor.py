@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from logging import getLogger
+from statistics import median
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Project modules
+from clock import now_ns
+
+__all__ = [
+    "ConnectionSupervisor"
+]
+
+
+class ConnectionSupervisor:
+    """
+    Keeps redundant connections healthy over long captures. Connections report every frame through ``heartbeat`` and
+    run their sessions through ``run_blocking`` (threaded websockets) or ``run_async`` (asyncio websockets), which
+    reconnect with jittered exponential backoff whenever a session ends. A watchdog thread restarts connections that
+    stall (no frame within ``stall_ms``), that lag behind their peers (still missing an update id the peers had
+    ``lag_ms`` ago), and every ``replace_interval_s`` seconds the consistently slowest one, so that it gets a fresh
+    TCP path.
+    """
+
+    def __init__(self, num_conn: int, stall_ms: float = 5000.0, lag_ms: float = 2000.0,
+                 replace_interval_s: float = 0.0, replace_margin_ms: float = 1.0, check_interval_s: float = 0.5,
+                 backoff_base_s: float = 0.5, backoff_max_s: float = 30.0):
+        """
+        :param num_conn: number of connections
+        :type num_conn: int
+        :param stall_ms: silence in milliseconds after which a connection is restarted
+        :type stall_ms: float
+        :param lag_ms: age in milliseconds of the newest peer update id a connection may still miss
+        :type lag_ms: float
+        :param replace_interval_s: interval in seconds between replacements of the slowest connection, 0 disables them
+        :type replace_interval_s: float
+        :param replace_margin_ms: minimal excess in milliseconds of the slowest mean delay over the median of the
+            other connections to replace it
+        :type replace_margin_ms: float
+        :param check_interval_s: interval in seconds of the watchdog checks
+        :type check_interval_s: float
+        :param backoff_base_s: first reconnect backoff in seconds, doubled on every consecutive failure
+        :type backoff_base_s: float
+        :param backoff_max_s: maximal reconnect backoff in seconds
+        :type backoff_max_s: float
+        """
+        self.config = {"num_conn": num_conn, "stall_ms": stall_ms, "lag_ms": lag_ms,
+                       "replace_interval_s": replace_interval_s, "replace_margin_ms": replace_margin_ms,
+                       "check_interval_s": check_interval_s, "backoff_base_s": backoff_base_s,
+                       "backoff_max_s": backoff_max_s}
+        self.stall_ns = int(stall_ms * 1e6)
+        self.lag_ns = int(lag_ms * 1e6)
+        self.replace_interval_ns = int(replace_interval_s * 1e9)
+        self.replace_margin_ns = int(replace_margin_ms * 1e6)
+        self.check_interval_s = check_interval_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.stopped = False
+        self.last_recv = [0] * num_conn
+        self.last_update = [0] * num_conn
+        self.reconnects = [0] * num_conn
+        self.restarts = [0] * num_conn
+        self._delay_sum = [0] * num_conn
+        self._delay_count = [0] * num_conn
+        self._session_start = [0] * num_conn
+        self._restart_hooks: Dict[int, Callable[[], None]] = dict()
+        self._restarting = [False] * num_conn
+        self._active = [False] * num_conn
+        self._peer_updates = deque()
+        self._last_replace = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def heartbeat(self, conn_id: int, recv_ns: int, update_id: int, delay_ns: int) -> None:
+        """
+        Report a frame. Called from the receive path, O(1).
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param recv_ns: client receive time in nanoseconds
+        :type recv_ns: int
+        :param update_id: update id of the frame
+        :type update_id: int
+        :param delay_ns: raw delay of the frame in nanoseconds, without clock offset correction
+        :type delay_ns: int
+        """
+        self.last_recv[conn_id] = recv_ns
+        if update_id > self.last_update[conn_id]:
+            self.last_update[conn_id] = update_id
+        self._delay_sum[conn_id] += delay_ns
+        self._delay_count[conn_id] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """
+        :param attempt: number of consecutive failed sessions, from 1
+        :type attempt: int
+        :return float: jittered exponential backoff in seconds
+        """
+        delay = min(self.backoff_max_s, self.backoff_base_s * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _next_attempt(self, conn_id: int, attempt: int) -> int:
+        # A session which delivered frames resets the backoff.
+        if self.last_recv[conn_id] > self._session_start[conn_id]:
+            return 1
+        return attempt + 1
+
+    def run_blocking(self, conn_id: int, run: Callable[[], Any], close: Callable[[], None]) -> None:
+        """
+        Run blocking sessions of a connection until the supervisor is stopped.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param run: runs one session, e.g. ``WebSocketApp.run_forever``
+        :type run: Callable[[], Any]
+        :param close: ends the running session from another thread, e.g. ``WebSocketApp.close``
+        :type close: Callable[[], None]
+        """
+        self._restart_hooks[conn_id] = close
+        attempt = 0
+        while not self.stopped:
+            self._session_start[conn_id] = now_ns()
+            self._active[conn_id] = True
+            try:
+                run()
+            except Exception as e:
+                getLogger(f"{__name__}.run_blocking").error(f"Session of connection {conn_id} failed: {e}")
+            self._active[conn_id] = False
+            self._restarting[conn_id] = False
+            if self.stopped:
+                break
+            attempt = self._next_attempt(conn_id, attempt)
+            self._log_reconnect(conn_id, attempt)
+            time.sleep(self.backoff(attempt) if attempt > 1 else 0)
+
+    async def run_async(self, conn_id: int, session: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Run asyncio sessions of a connection until the supervisor is stopped.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param session: coroutine function running one session
+        :type session: Callable[[], Awaitable[Any]]
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while not self.stopped:
+            self._session_start[conn_id] = now_ns()
+            task = asyncio.ensure_future(session())
+            # Set when the supervisor ends the session, the only holder of the task besides this coroutine.
+            restarted = threading.Event()
+
+            def restart_session(task=task, restarted=restarted):
+                restarted.set()
+                loop.call_soon_threadsafe(task.cancel)
+
+            self._active[conn_id] = True
+            self._restart_hooks[conn_id] = restart_session
+            try:
+                # Unlike awaiting the task, waiting for it tells a cancellation of this coroutine by the runner, which
+                # is raised here, apart from a restart of the session, which only cancels the task.
+                await asyncio.wait((task,))
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._active[conn_id] = False
+            if task.cancelled():
+                # Cancelled by anyone else, the connection ends as if this coroutine had been cancelled.
+                if not restarted.is_set():
+                    raise asyncio.CancelledError()
+            elif task.exception() is not None:
+                getLogger(f"{__name__}.run_async").error(f"Session of connection {conn_id} failed: "
+                                                         f"{task.exception()}")
+            self._restarting[conn_id] = False
+            if self.stopped:
+                break
+            attempt = self._next_attempt(conn_id, attempt)
+            self._log_reconnect(conn_id, attempt)
+            await asyncio.sleep(self.backoff(attempt) if attempt > 1 else 0)
+
+    def _log_reconnect(self, conn_id: int, attempt: int) -> None:
+        self.reconnects[conn_id] += 1
+        getLogger(f"{__name__}.reconnect").info(f"Reconnecting connection {conn_id}, attempt {attempt}")
+
+    def restart(self, conn_id: int, reason: str) -> None:
+        """
+        End the current session of a connection, which then reconnects.
+
+        :param conn_id: connection index
+        :type conn_id: int
+        :param reason: logged reason of the restart
+        :type reason: str
+        """
+        hook = self._restart_hooks.get(conn_id)
+        if hook is None:
+            return
+        getLogger(f"{__name__}.restart").warning(f"Restarting connection {conn_id}: {reason}")
+        self.restarts[conn_id] += 1
+        self._restarting[conn_id] = True
+        # Do not restart it again before it had the chance to reconnect.
+        self._session_start[conn_id] = now_ns()
+        try:
+            hook()
+        except Exception as e:
+            getLogger(f"{__name__}.restart").error(f"Failed to restart connection {conn_id}: {e}")
+
+    def check(self) -> None:
+        """
+        One watchdog pass over all registered connections.
+        """
+        now = now_ns()
+        conn_ids = list(self._restart_hooks)
+        if not conn_ids:
+            return
+        self._peer_updates.append((now, max(self.last_update[conn_id] for conn_id in conn_ids)))
+        peer_update = 0
+        while self._peer_updates and self._peer_updates[0][0] <= now - self.lag_ns:
+            peer_update = self._peer_updates.popleft()[1]
+        if peer_update:
+            self._peer_updates.appendleft((now - self.lag_ns, peer_update))
+
+        for conn_id in conn_ids:
+            # Connections waiting for their reconnect have no session to restart.
+            if not self._active[conn_id] or self._restarting[conn_id]:
+                continue
+            last_seen = max(self.last_recv[conn_id], self._session_start[conn_id])
+            if now - last_seen > self.stall_ns:
+                self.restart(conn_id, f"no frame for {(now - last_seen) / 1e6:.0f} ms")
+            elif len(conn_ids) > 1 and self.last_update[conn_id] < peer_update and \
+                    self._session_start[conn_id] < now - self.lag_ns:
+                self.restart(conn_id, f"update id {self.last_update[conn_id]} lags behind peers' {peer_update}")
+
+        if self.replace_interval_ns and now - self._last_replace >= self.replace_interval_ns:
+            self._replace_slowest(conn_ids)
+            self._last_replace = now
+
+    def _replace_slowest(self, conn_ids) -> None:
+        means = {conn_id: self._delay_sum[conn_id] / self._delay_count[conn_id]
+                 for conn_id in conn_ids if self._delay_count[conn_id]}
+        for conn_id in conn_ids:
+            self._delay_sum[conn_id], self._delay_count[conn_id] = 0, 0
+        if len(means) < 3:
+            return
+        slowest = max(means, key=means.get)
+        others = median(mean for conn_id, mean in means.items() if conn_id != slowest)
+        if means[slowest] - others > self.replace_margin_ns:
+            self.restart(slowest, f"slowest connection, mean delay {(means[slowest] - others) / 1e6:.3f} ms "
+                                  f"above the median of its peers")
+
+    def _run(self) -> None:
+        self._last_replace = now_ns()
+        while not self._stop_event.wait(self.check_interval_s):
+            try:
+                self.check()
+            except Exception as e:
+                getLogger(f"{__name__}._run").error(f"Supervisor check failed: {e}")
+
+    def start(self) -> "ConnectionSupervisor":
+        self.stopped = False
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ConnectionSupervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the watchdog and end all sessions without reconnecting them.
+        """
+        self.stopped = True
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for conn_id, hook in list(self._restart_hooks.items()):
+            self._restarting[conn_id] = True
+            try:
+                hook()
+            except Exception as e:
+                getLogger(f"{__name__}.stop").error(f"Failed to close connection {conn_id}: {e}")
+        getLogger(f"{__name__}.stop").info(f"Supervisor stopped, reconnects per connection: {self.reconnects}, "
+                                           f"restarts per connection: {self.restarts}")
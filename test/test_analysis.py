@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import tempfile
+import unittest
+
+# Third-party modules
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Project modules
+from analysis import align, first_arrival_share, lead_lag, lead_share, load_samples, pairwise_tests
+from storage import CAPTURE_FILE, CaptureWriter, samples_frame
+
+
+def _samples() -> pd.DataFrame:
+    # Connection 1 receives updates 1 and 2 first, connection 0 update 3; connection 1 misses update 4.
+    conn_id = [0, 1, 0, 1, 0, 1, 0]
+    update_id = [1, 1, 2, 2, 3, 3, 4]
+    delay = [3.0, 1.0, 5.0, 2.0, 1.0, 4.0, 2.0]
+    return pd.DataFrame({"conn_id": conn_id, "update_id": update_id, "client_ms": delay, "delay": delay,
+                         "corrected_delay": np.zeros(len(delay))})
+
+
+class AlignTest(unittest.TestCase):
+    def test_arrivals(self):
+        aligned = align(_samples())
+        self.assertEqual(aligned.shape, (4, 2))
+        self.assertEqual(first_arrival_share(aligned).tolist(), [1 / 3, 2 / 3])
+        self.assertEqual(first_arrival_share(aligned, complete=False).tolist(), [0.5, 0.5])
+        self.assertAlmostEqual(lead_lag(aligned).loc[0, 1], 2 / 3)
+        self.assertAlmostEqual(lead_share(aligned).loc[1, 0], 2 / 3)
+
+    def test_corrected_delays_are_not_aligned(self):
+        with self.assertRaises(ValueError):
+            align(_samples(), "corrected_delay")
+        aligned = align(_samples(), "client_ms")
+        aligned.attrs["column"] = "corrected_delay"
+        for compare in (first_arrival_share, lead_lag, lead_share):
+            with self.assertRaises(ValueError):
+                compare(aligned)
+
+
+class PairwiseTestsTest(unittest.TestCase):
+    def test_matches_scipy(self):
+        rng = np.random.default_rng(7)
+        # Sizes off the quantile grid, so the bin edges of connection 0 fall between its samples.
+        delays = [rng.normal(5.0, 1.0, 50), rng.normal(5.3, 1.2, 37), rng.gamma(4.0, 1.3, 45)]
+        samples = pd.DataFrame({"conn_id": np.repeat(np.arange(3), [len(d) for d in delays]),
+                                "delay": np.concatenate(delays)})
+        tests = pairwise_tests(samples, bins=5)
+        self.assertEqual(list(zip(tests["conn_a"], tests["conn_b"])), [(0, 1), (0, 2), (1, 2)])
+        for row in tests.itertuples():
+            a, b = delays[row.conn_a], delays[row.conn_b]
+            ks = stats.ks_2samp(a, b, method="asymp")
+            self.assertAlmostEqual(row.ks_stat, ks.statistic)
+            # ks_2samp uses the finite sample distribution, pairwise_tests its limit.
+            self.assertAlmostEqual(row.ks_p, stats.kstwobign.sf(ks.statistic * np.sqrt(len(a) * len(b) /
+                                                                                       (len(a) + len(b)))))
+            mwu = stats.mannwhitneyu(a, b, use_continuity=False, method="asymptotic")
+            self.assertAlmostEqual(row.mwu_stat, mwu.statistic)
+            self.assertAlmostEqual(row.mwu_p, mwu.pvalue)
+            edges = np.quantile(a, np.linspace(0, 1, 6))
+            observed = np.histogram(b, edges)[0]
+            expected = np.histogram(a, edges)[0] / len(a) * observed.sum()
+            chi = stats.chisquare(observed, expected)
+            self.assertAlmostEqual(row.chi2_stat, chi.statistic)
+            self.assertAlmostEqual(row.chi2_p, chi.pvalue)
+
+    def test_ties(self):
+        samples = pd.DataFrame({"conn_id": [0, 0, 0, 0, 1, 1, 1], "delay": [1.0, 2.0, 2.0, 3.0, 2.0, 3.0, 3.0]})
+        row = pairwise_tests(samples).iloc[0]
+        self.assertAlmostEqual(row["ks_stat"], stats.ks_2samp([1, 2, 2, 3], [2, 3, 3]).statistic)
+        self.assertAlmostEqual(row["mwu_stat"], stats.mannwhitneyu([1, 2, 2, 3], [2, 3, 3]).statistic)
+
+    def test_single_connection(self):
+        self.assertTrue(pairwise_tests(pd.DataFrame({"conn_id": [0, 0], "delay": [1.0, 2.0]})).empty)
+
+
+class LoadSamplesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_pickles(self):
+        samples_frame(([1, 2], [1_700_000_000_000, 1_700_000_000_001], [0, 1_700_000_000_000],
+                       [1_700_000_000_004_500_000, 1_700_000_000_006_000_000], [1_000_000, 1_000_000])).to_pickle(
+            os.path.join(self.tmp.name, "connection_1.pkl"))
+        pd.DataFrame({"update_id": [1], "client_timestamp": [1_700_000_000_003.5], "delay": [3.5]}).to_pickle(
+            os.path.join(self.tmp.name, "connection_0.pkl"))
+        samples = load_samples(self.tmp.name)
+        self.assertEqual(samples["conn_id"].tolist(), [0, 1, 1])
+        self.assertEqual(samples["update_id"].tolist(), [1, 1, 2])
+        np.testing.assert_allclose(samples["client_ms"], [1_700_000_000_003.5, 1_700_000_000_004.5,
+                                                          1_700_000_000_006.0], rtol=0, atol=1e-3)
+        np.testing.assert_allclose(samples["delay"], [3.5, 4.5, 5.0])
+        np.testing.assert_allclose(samples["corrected_delay"], [3.5, 3.5, 5.0])
+
+    def test_capture(self):
+        writer = CaptureWriter(os.path.join(self.tmp.name, CAPTURE_FILE), 2)
+        writer.write(1, [7, 8], [1_700_000_000_000, 1_700_000_000_001], [1_700_000_000_002_000_000,
+                                                                         1_700_000_000_004_000_000],
+                     [0, 1_700_000_000_000], [500_000, 500_000])
+        writer.close()
+        samples = load_samples(self.tmp.name)
+        self.assertEqual(samples["conn_id"].tolist(), [1, 1])
+        self.assertEqual(samples["update_id"].tolist(), [7, 8])
+        self.assertEqual(samples["delay"].tolist(), [2.0, 3.0])
+        self.assertEqual(samples["corrected_delay"].tolist(), [1.5, 3.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
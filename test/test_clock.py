@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import threading
+import unittest
+
+# Project modules
+from clock import ClockOffsetEstimator, shared_estimator
+
+MS = 1_000_000
+T0 = 1_700_000_000_000
+
+
+class ClockOffsetEstimatorTest(unittest.TestCase):
+    def test_offset_is_the_minimum_over_all_connections(self):
+        estimator = ClockOffsetEstimator()
+        slow, fast = estimator.channel(), estimator.channel()
+        # Connection 0 is 3 ms and connection 1 is 1 ms away from the exchange, the local clock is 50 ms ahead.
+        self.assertEqual(slow.update((T0 + 53) * MS, T0), 53 * MS)
+        # A new lowest sample of any channel lowers the offset at once.
+        self.assertEqual(fast.update((T0 + 51) * MS, T0), 51 * MS)
+        for i in range(1, 100):
+            self.assertEqual(slow.update((T0 + i + 53) * MS, T0 + i), 51 * MS)
+            self.assertEqual(fast.update((T0 + i + 51) * MS, T0 + i), 51 * MS)
+        self.assertEqual(estimator.corrected_delay_ns((T0 + 100 + 53) * MS, T0 + 100), 2 * MS)
+
+    def test_transaction_time_is_the_origin(self):
+        estimator = ClockOffsetEstimator()
+        offset_ns = estimator.update(1_700_000_000_010_000_000, 1_700_000_000_005, 1_700_000_000_002)
+        self.assertEqual(offset_ns, 8_000_000)
+        self.assertEqual(estimator.update(1_700_000_000_020_000_000, 1_700_000_000_011), 8_000_000)
+
+    def test_window_expiry(self):
+        estimator = ClockOffsetEstimator(window_ns=1_000_000_000)
+        estimator.update(1_000_000_000, 0)
+        self.assertEqual(estimator.update(2_500_000_000, 1_000), 1_500_000_000)
+
+    def test_silent_channel_expires(self):
+        estimator = ClockOffsetEstimator(window_ns=1000 * MS, combine_interval_ns=100 * MS)
+        fast, slow = estimator.channel(), estimator.channel()
+        fast.update((T0 + 51) * MS, T0)
+        # The fast connection goes silent, its minimum is forgotten one window and at most one interval later.
+        for i in range(0, 1200, 10):
+            offset_ns = slow.update((T0 + i + 53) * MS, T0 + i)
+            self.assertEqual(offset_ns, 51 * MS if i < 1000 else 53 * MS, i)
+        self.assertEqual(estimator.combine((T0 + 1200 + 53) * MS), 53 * MS)
+
+    def test_channels_of_concurrent_threads(self):
+        estimator = ClockOffsetEstimator()
+        start = threading.Barrier(8)
+
+        def receive(latency_ms: int):
+            channel = estimator.channel()
+            start.wait()
+            for i in range(5000):
+                channel.update((T0 + i + 50 + latency_ms) * MS, T0 + i)
+
+        threads = [threading.Thread(target=receive, args=(latency_ms,)) for latency_ms in range(8, 0, -1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(estimator.combine((T0 + 5000) * MS), 51 * MS)
+        self.assertEqual(estimator.offset_ns, 51 * MS)
+
+    def test_shared_estimator(self):
+        self.assertIs(shared_estimator(), shared_estimator())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import unittest
+
+# Project modules
+from codec import DECODERS, _unwrap, get_decoder, stream_of
+
+BOOK_TICKER = {"e": "bookTicker", "u": 400900217, "s": "BNBUSDT", "b": "25.35190000", "B": "31.21000000",
+               "a": "25.36520000", "A": "40.66000000", "T": 1568014460891, "E": 1568014460893}
+DEPTH = {"e": "depthUpdate", "E": 1571889248277, "T": 1571889248276, "s": "BTCUSDT", "U": 390497796,
+         "u": 390497878, "pu": 390497794, "b": [["7403.89", "0.002"]], "a": [["7405.96", "3.340"]]}
+
+
+def _payloads(event: dict, stream: str):
+    combined = {"stream": stream, "data": event}
+    return {
+        "compact": json.dumps(event, separators=(",", ":")),
+        "spaced": json.dumps(event),
+        "indented": json.dumps(event, indent=2),
+        "combined compact": json.dumps(combined, separators=(",", ":")),
+        "combined spaced": json.dumps(combined)
+    }
+
+
+class StreamOfTest(unittest.TestCase):
+    def test_stream_names(self):
+        for event, stream in ((BOOK_TICKER, "bnbusdt@bookTicker"), (DEPTH, "btcusdt@depth@100ms")):
+            payloads = _payloads(event, stream)
+            for layout in ("combined compact", "combined spaced"):
+                self.assertEqual(stream_of(payloads[layout]), stream, layout)
+                self.assertEqual(stream_of(payloads[layout].encode()), stream, layout)
+            for layout in ("compact", "spaced"):
+                self.assertIsNone(stream_of(payloads[layout]), layout)
+        self.assertIsNone(stream_of('{"result":null,"id":1}'))
+
+
+class DecodersTest(unittest.TestCase):
+    def test_unwrap(self):
+        self.assertEqual(_unwrap(BOOK_TICKER), BOOK_TICKER)
+        self.assertEqual(_unwrap({"stream": "bnbusdt@bookTicker", "data": BOOK_TICKER}), BOOK_TICKER)
+        self.assertIsNone(_unwrap({"result": None, "id": 3}))
+        self.assertIsNone(_unwrap([1, 2]))
+        self.assertIsNone(_unwrap({"stream": "bnbusdt@bookTicker", "data": [1]}))
+
+    def test_decoders_agree(self):
+        for event, stream in ((BOOK_TICKER, "bnbusdt@bookTicker"), (DEPTH, "btcusdt@depth@100ms")):
+            for layout, frame in _payloads(event, stream).items():
+                for name in DECODERS:
+                    self.assertEqual(get_decoder(name)(frame), event, f"{name} {layout}")
+                    self.assertEqual(get_decoder(name)(frame.encode()), event, f"{name} {layout}")
+        for name in DECODERS:
+            self.assertIsNone(get_decoder(name)('{"result":null,"id":1}'), name)
+        for name in ("yaml", "fields"):
+            with self.assertRaises(ValueError):
+                get_decoder(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import threading
+import unittest
+
+# Project modules
+from fanin import FirstArrivalFanIn
+
+
+class FirstArrivalFanInTest(unittest.TestCase):
+    def test_first_copy_wins(self):
+        emitted = list()
+        fan_in = FirstArrivalFanIn(2, sink=lambda conn_id, data, curr_time: emitted.append((conn_id, data["u"])))
+        self.assertTrue(fan_in.offer(1, 10, {"u": 10}, 0))
+        self.assertFalse(fan_in.offer(0, 10, {"u": 10}, 1))
+        self.assertTrue(fan_in.offer(0, 11, {"u": 11}, 2))
+        self.assertEqual(emitted, [(1, 10), (0, 11)])
+        self.assertEqual(fan_in.wins, [1, 1])
+        self.assertEqual(fan_in.duplicates, [1, 0])
+
+    def test_copies_later_than_the_window_are_dropped(self):
+        fan_in = FirstArrivalFanIn(2, window=4)
+        for update_id in range(1, 10):
+            self.assertTrue(fan_in.offer(0, update_id, {"u": update_id}, update_id))
+        for update_id in range(1, 10):
+            self.assertFalse(fan_in.offer(1, update_id, {"u": update_id}, 100 + update_id))
+        self.assertEqual(fan_in.wins, [9, 0])
+        self.assertEqual(fan_in.duplicates, [0, 9])
+        self.assertEqual(fan_in.emitted, 9)
+
+    def test_reordering_inside_the_window(self):
+        fan_in = FirstArrivalFanIn(1, window=4)
+        self.assertTrue(fan_in.offer(0, 2, {"u": 2}, 0))
+        self.assertTrue(fan_in.offer(0, 1, {"u": 1}, 1))
+        self.assertEqual(fan_in.emitted, 2)
+
+    def test_sink_sees_the_emission_order(self):
+        delivered = list()
+        num_updates = 20_000
+        fan_in = FirstArrivalFanIn(4, window=num_updates,
+                                   sink=lambda conn_id, data, curr_time: delivered.append(data["u"]))
+        start = threading.Barrier(fan_in.num_conn)
+
+        def receive(conn_id: int):
+            start.wait()
+            for update_id in range(num_updates):
+                fan_in.offer(conn_id, update_id, {"u": update_id}, update_id)
+
+        threads = [threading.Thread(target=receive, args=(conn_id,)) for conn_id in range(fan_in.num_conn)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every update reaches the sink once and in the order it won the fan-in.
+        self.assertEqual(delivered, list(fan_in._order))
+        self.assertEqual(sorted(delivered), list(range(num_updates)))
+        self.assertEqual(sum(fan_in.wins), num_updates)
+
+
+if __name__ == "__main__":
+    unittest.main()
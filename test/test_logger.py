@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import json
+import logging
+import tempfile
+import threading
+import unittest
+from logging import getLogger, Formatter, LogRecord
+from logging.handlers import QueueHandler
+from unittest import mock
+
+# Project modules
+from binance_logger import BufferedRotatingFileHandler, RateLimitFilter, init_logger, stop_logger
+
+
+def _record(msg: str, level: int = logging.INFO, lineno: int = 10) -> LogRecord:
+    return LogRecord("network", level, "network.py", lineno, msg, None, None)
+
+
+class InitLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.root_handlers = list(getLogger().handlers)
+        self.root_level = getLogger().level
+        self.addCleanup(self._restore)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def _restore(self):
+        stop_logger()
+        getLogger().handlers = self.root_handlers
+        getLogger().setLevel(self.root_level)
+
+    def _queue_handlers(self):
+        return [handler for handler in getLogger().handlers if isinstance(handler, QueueHandler)]
+
+    def test_second_init_replaces_the_queue_handler(self):
+        first, second = os.path.join(self.dir, "first.log"), os.path.join(self.dir, "second.log")
+        init_logger(first)
+        getLogger("test.first").info("to first")
+        init_logger(second)
+        self.assertEqual(len(self._queue_handlers()), 1)
+        getLogger("test.second").info("to second")
+        stop_logger()
+        self.assertEqual(self._queue_handlers(), [])
+        with open(first, encoding="utf-8") as f:
+            self.assertEqual([json.loads(line)["message"] for line in f], ["to first"])
+        with open(second, encoding="utf-8") as f:
+            self.assertEqual([json.loads(line)["message"] for line in f], ["to second"])
+
+    def test_direct_mode_after_queued_mode(self):
+        init_logger(os.path.join(self.dir, "queued.log"))
+        logger = init_logger(os.path.join(self.dir, "direct.log"), queued=False)
+        self.assertEqual(self._queue_handlers(), [])
+        self.assertEqual(logger.level, logging.INFO)
+        for handler in logger.handlers:
+            if handler not in self.root_handlers:
+                handler.close()
+
+
+class RateLimitFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("binance_logger.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_per_call_site(self):
+        rate_limit = RateLimitFilter(burst=3, interval=1.0)
+        self.assertEqual([rate_limit.filter(_record(f"open {i}")) for i in range(5)], [True] * 3 + [False] * 2)
+        # Another call site has its own budget.
+        self.assertTrue(rate_limit.filter(_record("close", lineno=20)))
+        self.now += 0.5
+        self.assertFalse(rate_limit.filter(_record("open 5")))
+        self.now += 0.5
+        record = _record("open 6")
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.getMessage(), "open 6 [3 similar messages suppressed]")
+        # Nothing was suppressed in the previous interval.
+        self.now += 1.0
+        record = _record("open 7")
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.getMessage(), "open 7")
+
+    def test_errors_are_never_suppressed(self):
+        rate_limit = RateLimitFilter(burst=1, interval=1.0)
+        self.assertTrue(rate_limit.filter(_record("failed", logging.WARNING)))
+        self.assertFalse(rate_limit.filter(_record("failed", logging.WARNING)))
+        for level in (logging.ERROR, logging.CRITICAL, logging.ERROR):
+            self.assertTrue(rate_limit.filter(_record("failed", level)))
+
+    def test_concurrent_call_sites(self):
+        rate_limit = RateLimitFilter(burst=50, interval=60.0)
+        passed = [0] * 8
+        start = threading.Barrier(len(passed))
+
+        def log(thread_idx: int):
+            start.wait()
+            for i in range(2000):
+                passed[thread_idx] += rate_limit.filter(_record(f"frame {i}"))
+
+        threads = [threading.Thread(target=log, args=(thread_idx,)) for thread_idx in range(len(passed))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(passed), 50)
+        self.assertEqual(rate_limit._sites[("network.py", 10)][1:], [50, len(passed) * 2000 - 50])
+
+
+class BufferedRotatingFileHandlerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "binance.log")
+
+    def _handler(self, **kwargs) -> BufferedRotatingFileHandler:
+        handler = BufferedRotatingFileHandler(self.path, **kwargs)
+        handler.setFormatter(Formatter("%(message)s"))
+        self.addCleanup(handler.close)
+        return handler
+
+    def _lines(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_rotation(self):
+        handler = self._handler(max_bytes=100, backup_count=2)
+        for i in range(40):
+            handler.emit(_record(f"record {i:03d}"))
+        handler.close()
+        # Every file holds 9 records of 11 bytes, the oldest records are dropped with the third backup.
+        files = [self.path, self.path + ".1", self.path + ".2"]
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        for path in files:
+            self.assertLessEqual(os.path.getsize(path), 100)
+        lines = [line for path in reversed(files) for line in self._lines(path)]
+        self.assertEqual(lines, [f"record {i:03d}" for i in range(40 - len(lines), 40)])
+        self.assertEqual(len(lines), 22)
+
+    def test_rotation_counts_bytes(self):
+        handler = self._handler(max_bytes=100, backup_count=3)
+        # 10 characters but 20 bytes in UTF-8 with the newline, 5 records fit a file.
+        for i in range(20):
+            handler.emit(_record(f"€€€€€ {i:03d}"))
+        handler.close()
+        files = [self.path] + [f"{self.path}.{i}" for i in range(1, 4)]
+        for path in files:
+            self.assertLessEqual(os.path.getsize(path), 100)
+        self.assertEqual([len(self._lines(path)) for path in reversed(files)], [5, 5, 5, 5])
+
+    def test_existing_file_is_appended_and_rotated(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("x" * 95 + "\n")
+        handler = self._handler(max_bytes=100, backup_count=1)
+        handler.emit(_record("first"))
+        handler.close()
+        self.assertEqual(self._lines(self.path), ["first"])
+        self.assertEqual(self._lines(self.path + ".1"), ["x" * 95])
+
+    def test_flush(self):
+        now = [100.0]
+        with mock.patch("binance_logger.time.monotonic", lambda: now[0]):
+            handler = self._handler(flush_interval=1.0)
+            handler.emit(_record("buffered"))
+            self.assertEqual(os.path.getsize(self.path), 0)
+            handler.emit(_record("failed", logging.ERROR))
+            self.assertEqual(self._lines(self.path), ["buffered", "failed"])
+            handler.emit(_record("buffered again"))
+            now[0] += 1.0
+            handler.emit(_record("late"))
+            self.assertEqual(self._lines(self.path)[2:], ["buffered again", "late"])
+
+
+if __name__ == "__main__":
+    unittest.main()
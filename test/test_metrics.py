@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import random
+import unittest
+from unittest import mock
+
+# Third-party modules
+import numpy as np
+
+# Project modules
+from metrics import ConnectionMetrics, LogHistogram, MetricsRegistry, quantiles
+
+
+def _exact_quantile(sorted_values, q):
+    return sorted_values[max(1, int(q * len(sorted_values) + 0.5)) - 1]
+
+
+class LogHistogramTest(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        hist = LogHistogram()
+        for value in range(128):
+            hist.record(value)
+        self.assertEqual(hist.filled(), list(range(128)))
+        for value in range(128):
+            self.assertEqual(hist.value_at(value), value)
+        self.assertEqual(hist.quantile(0.5), 63)
+        hist.record(-5)
+        self.assertEqual(hist.counts[0], 2)
+
+    def test_bucket_relative_error(self):
+        hist = LogHistogram()
+        for value in (128, 1000, 123_456, 10 ** 9, 2 ** 40 + 12345):
+            hist.reset()
+            hist.record(value)
+            (index,) = hist.filled()
+            self.assertLess(abs(hist.value_at(index) - value) / value, 2 ** -6)
+
+    def test_quantile_error(self):
+        rng = random.Random(3)
+        values = sorted(int(rng.lognormvariate(10, 2)) for _ in range(20000))
+        hist = LogHistogram()
+        for value in values:
+            hist.record(value)
+        self.assertEqual((hist.count, hist.max), (len(values), values[-1]))
+        for q in (0.01, 0.5, 0.9, 0.99, 0.999, 1.0):
+            exact = _exact_quantile(values, q)
+            self.assertLessEqual(abs(hist.quantile(q) - exact), max(1, exact * 2 ** -6))
+        self.assertEqual(hist.quantile(1.0), values[-1])
+
+    def test_quantiles_of_union(self):
+        first, second = LogHistogram(), LogHistogram()
+        for value in range(0, 5000, 7):
+            first.record(value)
+        for value in range(3, 90000, 11):
+            second.record(value)
+        merged = LogHistogram()
+        merged.merge(first)
+        merged.merge(second)
+        self.assertEqual(merged.count, first.count + second.count)
+        qs = (0.0, 0.25, 0.5, 0.99, 1.0)
+        self.assertEqual(quantiles((first, second), qs), [merged.quantile(q) for q in qs])
+        self.assertEqual(quantiles((LogHistogram(), LogHistogram()), qs), [0] * len(qs))
+
+    def test_record_many(self):
+        values = [-3, 0, 1, 127, 128, 129, 255, 256, 1000, 123_456, 10 ** 9, 2 ** 40 + 12345, 2 ** 52 - 1]
+        single, batched = LogHistogram(), LogHistogram()
+        for value in values:
+            single.record(value)
+        batched.record_many(np.array(values, dtype=np.int64))
+        batched.record_many(np.array([], dtype=np.int64))
+        self.assertEqual(batched.filled(), single.filled())
+        self.assertEqual(bytes(batched.counts), bytes(single.counts))
+        self.assertEqual((batched.count, batched.max), (single.count, single.max))
+
+
+class ConnectionMetricsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("metrics.now_ns", return_value=0)
+        self.now_ns = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rolling_window(self):
+        conn = ConnectionMetrics(2, window_s=1.0, gap_ms=100.0)
+        # 0.5 s of 100 us delays, a 200 ms silence, then 1 ms delays until the window rotates twice.
+        for i in range(50):
+            conn.record(i * 10_000_000, 100_000)
+        for i in range(100):
+            conn.record(700_000_000 + i * 10_000_000, 1_000_000)
+        self.now_ns.return_value = 1_700_000_000
+        snap = conn.snapshot()
+        self.assertEqual((snap["conn_id"], snap["messages"], snap["gaps"]), (2, 150, 1))
+        self.assertEqual((snap["p50_us"], snap["p99_us"], snap["max_us"]), (1000, 1000, 1000))
+        self.assertAlmostEqual(snap["rate"], 150 / 1.7)
+        conn.record(2_100_000_000, 50_000)
+        snap = conn.snapshot()
+        # The first window rotated out with its gap: the second one remains, and the new frame after a 410 ms gap.
+        self.assertEqual((snap["messages"], snap["gaps"], snap["total_messages"], snap["total_gaps"]),
+                         (71, 1, 151, 2))
+        self.assertEqual(snap["max_us"], 1000)
+
+    def test_silent_connection(self):
+        conn = ConnectionMetrics(0, window_s=1.0, gap_ms=100.0)
+        for i in range(50):
+            conn.record(i * 10_000_000, 2_000_000)
+        self.now_ns.return_value = 550_000_000
+        snap = conn.snapshot()
+        # 60 ms since the last frame, below the gap threshold.
+        self.assertEqual((snap["messages"], snap["gaps"], snap["total_gaps"]), (50, 0, 0))
+        self.assertAlmostEqual(snap["silence_ms"], 60.0)
+        self.now_ns.return_value = 1_200_000_000
+        snap = conn.snapshot()
+        # The snapshot rotates the window, the silence is an ongoing gap.
+        self.assertEqual((snap["messages"], snap["p99_us"], snap["gaps"], snap["total_gaps"]), (50, 2000, 1, 1))
+        self.assertAlmostEqual(snap["silence_ms"], 710.0)
+        self.now_ns.return_value = 2_300_000_000
+        snap = conn.snapshot()
+        # Silent for more than a window: its latencies aged out, the gap is still reported.
+        self.assertEqual((snap["messages"], snap["p50_us"], snap["p99_us"], snap["max_us"], snap["gaps"]),
+                         (0, 0, 0, 0, 1))
+        self.assertEqual((snap["total_messages"], snap["total_gaps"]), (50, 1))
+        # The gap ends with the next frame and is counted once.
+        conn.record(2_300_000_000, 1_000_000)
+        snap = conn.snapshot()
+        self.assertEqual((snap["messages"], snap["gaps"], snap["total_gaps"], snap["silence_ms"]), (1, 1, 1, 0.0))
+
+    def test_record_many(self):
+        rng = random.Random(5)
+        recv_ns = np.cumsum([rng.choice((1, 10, 10, 10, 150)) * 1_000_000 for _ in range(600)]).astype(np.int64)
+        delay_ns = np.array([rng.randint(0, 5_000_000) for _ in range(600)], dtype=np.int64)
+        single, batched = (ConnectionMetrics(0, window_s=1.0, gap_ms=100.0) for _ in range(2))
+        for recv, delay in zip(recv_ns.tolist(), delay_ns.tolist()):
+            single.record(recv, delay)
+        # Batches of a worker flush interval, several of them span a rotation of the window.
+        for start in range(0, 600, 40):
+            batched.record_many(recv_ns[start:start + 40], delay_ns[start:start + 40])
+        self.now_ns.return_value = int(recv_ns[-1])
+        self.assertEqual(batched.snapshot(), single.snapshot())
+        self.assertGreater(single.total_gaps, 0)
+
+    def test_registry(self):
+        registry = MetricsRegistry(2)
+        registry.connections[1].record(10, 3_000)
+        text = registry.prometheus_text()
+        self.assertIn('binance_ws_messages_total{conn_id="0"} 0', text)
+        self.assertIn('binance_ws_latency_max_microseconds{conn_id="1"} 3', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
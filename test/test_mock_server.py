@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import random
+import unittest
+from itertools import islice
+
+# Project modules
+from mock_server import MockFuturesServer
+
+STREAM = "btcusdt@bookTicker"
+
+
+def _schedule(server: MockFuturesServer, stream: str = STREAM) -> list:
+    return list(islice(server._schedule(server._random(stream)), 100))
+
+
+class MockFuturesServerTest(unittest.TestCase):
+    def test_seed_does_not_touch_the_process_generator(self):
+        random.seed(11)
+        expected = random.random()
+        random.seed(11)
+        _schedule(MockFuturesServer(port=0, seed=0))
+        self.assertEqual(random.random(), expected)
+
+    def test_seeded_schedules_repeat(self):
+        schedules = [_schedule(MockFuturesServer(port=0, rate=50, seed=seed)) for seed in (4, 4, 5)]
+        self.assertEqual(schedules[0], schedules[1])
+        self.assertNotEqual(schedules[0], schedules[2])
+        # Every stream has its own generator.
+        self.assertNotEqual(schedules[0], _schedule(MockFuturesServer(port=0, rate=50, seed=4), "ethusdt@depth"))
+        self.assertEqual({interval for interval, _ in schedules[0]}, {0.02})
+
+    def test_unseeded_schedules_differ(self):
+        server = MockFuturesServer(port=0)
+        self.assertNotEqual(_schedule(server), _schedule(server))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import time
+import unittest
+
+# Third-party modules
+import websocket
+
+# Project modules
+from mock_server import MockFuturesServer
+from orderbook import BookSide, LocalOrderBook
+
+
+def _event(first_u: int, last_u: int, prev_u: int, bids=(), asks=()) -> dict:
+    return {"e": "depthUpdate", "E": 1_700_000_000_000, "T": 1_700_000_000_000, "s": "BTCUSDT",
+            "U": first_u, "u": last_u, "pu": prev_u, "b": [list(level) for level in bids],
+            "a": [list(level) for level in asks]}
+
+
+SNAPSHOT = {"lastUpdateId": 5, "bids": [["99.0", "1.0"], ["98.0", "2.0"]], "asks": [["101.0", "1.0"], ["102.0", "2.0"]]}
+
+
+class BookSideTest(unittest.TestCase):
+    def test_sorted_levels(self):
+        bids = BookSide(descending=True)
+        bids.apply([["99.0", "1"], ["101.0", "2"], ["100.0", "3"], ["101.0", "4"]])
+        self.assertEqual(bids.top(3), [(101.0, 4.0), (100.0, 3.0), (99.0, 1.0)])
+        bids.apply([["101.0", "0"], ["97.0", "0"]])
+        self.assertEqual(bids.best(), (100.0, 3.0))
+        self.assertEqual(len(bids), 2)
+
+
+class LocalOrderBookTest(unittest.TestCase):
+    def test_snapshot_spanning_buffered_updates(self):
+        book = LocalOrderBook("btcusdt")
+        book.on_event(0, _event(1, 3, 0, bids=[("99.0", "9.0")]), 0)
+        book.on_event(0, _event(4, 7, 3, bids=[("99.5", "1.0")]), 0)
+        book.on_event(0, _event(8, 10, 7, asks=[("101.0", "0")]), 0)
+        self.assertTrue(book.load_snapshot(SNAPSHOT))
+        # The event before the snapshot is dropped, the one straddling it is the first applied.
+        self.assertEqual((book.dropped, book.applied, book.last_u), (1, 2, 10))
+        self.assertEqual(book.book.best_bid(), (99.5, 1.0))
+        self.assertEqual(book.book.bids.top(3), [(99.5, 1.0), (99.0, 1.0), (98.0, 2.0)])
+        self.assertEqual(book.book.best_ask(), (102.0, 2.0))
+
+    def test_snapshot_older_than_the_stream(self):
+        book = LocalOrderBook("btcusdt")
+        book.on_event(0, _event(8, 10, 7), 0)
+        self.assertFalse(book.load_snapshot(SNAPSHOT))
+        self.assertEqual(book.resyncs, 1)
+
+    def test_pu_chain_resync(self):
+        book = LocalOrderBook("btcusdt")
+        self.assertTrue(book.load_snapshot(SNAPSHOT))
+        book.on_event(0, _event(5, 8, 4), 0)
+        book.on_event(0, _event(9, 12, 8), 0)
+        self.assertTrue(book.synced)
+        # Events 13..15 are lost.
+        book.on_event(0, _event(16, 18, 15, bids=[("99.9", "1.0")]), 0)
+        self.assertFalse(book.synced)
+        self.assertEqual(book.resyncs, 1)
+        book.on_event(0, _event(19, 20, 18), 0)
+        self.assertTrue(book.load_snapshot({"lastUpdateId": 17, "bids": [["99.0", "1.0"]], "asks": [["101.0", "1.0"]]}))
+        self.assertEqual((book.last_u, book.book.best_bid()), (20, (99.9, 1.0)))
+
+    def test_crossed_levels_are_removed(self):
+        book = LocalOrderBook("btcusdt")
+        book.load_snapshot(SNAPSHOT)
+        # The mid moves up: a new bid above the old best ask comes with the removal of the crossed ask.
+        book.on_event(0, _event(6, 6, 5, bids=[("101.5", "1.0")], asks=[("103.0", "1.0"), ("101.0", "0.000")]), 0)
+        self.assertEqual(book.book.best_bid(), (101.5, 1.0))
+        self.assertEqual(book.book.best_ask(), (102.0, 2.0))
+
+
+class MockDepthStreamTest(unittest.TestCase):
+    def test_local_book_never_crosses(self):
+        server = MockFuturesServer(port=0, rate=2000, seed=7).start_in_thread()
+        self.addCleanup(server.stop_thread)
+        stream = websocket.create_connection(server.url, timeout=5)
+        self.addCleanup(stream.close)
+        stream.send(json.dumps({"method": "SUBSCRIBE", "params": ["btcusdt@depth@100ms"], "id": 1}))
+        book = LocalOrderBook("btcusdt")
+        deadline, crossed = time.monotonic() + 1.5, 0
+        while time.monotonic() < deadline:
+            data = json.loads(stream.recv())
+            if "id" in data:
+                continue
+            book.on_event(0, data, 0)
+            if not book.synced and book.resyncs == 0 and book.applied == 0 and len(book._buffer) == 50:
+                requests = websocket.create_connection(server.url, timeout=5)
+                requests.send(json.dumps({"method": "depth", "params": {"symbol": "BTCUSDT"}, "id": 2}))
+                self.assertTrue(book.load_snapshot(json.loads(requests.recv())["result"]))
+                requests.close()
+            if book.synced and book.book.best_bid() and book.book.best_ask():
+                crossed += book.book.best_bid()[0] >= book.book.best_ask()[0]
+        self.assertGreater(book.applied, 500)
+        self.assertEqual(book.resyncs, 0)
+        self.assertEqual(crossed, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import math
+import unittest
+
+# Project modules
+from publisher import _HEADER, _SEQ, _SLOT, TickPublisher, TickSubscriber
+
+
+def _publish(publisher: TickPublisher, first: int, last: int) -> None:
+    for update_id in range(first, last + 1):
+        publisher.publish("BTCUSDT", update_id, 100.0 + update_id, 1.0, 101.0 + update_id, 2.0, update_id, update_id)
+
+
+class TickRingTest(unittest.TestCase):
+    def _ring(self, capacity: int) -> TickPublisher:
+        publisher = TickPublisher(f"bfc_test_{os.getpid()}_{self._testMethodName}", capacity, "btcusdt")
+        self.addCleanup(publisher.close)
+        return publisher
+
+    def _subscriber(self, publisher: TickPublisher, from_start: bool = False) -> TickSubscriber:
+        subscriber = TickSubscriber(publisher.name, from_start)
+        self.addCleanup(subscriber.close)
+        return subscriber
+
+    def test_round_trip(self):
+        publisher = self._ring(8)
+        subscriber = self._subscriber(publisher)
+        _publish(publisher, 1, 3)
+        ticks = subscriber.poll()
+        self.assertEqual([tick.update_id for tick in ticks], [1, 2, 3])
+        self.assertEqual(ticks[0][:6], (1, "BTCUSDT", 1, 101.0, 1.0, 102.0))
+        self.assertEqual(subscriber.poll(), [])
+        publisher.on_event(0, {"u": 4, "E": 4}, 4)
+        tick = subscriber.poll()[0]
+        self.assertEqual((tick.symbol, tick.update_id), ("BTCUSDT", 4))
+        self.assertTrue(math.isnan(tick.bid_price))
+
+    def test_max_ticks_and_from_start(self):
+        publisher = self._ring(4)
+        _publish(publisher, 1, 6)
+        subscriber = self._subscriber(publisher, from_start=True)
+        self.assertEqual([tick.update_id for tick in subscriber.poll(2)], [3, 4])
+        self.assertEqual([tick.update_id for tick in subscriber.poll()], [5, 6])
+        self.assertEqual(subscriber.lost, 0)
+
+    def test_overrun_reader_counts_lost_ticks(self):
+        publisher = self._ring(8)
+        subscriber = self._subscriber(publisher)
+        _publish(publisher, 1, 13)
+        # Ticks 1 to 5 were overwritten before the first poll, the oldest 8 remain.
+        self.assertEqual([tick.seq for tick in subscriber.poll()], list(range(6, 14)))
+        self.assertEqual(subscriber.lost, 5)
+        _publish(publisher, 14, 15)
+        self.assertEqual([tick.seq for tick in subscriber.poll()], [14, 15])
+        self.assertEqual(subscriber.lost, 5)
+
+    def test_slot_rewritten_during_read_is_skipped(self):
+        publisher = self._ring(8)
+        subscriber = self._subscriber(publisher)
+        _publish(publisher, 1, 3)
+        # The publisher marks a slot with its negated new sequence number while it rewrites it, here tick 10 in the
+        # slot of tick 2: the reader sees neither sequence number match and skips the slot.
+        _SEQ.pack_into(publisher.shm.buf, _HEADER.size + 2 * _SLOT.size, -10)
+        self.assertEqual([tick.seq for tick in subscriber.poll()], [1, 3])
+        self.assertEqual(subscriber.lost, 1)
+
+    def test_publish_after_close_is_discarded(self):
+        publisher = self._ring(8)
+        _publish(publisher, 1, 2)
+        publisher.close()
+        self.assertEqual(publisher.publish("BTCUSDT", 3, 1.0, 1.0, 1.0, 1.0, 3, 3), 0)
+        publisher.on_event(0, {"u": 4, "E": 4}, 4)
+        self.assertEqual(publisher.seq, 2)
+        with self.assertRaises(FileNotFoundError):
+            TickSubscriber(publisher.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import gc
+import unittest
+import weakref
+
+# Project modules
+from ring import FrameRing, RingConsumer
+
+
+class Frame:
+    pass
+
+
+class FrameRingTest(unittest.TestCase):
+    def test_wrap_around(self):
+        ring = FrameRing(4)
+        for i in range(3):
+            ring.push(f"f{i}", i)
+        self.assertEqual(ring.drain(), ([0, 1, 2], ["f0", "f1", "f2"]))
+        # Slots 3, 0, 1 and 2: the batch wraps past the end of the ring and fills it completely.
+        for i in range(3, 7):
+            self.assertTrue(ring.push(f"f{i}", i))
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.drain(), ([3, 4, 5, 6], ["f3", "f4", "f5", "f6"]))
+        self.assertEqual(ring.drain(), ([], []))
+
+    def test_drained_frames_are_released(self):
+        ring = FrameRing(4)
+        for batch in range(3):
+            # The second and third batch wrap past the end of the ring.
+            frames = [Frame() for _ in range(3)]
+            refs = [weakref.ref(frame) for frame in frames]
+            for frame in frames:
+                ring.push(frame, 0)
+            self.assertEqual(ring.drain()[1], frames)
+            del frames, frame
+            gc.collect()
+            self.assertEqual([ref() for ref in refs], [None] * 3, f"batch {batch}")
+        self.assertEqual(ring._frames, [None] * 4)
+
+    def test_full_ring_drops_new_frames(self):
+        ring = FrameRing(2)
+        self.assertTrue(ring.push("a", 1))
+        self.assertTrue(ring.push("b", 2))
+        self.assertFalse(ring.push("c", 3))
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(ring.drain(), ([1, 2], ["a", "b"]))
+        self.assertTrue(ring.push("d", 4))
+        self.assertEqual(ring.drain(), ([4], ["d"]))
+
+    def test_drain_limit(self):
+        ring = FrameRing(8)
+        for i in range(5):
+            ring.push(i, i)
+        self.assertEqual(ring.drain(2), ([0, 1], [0, 1]))
+        self.assertEqual(ring.drain(2), ([2, 3], [2, 3]))
+        self.assertEqual(ring.drain(2), ([4], [4]))
+        self.assertEqual(len(ring), 0)
+
+
+class RingConsumerTest(unittest.TestCase):
+    def test_stop_handles_the_rest(self):
+        rings = [FrameRing(1024), FrameRing(1024)]
+        handled = [list(), list()]
+        consumer = RingConsumer(batch_size=16, poll_interval=0.01)
+        for ring, frames in zip(rings, handled):
+            consumer.add(ring, lambda frame, recv_ns, frames=frames: frames.append((frame, recv_ns)))
+        for i in range(1000):
+            rings[i % 2].push(i, i)
+        consumer.start()
+        consumer.stop()
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(handled[0], [(i, i) for i in range(0, 1000, 2)])
+        self.assertEqual(handled[1], [(i, i) for i in range(1, 1000, 2)])
+        self.assertGreaterEqual(consumer.batches, 1000 // 16)
+        self.assertEqual(consumer.max_backlog, 500)
+
+    def test_failing_frame_does_not_stop_the_batch(self):
+        ring, handled = FrameRing(8), list()
+
+        def handle(frame, recv_ns):
+            if frame == "bad":
+                raise ValueError(frame)
+            handled.append(frame)
+
+        consumer = RingConsumer()
+        consumer.add(ring, handle)
+        for frame in ("a", "bad", "b"):
+            ring.push(frame, 0)
+        with self.assertLogs("ring._drain_all", "ERROR"):
+            consumer.start()
+            consumer.stop()
+        self.assertEqual(handled, ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
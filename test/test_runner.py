@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import logging
+import unittest
+
+# Third-party modules
+import numpy as np
+
+# Project modules
+from fanin import FirstArrivalFanIn
+from metrics import MetricsRegistry
+from mock_server import MockFuturesServer
+from recorder import SampleRecorder
+from runner import _ArrivalMerger, _apply_shared_offset, _record_batch_metrics, run_MWMP
+from sequence import SequenceTracker
+from stages import LatencyBreakdown
+
+
+def _rows(rows) -> np.ndarray:
+    return np.array(rows, dtype=np.int64).reshape(-1, len(SampleRecorder.FIELDS))
+
+
+class ApplySharedOffsetTest(unittest.TestCase):
+    def test_lowest_worker_estimate_is_used(self):
+        worker_offsets = [None, None]
+        # update_id, event_time, transaction_time, client_time_ns, offset_ns of the estimate of the worker.
+        first = _rows([(1, 1_700_000_000_000, 0, 1_700_000_000_009_000_000, 9_000_000),
+                       (2, 1_700_000_000_010, 0, 1_700_000_000_017_000_000, 7_000_000)])
+        _apply_shared_offset(first, 0, worker_offsets)
+        self.assertEqual(first[:, 4].tolist(), [9_000_000, 7_000_000])
+        second = _rows([(2, 1_700_000_000_010, 1_700_000_000_008, 1_700_000_000_012_000_000, 4_000_000),
+                        (3, 1_700_000_000_020, 0, 1_700_000_000_030_000_000, 8_000_000)])
+        _apply_shared_offset(second, 1, worker_offsets)
+        # Worker 1 keeps its lower estimate, its later rows take the one of worker 0.
+        self.assertEqual(second[:, 4].tolist(), [4_000_000, 7_000_000])
+        self.assertEqual(worker_offsets, [7_000_000, 8_000_000])
+        third = _rows([(4, 1_700_000_000_030, 0, 1_700_000_000_040_000_000, 9_000_000)])
+        _apply_shared_offset(third, 0, worker_offsets)
+        self.assertEqual(third[:, 4].tolist(), [8_000_000])
+        self.assertEqual(third[:, 0].tolist(), [4])
+
+
+class RecordBatchMetricsTest(unittest.TestCase):
+    def test_batch_matches_single_records(self):
+        rows = _rows([(update_id, 1_700_000_000_000 + update_id, 1_700_000_000_000 + update_id if update_id % 2 else 0,
+                       (1_700_000_000_000 + update_id + 3) * 1_000_000 + 7_000 * update_id, 1_000_000)
+                      for update_id in range(1, 200)])
+        batched, single = MetricsRegistry(1), MetricsRegistry(1)
+        _record_batch_metrics(batched, 0, rows)
+        for _, event_time, transaction_time, recv_ns, offset_ns in rows.tolist():
+            single.connections[0].record(recv_ns, recv_ns - (transaction_time or event_time) * 1_000_000 - offset_ns)
+        self.assertEqual(batched.snapshot()[0]["p99_us"], single.snapshot()[0]["p99_us"])
+        self.assertEqual(bytes(batched.connections[0]._current.counts), bytes(single.connections[0]._current.counts))
+
+
+class ArrivalMergerTest(unittest.TestCase):
+    def test_rows_are_offered_in_receive_time_order(self):
+        delivered = list()
+        fan_in = FirstArrivalFanIn(3, sink=lambda conn_id, data, curr_time: delivered.append(
+            (conn_id, data["u"], curr_time)))
+        merger = _ArrivalMerger(fan_in, 2)
+        # Worker 0 runs connections 0 and 2, worker 1 connection 1, which receives update 10 first.
+        merger.add(0, _rows([(11, 2, 0, 400, 0), (10, 1, 0, 200, 0)]))
+        merger.add(2, _rows([(10, 1, 0, 250, 0)]))
+        merger.advance(0, 500)
+        # Worker 1 has not reported yet, nothing is final.
+        self.assertEqual(delivered, [])
+        merger.add(1, _rows([(10, 1, 0, 150, 0), (11, 2, 0, 450, 0)]))
+        merger.advance(1, 300)
+        self.assertEqual(delivered, [(1, 10, 150)])
+        self.assertEqual(fan_in.duplicates, [1, 0, 1])
+        merger.advance(1, float("inf"))
+        self.assertEqual(delivered, [(1, 10, 150), (0, 11, 400)])
+        merger.advance(0, float("inf"))
+        self.assertEqual((fan_in.wins, fan_in.duplicates, fan_in.emitted), ([1, 1, 0], [1, 1, 1], 2))
+
+    def test_nothing_is_offered_before_the_watermark(self):
+        fan_in = FirstArrivalFanIn(1)
+        merger = _ArrivalMerger(fan_in, 1)
+        merger.add(0, _rows([(1, 1, 0, 100, 0)]))
+        merger.advance(0, 100)
+        self.assertEqual(fan_in.emitted, 0)
+        merger.advance(0, 101)
+        self.assertEqual(fan_in.emitted, 1)
+        self.assertEqual(merger._batches, [])
+
+
+class RunMWMPTest(unittest.TestCase):
+    def test_workers_are_merged(self):
+        server = MockFuturesServer(port=0, rate=100, seed=5).start_in_thread()
+        self.addCleanup(server.stop_thread)
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        root.setLevel(logging.INFO)
+        num_conn = 4
+        fan_in = FirstArrivalFanIn(num_conn)
+        sequences = [SequenceTracker(conn_id) for conn_id in range(num_conn)]
+        stages = LatencyBreakdown(num_conn)
+        with self.assertLogs("network", level=logging.INFO) as logs:
+            columns = run_MWMP("btcusdt", 3, num_conn, num_workers=2, url=server.url, flush_interval=0.1,
+                               sequences=sequences, stages=stages, fan_in=fan_in)
+        # Records of the workers are written by the main process.
+        self.assertTrue(any("Opened websocket" in line for line in logs.output))
+
+        update_ids = columns[SampleRecorder.FIELDS.index("update_id")]
+        self.assertEqual(len(update_ids), num_conn)
+        for conn_id, conn_update_ids in enumerate(update_ids):
+            self.assertGreater(len(conn_update_ids), 20)
+            # Receive threads outlive the last batch, the trackers sent after it may have seen a few more frames.
+            self.assertGreaterEqual(sequences[conn_id].messages, len(conn_update_ids))
+            self.assertGreaterEqual(stages.connections[conn_id].histograms["record"].count, len(conn_update_ids))
+        self.assertGreater(stages.probes["thread_lag"].count, 0)
+        # Every update is emitted once, each copy is either its first arrival or a duplicate.
+        self.assertEqual(fan_in.emitted, len(set().union(*update_ids)))
+        self.assertEqual(sum(fan_in.wins), fan_in.emitted)
+        self.assertEqual(fan_in.emitted + sum(fan_in.duplicates), sum(len(ids) for ids in update_ids))
+
+
+if __name__ == "__main__":
+    unittest.main()
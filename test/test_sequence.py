@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import unittest
+
+# Project modules
+from sequence import SequenceTracker
+
+
+class SequenceTrackerTest(unittest.TestCase):
+    def test_depth_chain_gap(self):
+        tracker = SequenceTracker()
+        self.assertEqual(tracker.update({"U": 1, "u": 5, "pu": 0}), SequenceTracker.OK)
+        self.assertEqual(tracker.update({"U": 6, "u": 8, "pu": 5}), SequenceTracker.OK)
+        # Events 9..11 are missing.
+        self.assertEqual(tracker.update({"U": 12, "u": 15, "pu": 11}), SequenceTracker.GAP)
+        self.assertEqual((tracker.gaps, tracker.missed, tracker.last_u), (1, 3, 15))
+        self.assertEqual(tracker.update({"U": 16, "u": 20, "pu": 15}), SequenceTracker.OK)
+
+    def test_book_ticker_skips_are_not_gaps(self):
+        tracker = SequenceTracker()
+        for u in (10, 14, 30):
+            self.assertEqual(tracker.update({"u": u}), SequenceTracker.OK)
+        self.assertEqual(tracker.gaps, 0)
+
+    def test_duplicates_and_out_of_order(self):
+        tracker = SequenceTracker()
+        tracker.update({"u": 10})
+        self.assertEqual(tracker.update({"u": 10}), SequenceTracker.DUPLICATE)
+        self.assertEqual(tracker.update({"u": 7}), SequenceTracker.OUT_OF_ORDER)
+        # Neither moves the tracker forward, so the chain continues from 10.
+        self.assertEqual(tracker.update({"U": 11, "u": 12, "pu": 10}), SequenceTracker.OK)
+        snap = tracker.snapshot()
+        self.assertEqual((snap["messages"], snap["duplicates"], snap["out_of_order"]), (4, 1, 1))
+
+    def test_merge(self):
+        tracker, other = SequenceTracker(3), SequenceTracker(3)
+        tracker.update({"u": 5})
+        tracker.update({"u": 5})
+        other.update({"U": 1, "u": 2, "pu": 0})
+        other.update({"U": 9, "u": 9, "pu": 8})
+        other.update({"u": 1})
+        tracker.merge(other)
+        self.assertEqual((tracker.last_u, tracker.messages, tracker.gaps, tracker.missed, tracker.duplicates,
+                          tracker.out_of_order), (9, 5, 1, 6, 1, 1))
+        self.assertEqual(tracker.snapshot()["gaps_per_1000"], 200.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
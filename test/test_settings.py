@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import json
+import tempfile
+import unittest
+from dataclasses import dataclass
+
+# Project modules
+from settings import CONFIG_FILE, Settings
+
+
+@dataclass(frozen=True)
+class FlagSettings(Settings):
+    publish_prices: bool = False
+
+
+class SettingsLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _config(self, **sections) -> str:
+        path = os.path.join(self.tmp.name, "config.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(sections, f)
+        return path
+
+    def test_precedence(self):
+        path = self._config(Project={"CONN_NUM": 5, "CONN_TIMEOUT": 30, "DATA_DIR": "captures"},
+                            Performance={"BATCH_SIZE": 64, "DECODER": "orjson"})
+        environ = {"BFC_CONN_NUM": "7", "BFC_BATCH_SIZE": "128", "PATH": "/usr/bin"}
+        settings = Settings.load(path, environ, overrides={"conn_num": 9, "decoder": None})
+        # Options override the environment, which overrides the config file; unset options are skipped.
+        self.assertEqual((settings.conn_num, settings.batch_size, settings.conn_timeout, settings.decoder),
+                         (9, 128, 30, "orjson"))
+        self.assertEqual(settings.data_dir, "captures")
+        self.assertEqual(settings.ring_capacity, Settings.ring_capacity)
+
+    def test_missing_config_uses_defaults(self):
+        self.assertEqual(Settings.load(os.path.join(self.tmp.name, "missing.json"), {}), Settings())
+        self.assertEqual(Settings.load(None, {}), Settings())
+
+    def test_repository_config(self):
+        settings = Settings.load(CONFIG_FILE, {})
+        self.assertEqual(settings.conn_num, 5)
+        self.assertEqual(Settings(**settings.as_dict()), settings)
+
+    def test_environment_coercion(self):
+        settings = FlagSettings.load(None, {"BFC_WORKERS": "4", "BFC_WORKER_FLUSH_INTERVAL": "0.25",
+                                            "BFC_STALL_MS": "1500", "BFC_PUBLISH_PRICES": "true",
+                                            "BFC_BINANCE_FUTURES_WS": "ws://127.0.0.1:8765/ws"})
+        self.assertEqual((settings.workers, settings.worker_flush_interval, settings.stall_ms), (4, 0.25, 1500.0))
+        self.assertIsInstance(settings.workers, int)
+        self.assertIsInstance(settings.stall_ms, float)
+        self.assertIs(settings.publish_prices, True)
+        self.assertEqual(settings.binance_futures_ws, "ws://127.0.0.1:8765/ws")
+        for value, expected in (("0", False), ("False", False), ("off", False), ("1", True), ("YES", True)):
+            self.assertIs(FlagSettings.load(None, {"BFC_PUBLISH_PRICES": value}).publish_prices, expected)
+
+    def test_invalid_values(self):
+        for environ in ({"BFC_CONN_NUM": "many"}, {"BFC_WORKER_FLUSH_INTERVAL": "fast"}, {"BFC_CONN_NUM": "0"},
+                        {"BFC_DECODER": "yaml"}):
+            with self.assertRaises(ValueError, msg=str(environ)):
+                Settings.load(None, environ)
+        with self.assertRaises(ValueError):
+            FlagSettings.load(None, {"BFC_PUBLISH_PRICES": "maybe"})
+
+    def test_unknown_keys(self):
+        with self.assertRaisesRegex(ValueError, "conn_count"):
+            Settings.load(self._config(Project={"CONN_COUNT": 5}), {})
+        with self.assertRaisesRegex(ValueError, "threads"):
+            Settings.load(None, {}, overrides={"threads": 4})
+        # Environment variables are only looked up for known settings.
+        self.assertEqual(Settings.load(None, {"BFC_THREADS": "4"}), Settings())
+
+    def test_windows_paths(self):
+        for data_dir, expected in ((".\\data", "data"), (".\\data\\MWMT", os.path.join("data", "MWMT")),
+                                   ("data/", "data")):
+            self.assertEqual(Settings.load(self._config(Project={"DATA_DIR": data_dir}), {}).data_dir, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import json
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+# Project modules
+from metrics import LogHistogram
+from stages import HANDLING, PROBES, STAGES, LatencyBreakdown, StageHistograms
+
+
+def _stages(conn_id: int, frames) -> StageHistograms:
+    histograms = StageHistograms(conn_id)
+    for frame in frames:
+        histograms.add(*frame)
+    return histograms
+
+
+class LatencyBreakdownTest(unittest.TestCase):
+    def test_summary(self):
+        breakdown = LatencyBreakdown(2)
+        # wire, decode, record, queue in nanoseconds; connection 1 decodes on receipt.
+        for frame in ((1_000_000, 20_000, 5_000, 3_000), (2_000_000, 40_000, 6_000, 1_000)):
+            breakdown.connections[0].add(*frame)
+        breakdown.connections[1].add(500_000, 10_000, 4_000)
+        breakdown.connections[1].add(700_000, -1, 4_000)
+        summary = breakdown.summary()
+        self.assertEqual({stage: summary["stages"][stage]["count"] for stage in STAGES},
+                         {"wire": 4, "queue": 2, "decode": 3, "record": 4})
+        self.assertEqual([conn["decode"]["count"] for conn in summary["connections"]], [2, 1])
+        self.assertAlmostEqual(summary["stages"]["wire"]["max_us"], 2000.0)
+        self.assertAlmostEqual(summary["stages"]["queue"]["max_us"], 3.0)
+        self.assertLessEqual(abs(summary["stages"]["record"]["p50_us"] - 4.0), 4.0 * 2 ** -6)
+        # Handling is the total of the stages after receipt of every frame: 28, 47, 14 and 4 us.
+        self.assertEqual(summary["stages"][HANDLING]["count"], 4)
+        self.assertAlmostEqual(summary["stages"][HANDLING]["max_us"], 47.0)
+        self.assertLessEqual(abs(summary["stages"][HANDLING]["p50_us"] - 14.0), 14.0 * 2 ** -6)
+        for name in STAGES + PROBES:
+            buckets = summary["histograms"][name]
+            self.assertEqual(sum(buckets["count"]), summary["stages"][name]["count"] if name in STAGES else 0)
+        self.assertEqual(summary["probes"]["loop_lag"]["count"], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stages.json")
+            breakdown.save(path, summary)
+            with open(path, "r", encoding="utf-8") as f:
+                self.assertEqual(json.load(f), json.loads(json.dumps(summary)))
+
+    def test_merge_connections(self):
+        breakdown = LatencyBreakdown(3)
+        breakdown.connections[2].add(1_000, 100, 10)
+        # Shards of a worker process, pickled as they are sent through its pipe.
+        shard = pickle.loads(pickle.dumps([_stages(0, [(2_000, 200, 20, 5)] * 3),
+                                           _stages(2, [(3_000, 300, 30)] * 2)]))
+        breakdown.merge_connections(shard)
+        counts = [{stage: conn.histograms[stage].count for stage in STAGES} for conn in breakdown.connections]
+        self.assertEqual(counts, [{"wire": 3, "queue": 3, "decode": 3, "record": 3},
+                                  {"wire": 0, "queue": 0, "decode": 0, "record": 0},
+                                  {"wire": 3, "queue": 0, "decode": 3, "record": 3}])
+        self.assertEqual(breakdown.connections[2].histograms["wire"].max, 3_000)
+        self.assertEqual(breakdown.summary()["stages"]["record"]["count"], 6)
+
+    def test_detach(self):
+        breakdown = LatencyBreakdown(2)
+        receiving = breakdown.connections[0]
+        receiving.add(1_000, 100, 10)
+        breakdown.detach()
+        # A thread that outlives the run keeps recording into the histograms it was given.
+        receiving.add(2_000, 200, 20)
+        self.assertEqual(receiving.histograms["record"].count, 2)
+        self.assertEqual(breakdown.summary()["stages"]["record"]["count"], 1)
+        self.assertEqual(breakdown.summary()["stages"][HANDLING]["max_us"], 0.11)
+
+    def test_merge_probes(self):
+        breakdown = LatencyBreakdown(1)
+        breakdown.probes["thread_lag"].record(50_000)
+        workers = list()
+        for lag_ns in (10_000, 90_000):
+            worker = LatencyBreakdown(0)
+            for _ in range(4):
+                worker.probes["thread_lag"].record(lag_ns)
+            workers.append({"thread_lag": pickle.loads(pickle.dumps(worker.probes["thread_lag"]))})
+        for probes in workers:
+            breakdown.merge_probes(probes)
+        thread_lag = breakdown.probes["thread_lag"]
+        self.assertEqual((thread_lag.count, thread_lag.max), (9, 90_000))
+        self.assertEqual(breakdown.probes["loop_lag"].count, 0)
+        self.assertEqual(breakdown.summary()["probes"]["thread_lag"]["count"], 9)
+
+    def test_thread_probe(self):
+        breakdown = LatencyBreakdown(0, probe_interval=0.001).start()
+        try:
+            while breakdown.probes["thread_lag"].count < 3:
+                time.sleep(0.001)
+        finally:
+            breakdown.stop()
+        self.assertIsInstance(breakdown.probes["thread_lag"], LogHistogram)
+        self.assertGreaterEqual(breakdown.summary()["probes"]["thread_lag"]["count"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import re
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time of main in microseconds; typically around 0.1 s, the backends used to add about a second.
+STARTUP_BUDGET_US = 500_000
+# Loaded only by the backend, saving or analysis which needs them.
+LAZY_MODULES = ("pandas", "numpy", "binance", "aiohttp", "websockets", "websocket", "requests", "scipy")
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True,
+                          check=True)
+
+
+class StartupTest(unittest.TestCase):
+    def test_import_time_budget(self):
+        profile = _run("import main").stderr
+        cumulative = {name.strip(): int(total) for total, name in
+                      re.findall(r"^import time:\s+\d+ \|\s+(\d+) \|(.*)$", profile, re.MULTILINE)}
+        self.assertIn("main", cumulative)
+        self.assertLess(cumulative["main"], STARTUP_BUDGET_US,
+                        f"Importing main took {cumulative['main']} us, slowest imports:\n" +
+                        "\n".join(f"{name}: {total} us" for name, total in
+                                  sorted(cumulative.items(), key=lambda item: -item[1])[:10]))
+
+    def test_backends_are_lazy(self):
+        loaded = _run(f"import sys, main, runner, network\n"
+                      f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))").stdout.strip()
+        self.assertEqual(loaded, "", f"Eagerly imported: {loaded}")
+
+
+if __name__ == "__main__":
+    unittest.main()
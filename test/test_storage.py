@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import os
+import tempfile
+import unittest
+
+# Third-party modules
+import numpy as np
+import pandas as pd
+
+# Project modules
+from recorder import SampleRecorder
+from storage import (CAPTURE_DTYPES, CAPTURE_HEADER, CAPTURE_MAGIC, CAPTURE_FILE, ChunkedCaptureWriter,
+                     convert_pickles, open_capture, read_chunks, samples_frame)
+
+
+def _rows(conn_id: int, num_rows: int):
+    return [(1000 * conn_id + i, 1_700_000_000_000 + i, 1_700_000_000_000 + i - 1,
+             1_700_000_000_005_000_000 + i * 1_000_000 + conn_id, 1_000 * conn_id - 500) for i in range(num_rows)]
+
+
+def _recorders(num_conn: int, num_rows: int):
+    recorders = [SampleRecorder() for _ in range(num_conn)]
+    for conn_id, recorder in enumerate(recorders):
+        for row in _rows(conn_id, num_rows):
+            recorder.append(row)
+    return recorders
+
+
+class StorageRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_chunk_files(self):
+        writer = ChunkedCaptureWriter(self.tmp.name, chunk_rows=4, flush_interval=0.01)
+        recorders = _recorders(3, 10)
+        writer.start(recorders)
+        writer.stop()
+        self.assertEqual(writer.rows_written, [10, 10, 10])
+        frames = read_chunks(self.tmp.name)
+        self.assertEqual(len(frames), 3)
+        for conn_id, df in enumerate(frames):
+            self.assertEqual([tuple(row) for row in df[list(SampleRecorder.FIELDS)].itertuples(index=False)],
+                             _rows(conn_id, 10))
+
+    def test_capture_file(self):
+        writer = ChunkedCaptureWriter(self.tmp.name, chunk_rows=4, single_file=True)
+        writer.start(_recorders(2, 7))
+        writer.stop()
+        records = open_capture(os.path.join(self.tmp.name, CAPTURE_FILE))
+        self.assertEqual(records.dtype, CAPTURE_DTYPES[2])
+        for conn_id in range(2):
+            conn = records[records["conn_id"] == conn_id]
+            self.assertEqual([tuple(int(conn[field][i]) for field in SampleRecorder.FIELDS) for i in range(len(conn))],
+                             _rows(conn_id, 7))
+
+    def test_version_1_capture_file(self):
+        dtype = CAPTURE_DTYPES[1]
+        records = np.zeros(5, dtype=dtype)
+        records["conn_id"] = [0, 1, 0, 1, 0]
+        records["update_id"] = np.arange(5)
+        records["event_time"] = 1_700_000_000_000 + np.arange(5)
+        records["client_time_ns"] = 1_700_000_000_001_000_000 + np.arange(5)
+        path = os.path.join(self.tmp.name, CAPTURE_FILE)
+        with open(path, "wb") as f:
+            f.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, 1, CAPTURE_HEADER.size, dtype.itemsize, 2))
+            records.tofile(f)
+        read = open_capture(path)
+        self.assertEqual(read.dtype, dtype)
+        np.testing.assert_array_equal(read, records)
+
+    def test_converted_pickles(self):
+        for conn_id in range(2):
+            samples_frame(tuple(zip(*_rows(conn_id, 6)))).to_pickle(os.path.join(self.tmp.name,
+                                                                              f"connection_{conn_id}.pkl"))
+        path = os.path.join(self.tmp.name, CAPTURE_FILE)
+        self.assertEqual(convert_pickles(self.tmp.name, path), 12)
+        records = open_capture(path)
+        for conn_id in range(2):
+            conn = records[records["conn_id"] == conn_id]
+            self.assertEqual([tuple(int(conn[field][i]) for field in SampleRecorder.FIELDS) for i in range(len(conn))],
+                             _rows(conn_id, 6))
+
+    def test_converted_legacy_pickles(self):
+        pd.DataFrame({"update_id": [1, 2, 3], "client_timestamps": [1_700_000_000_010, 1_700_000_000_020,
+                                                                    1_700_000_000_030],
+                      "delay": [10, 15, 20]}).to_pickle(os.path.join(self.tmp.name, "connection_0.pkl"))
+        path = os.path.join(self.tmp.name, CAPTURE_FILE)
+        self.assertEqual(convert_pickles(self.tmp.name, path), 3)
+        records = open_capture(path)
+        self.assertEqual(records["update_id"].tolist(), [1, 2, 3])
+        self.assertEqual(records["event_time"].tolist(), [1_700_000_000_000, 1_700_000_000_005, 1_700_000_000_010])
+        self.assertEqual(records["client_time_ns"].tolist(), [1_700_000_000_010_000_000, 1_700_000_000_020_000_000,
+                                                              1_700_000_000_030_000_000])
+
+    def test_converted_historical_pickles(self):
+        pd.DataFrame({"update_id": [1, 2], "client_timestamp": [1_700_000_000_010.75, 1_700_000_000_020.25],
+                      "delay": [10.5, 15.0]}).to_pickle(os.path.join(self.tmp.name, "connection_0.pkl"))
+        path = os.path.join(self.tmp.name, CAPTURE_FILE)
+        self.assertEqual(convert_pickles(self.tmp.name, path), 2)
+        records = open_capture(path)
+        self.assertEqual(records["event_time"].tolist(), [1_700_000_000_000, 1_700_000_000_005])
+        self.assertEqual(records["client_time_ns"].tolist(), [1_700_000_000_010_750_000, 1_700_000_000_020_250_000])
+
+
+if __name__ == "__main__":
+    unittest.main()
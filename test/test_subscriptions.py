@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import asyncio
+import unittest
+
+# Project modules
+from codec import decode_json
+from fanin import FirstArrivalFanIn
+from mock_server import MockFuturesServer
+from network import AsyncWSv2
+from subscriptions import StreamRouter, combined_url, raw_url
+
+FRAME = '{"stream":"btcusdt@bookTicker","data":{"e":"bookTicker","u":7,"E":1700000000000,"T":1700000000000}}'
+
+
+class StreamRouterTest(unittest.TestCase):
+    def test_decoder_routes_by_prefix(self):
+        frames, routed = list(), list()
+
+        def loads(frame):
+            frames.append(frame)
+            return {"id": 1, "result": None}
+
+        router = StreamRouter(loads, decoder=decode_json)
+        router.add("btcusdt@bookTicker", lambda data, recv_ns: routed.append((data["u"], recv_ns)))
+        self.assertTrue(router.dispatch(FRAME, 5))
+        self.assertEqual(routed, [(7, 5)])
+        # Routed frames are only decoded, replies only parsed.
+        self.assertEqual(frames, [])
+        self.assertFalse(router.dispatch('{"result":null,"id":1}', 6))
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(router.unrouted, 0)
+
+    def test_unrouted_streams(self):
+        router = StreamRouter()
+        router.add("ethusdt@bookTicker", lambda data, recv_ns: None)
+        self.assertFalse(router.dispatch(FRAME, 0))
+        self.assertEqual(router.unrouted, 1)
+
+
+class EndpointTest(unittest.TestCase):
+    def test_endpoints(self):
+        for url in ("wss://fstream.binance.com/ws", "wss://fstream.binance.com/stream/", "wss://fstream.binance.com"):
+            self.assertEqual(combined_url(url), "wss://fstream.binance.com/stream")
+            self.assertEqual(raw_url(url), "wss://fstream.binance.com/ws")
+
+
+class AsyncWSv2Test(unittest.TestCase):
+    def setUp(self):
+        self.server = MockFuturesServer(port=0, rate=200, seed=3).start_in_thread()
+        self.addCleanup(self.server.stop_thread)
+
+    def _run(self, socket: AsyncWSv2) -> None:
+        async def run():
+            try:
+                await asyncio.wait_for(socket.run(), timeout=1.0)
+            except TimeoutError:
+                pass
+
+        asyncio.run(run())
+
+    def test_shared_stream_is_recorded_by_every_subscriber(self):
+        socket = AsyncWSv2(self.server.url, "btcusdt", 0, streams=["btcusdt@bookTicker", "btcusdt@bookTicker",
+                                                                   "btcusdt@depth@100ms"])
+        self._run(socket)
+        self.assertEqual(socket.manager.plan, [["btcusdt@bookTicker", "btcusdt@depth@100ms"]])
+        # Combined payloads are negotiated on the raw endpoint, raw frames would not be routed.
+        self.assertEqual(socket.manager.url, self.server.url)
+        update_ids = socket.get_data()[0]
+        self.assertGreater(len(update_ids[0]), 50)
+        self.assertEqual(update_ids[0], update_ids[1])
+        self.assertEqual(socket.router.unrouted, 0)
+
+    def test_frames_are_offered_to_the_fan_in_once(self):
+        fan_in = FirstArrivalFanIn(3)
+        socket = AsyncWSv2(self.server.url, "btcusdt", 3, fan_in)
+        self._run(socket)
+        update_ids = socket.get_data()[0]
+        self.assertEqual(update_ids[0], update_ids[2])
+        self.assertGreater(fan_in.emitted, 50)
+        self.assertEqual((fan_in.wins, fan_in.duplicates), ([fan_in.emitted, 0, 0], [0, 0, 0]))
+        self.assertEqual(fan_in.emitted, len(update_ids[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# Standard modules
+import asyncio
+import unittest
+from unittest import mock
+
+# Project modules
+from supervisor import ConnectionSupervisor
+
+MS = 1_000_000
+
+
+class FakeClock:
+    def __init__(self, now: int = 1_000_000 * MS):
+        self.now = now
+
+    def __call__(self) -> int:
+        return self.now
+
+
+class SupervisorCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("supervisor.now_ns", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.restarted = list()
+
+    def _supervisor(self, num_conn: int, **kwargs) -> ConnectionSupervisor:
+        supervisor = ConnectionSupervisor(num_conn, **kwargs)
+        # Sessions started a minute ago, as run_blocking and run_async would register them.
+        for conn_id in range(num_conn):
+            supervisor._restart_hooks[conn_id] = lambda conn_id=conn_id: self.restarted.append(conn_id)
+            supervisor._active[conn_id] = True
+            supervisor._session_start[conn_id] = self.clock.now - 60_000 * MS
+        return supervisor
+
+    def _beat(self, supervisor: ConnectionSupervisor, conn_id: int, update_id: int, delay_ms: float = 1.0) -> None:
+        supervisor.heartbeat(conn_id, self.clock.now, update_id, int(delay_ms * MS))
+
+    def test_healthy_connections_are_kept(self):
+        supervisor = self._supervisor(3, stall_ms=1000, lag_ms=500)
+        for update_id in range(1, 20):
+            for conn_id in range(3):
+                self._beat(supervisor, conn_id, update_id)
+            supervisor.check()
+            self.clock.now += 100 * MS
+        self.assertEqual(self.restarted, [])
+        self.assertEqual(supervisor.restarts, [0, 0, 0])
+
+    def test_stalled_connection_is_restarted_once(self):
+        supervisor = self._supervisor(2, stall_ms=1000, lag_ms=10_000)
+        self._beat(supervisor, 0, 1)
+        self._beat(supervisor, 1, 1)
+        self.clock.now += 900 * MS
+        self._beat(supervisor, 0, 2)
+        supervisor.check()
+        self.assertEqual(self.restarted, [])
+        self.clock.now += 200 * MS
+        supervisor.check()
+        self.assertEqual(self.restarted, [1])
+        # The restart counts as a new session start, the connection gets time to reconnect.
+        self.clock.now += 500 * MS
+        self._beat(supervisor, 0, 3)
+        supervisor.check()
+        self.assertEqual(supervisor.restarts, [0, 1])
+
+    def test_lagging_connection_is_restarted(self):
+        supervisor = self._supervisor(3, stall_ms=60_000, lag_ms=500)
+        # Peers pass update id 5 at step 5, 500 ms later connection 2 still misses it.
+        for step in range(11):
+            for conn_id in range(3):
+                # Connection 2 keeps sending frames, but stays at update id 5.
+                self._beat(supervisor, conn_id, min(step + 1, 5) if conn_id == 2 else step + 1)
+            supervisor.check()
+            self.clock.now += 100 * MS
+        self.assertEqual(self.restarted, [2])
+
+    def test_single_connection_never_lags(self):
+        supervisor = self._supervisor(1, stall_ms=60_000, lag_ms=100)
+        for _ in range(10):
+            self._beat(supervisor, 0, 1)
+            supervisor.check()
+            self.clock.now += 100 * MS
+        self.assertEqual(self.restarted, [])
+
+    def test_inactive_and_restarting_connections_are_skipped(self):
+        supervisor = self._supervisor(2, stall_ms=1000)
+        supervisor._active[0] = False
+        supervisor._restarting[1] = True
+        self.clock.now += 5000 * MS
+        supervisor.check()
+        self.assertEqual(self.restarted, [])
+
+    def test_slowest_connection_is_replaced(self):
+        supervisor = self._supervisor(4, stall_ms=60_000, lag_ms=60_000, replace_interval_s=10,
+                                      replace_margin_ms=1.0)
+        supervisor._last_replace = self.clock.now
+        for update_id in range(1, 11):
+            for conn_id, delay_ms in enumerate((2.0, 2.2, 5.0, 2.1)):
+                self._beat(supervisor, conn_id, update_id, delay_ms)
+        self.clock.now += 5000 * MS
+        supervisor.check()
+        self.assertEqual(self.restarted, [])
+        self.clock.now += 5000 * MS
+        supervisor.check()
+        self.assertEqual(self.restarted, [2])
+        # Mean delays restart from scratch after every replacement round.
+        self.assertEqual(supervisor._delay_count, [0, 0, 0, 0])
+
+    def test_replace_slowest_keeps_close_or_few_connections(self):
+        supervisor = self._supervisor(4, replace_margin_ms=1.0)
+        for conn_id, delay_ms in enumerate((2.0, 2.2, 2.9, 2.1)):
+            self._beat(supervisor, conn_id, 1, delay_ms)
+        supervisor._replace_slowest([0, 1, 2, 3])
+        self.assertEqual(self.restarted, [])
+        # Two connections with samples are not enough to tell the slowest one.
+        self._beat(supervisor, 0, 2, 1.0)
+        self._beat(supervisor, 1, 2, 50.0)
+        supervisor._replace_slowest([0, 1, 2, 3])
+        self.assertEqual(self.restarted, [])
+
+
+class SupervisorReconnectTest(unittest.TestCase):
+    def test_backoff(self):
+        supervisor = ConnectionSupervisor(1, backoff_base_s=0.5, backoff_max_s=4.0)
+        with mock.patch("supervisor.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([supervisor.backoff(attempt) for attempt in range(1, 7)],
+                             [0.5, 1.0, 2.0, 4.0, 4.0, 4.0])
+        with mock.patch("supervisor.random.uniform", side_effect=lambda low, high: low):
+            self.assertEqual(supervisor.backoff(3), 1.0)
+
+    def test_failed_sessions_back_off_until_frames_arrive(self):
+        clock = FakeClock()
+        supervisor = ConnectionSupervisor(1, backoff_base_s=0.5, backoff_max_s=30.0)
+        sessions = list()
+
+        def run():
+            sessions.append(clock.now)
+            clock.now += MS
+            if len(sessions) == 3:
+                # The third session delivers frames, so the fourth one starts without backoff.
+                supervisor.heartbeat(0, clock.now, 1, MS)
+            if len(sessions) == 4:
+                supervisor.stopped = True
+            raise ConnectionError("connection refused")
+
+        with mock.patch("supervisor.now_ns", clock), \
+                mock.patch("supervisor.random.uniform", side_effect=lambda low, high: high), \
+                mock.patch("supervisor.time.sleep") as sleep:
+            supervisor.run_blocking(0, run, lambda: None)
+        self.assertEqual(len(sessions), 4)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0, 1.0, 0])
+        self.assertEqual(supervisor.reconnects, [3])
+
+
+
+class SupervisorRunAsyncTest(unittest.TestCase):
+    def test_restarted_session_reconnects(self):
+        supervisor = ConnectionSupervisor(1)
+        sessions = list()
+
+        async def session():
+            sessions.append(len(sessions))
+            if len(sessions) == 3:
+                supervisor.stop()
+            await asyncio.Future()
+
+        async def run():
+            runner = asyncio.ensure_future(supervisor.run_async(0, session))
+            for _ in range(2):
+                await asyncio.sleep(0.01)
+                supervisor.restart(0, "test")
+            await asyncio.wait_for(runner, 1.0)
+
+        asyncio.run(run())
+        self.assertEqual((sessions, supervisor.restarts, supervisor.reconnects), ([0, 1, 2], [2], [2]))
+
+    def test_cancellation_of_the_runner_is_raised(self):
+        supervisor = ConnectionSupervisor(1)
+        ended = list()
+
+        async def session():
+            try:
+                await asyncio.Future()
+            finally:
+                ended.append(True)
+
+        async def run():
+            runner = asyncio.ensure_future(supervisor.run_async(0, session))
+            await asyncio.sleep(0.01)
+            # The runner times out while the supervisor restarts the connection.
+            supervisor._restarting[0] = True
+            runner.cancel()
+            await asyncio.wait((runner,), timeout=1.0)
+            # Ends a runner which swallowed its cancellation and reconnected.
+            supervisor.stop()
+            self.assertTrue(runner.cancelled())
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        self.assertEqual((ended, supervisor.reconnects), ([True], [0]))
+
+
+if __name__ == "__main__":
+    unittest.main()